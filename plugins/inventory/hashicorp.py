@@ -0,0 +1,237 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+DOCUMENTATION = r"""
+name: hashicorp
+short_description: nomad clients and consul service instances as inventory
+description:
+  - Adds the nomad client nodes and the nodes of consul services as hosts.
+  - Nomad nodes are grouped by node pool, datacenter and node class. Consul nodes
+    are grouped by the services they run and the tags of those services.
+  - Nodes and services are fetched in bulk (nomad nodes page by page), the result
+    can be kept in the inventory cache.
+  - The config file must end with C(hashicorp.yml) or C(hashicorp.yaml).
+extends_documentation_fragment:
+  - constructed
+  - inventory_cache
+options:
+  plugin:
+    description: token that ensures this is a source file for this plugin.
+    required: true
+    choices: ["hashicorp", "gbolo.hashicorp.hashicorp"]
+  nomad_url:
+    description: url of the nomad API, nomad nodes are not added without it.
+    type: str
+    env:
+      - name: NOMAD_ADDR
+  nomad_token:
+    description: nomad ACL token with node:read.
+    type: str
+    env:
+      - name: NOMAD_TOKEN
+  nomad_node_filter:
+    description: nomad filter expression the nodes must match, ie. C(Status == "ready").
+    type: str
+  consul_url:
+    description: url of the consul API, consul services are not added without it.
+    type: str
+    env:
+      - name: CONSUL_HTTP_ADDR
+  consul_token:
+    description: consul ACL token with node:read and service:read.
+    type: str
+    env:
+      - name: CONSUL_HTTP_TOKEN
+  consul_services:
+    description: names of the consul services to add, all of them by default.
+    type: list
+    elements: str
+  consul_consistency:
+    description: consistency mode of the consul reads, any server may answer stale reads.
+    type: str
+    choices: ["default", "stale", "consistent", "cached"]
+    default: stale
+  validate_certs:
+    description: verify the TLS certificates of the APIs.
+    type: bool
+    default: true
+  connection_timeout:
+    description: seconds to wait for a response of the APIs.
+    type: int
+    default: 10
+  max_concurrency:
+    description: max number of consul services that are fetched at the same time.
+    type: int
+    default: 4
+"""
+
+EXAMPLES = r"""
+# hashicorp.yml
+plugin: hashicorp
+nomad_url: https://nomad.service.consul:4646
+consul_url: https://consul.service.consul:8501
+nomad_node_filter: Status == "ready"
+cache: true
+cache_plugin: jsonfile
+cache_connection: ~/.ansible/tmp/hashicorp-inventory
+cache_timeout: 300
+keyed_groups:
+  - key: nomad_node_pool
+    prefix: pool
+"""
+
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, Constructable
+
+from ..module_utils.consul import ConsulAPI
+from ..module_utils.nomad import NomadAPI
+from ..module_utils.utils import run_concurrently
+from ..plugin_utils.api import ModuleShim, api_params
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+    NAME = "hashicorp"
+
+    def verify_file(self, path):
+        return super(InventoryModule, self).verify_file(path) and path.endswith(("hashicorp.yml", "hashicorp.yaml"))
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path, cache)
+        self._read_config_data(path)
+
+        # the cache is read unless the inventory is refreshed, and written when it was not used
+        cache_key = self.get_cache_key(path)
+        use_cache = self.get_option("cache") and cache
+        update_cache = self.get_option("cache") and not cache
+        data = None
+        if use_cache:
+            try:
+                data = self._cache[cache_key]
+            except KeyError:
+                update_cache = True
+        if data is None:
+            data = self.fetch()
+        if update_cache:
+            self._cache[cache_key] = data
+
+        self.populate(data)
+
+    def _shim(self, url, token):
+        params = api_params(url, token, self.get_option("validate_certs"), self.get_option("connection_timeout"))
+        return ModuleShim("hashicorp_inventory", params, self.display)
+
+    def fetch(self):
+        """returns the nomad nodes and the consul nodes and services, trimmed to what the inventory needs"""
+        data = dict(nomad_nodes=[], consul_nodes=[], consul_services={})
+
+        if self.get_option("nomad_url"):
+            nomad = NomadAPI(self._shim(self.get_option("nomad_url"), self.get_option("nomad_token")))
+            for node in nomad.iter_nodes(filter_expr=self.get_option("nomad_node_filter")):
+                data["nomad_nodes"].append(
+                    dict(
+                        (key, node.get(key))
+                        for key in (
+                            "ID",
+                            "Name",
+                            "Address",
+                            "Datacenter",
+                            "NodePool",
+                            "NodeClass",
+                            "Status",
+                            "Drain",
+                            "SchedulingEligibility",
+                            "Version",
+                        )
+                    )
+                )
+
+        if self.get_option("consul_url"):
+            consul = ConsulAPI(self._shim(self.get_option("consul_url"), self.get_option("consul_token")))
+            consistency = self.get_option("consul_consistency")
+            for node in consul.get_catalog_nodes(consistency=consistency) or []:
+                data["consul_nodes"].append(
+                    dict((key, node.get(key)) for key in ("ID", "Node", "Address", "Datacenter", "Meta"))
+                )
+
+            names = self.get_option("consul_services")
+            if names is None:
+                names = sorted(consul.get_catalog_services(consistency=consistency) or {})
+
+            # the catalog has no bulk listing of service instances, fetch the services side by side
+            def instances(name):
+                return [
+                    dict(
+                        node=instance.get("Node"),
+                        id=instance.get("ServiceID"),
+                        address=instance.get("ServiceAddress") or instance.get("Address"),
+                        port=instance.get("ServicePort"),
+                        tags=instance.get("ServiceTags") or [],
+                    )
+                    for instance in consul.get_service(name, consistency=consistency) or []
+                ]
+
+            for name, service in zip(names, run_concurrently(instances, names, self.get_option("max_concurrency"))):
+                data["consul_services"][name] = service
+
+        return data
+
+    def populate(self, data):
+        strict = self.get_option("strict")
+        hosts = []
+
+        def add_group(name, host):
+            group = self.inventory.add_group(self._sanitize_group_name(name))
+            self.inventory.add_child(group, host)
+
+        for node in data["nomad_nodes"]:
+            host = self.inventory.add_host(node["Name"])
+            hosts.append(host)
+            self.inventory.set_variable(host, "ansible_host", node["Address"])
+            self.inventory.set_variable(host, "nomad_node_id", node["ID"])
+            self.inventory.set_variable(host, "nomad_datacenter", node["Datacenter"])
+            self.inventory.set_variable(host, "nomad_node_pool", node["NodePool"])
+            self.inventory.set_variable(host, "nomad_node_class", node["NodeClass"])
+            self.inventory.set_variable(host, "nomad_status", node["Status"])
+            self.inventory.set_variable(host, "nomad_drain", node["Drain"])
+            self.inventory.set_variable(host, "nomad_eligibility", node["SchedulingEligibility"])
+            self.inventory.set_variable(host, "nomad_version", node["Version"])
+            add_group("nomad_clients", host)
+            add_group("nomad_dc_%s" % node["Datacenter"], host)
+            if node["NodePool"]:
+                add_group("nomad_pool_%s" % node["NodePool"], host)
+            if node["NodeClass"]:
+                add_group("nomad_class_%s" % node["NodeClass"], host)
+
+        # only the consul nodes that run one of the services are added
+        services_by_node = {}
+        for name, instances in data["consul_services"].items():
+            for instance in instances:
+                services_by_node.setdefault(instance["node"], {}).setdefault(name, []).append(instance)
+        for node in data["consul_nodes"]:
+            services = services_by_node.get(node["Node"])
+            if not services:
+                continue
+            host = self.inventory.add_host(node["Node"])
+            if host not in hosts:
+                hosts.append(host)
+            # nomad nodes keep the address nomad reports
+            if "ansible_host" not in self.inventory.get_host(host).vars:
+                self.inventory.set_variable(host, "ansible_host", node["Address"])
+            self.inventory.set_variable(host, "consul_node_id", node["ID"])
+            self.inventory.set_variable(host, "consul_datacenter", node["Datacenter"])
+            self.inventory.set_variable(host, "consul_node_meta", node["Meta"] or {})
+            self.inventory.set_variable(host, "consul_services", services)
+            for name, instances in services.items():
+                add_group("consul_service_%s" % name, host)
+                for tag in set(tag for instance in instances for tag in instance["tags"]):
+                    add_group("consul_tag_%s" % tag, host)
+
+        # constructed groups and variables, from the host variables set above
+        for host in hosts:
+            hostvars = self.inventory.get_host(host).get_vars()
+            self._set_composite_vars(self.get_option("compose"), hostvars, host, strict=strict)
+            self._add_host_to_composed_groups(self.get_option("groups"), hostvars, host, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option("keyed_groups"), hostvars, host, strict=strict)
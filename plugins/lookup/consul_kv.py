@@ -0,0 +1,191 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+DOCUMENTATION = r"""
+name: consul_kv
+short_description: read values from the consul KV store
+description:
+  - Returns the values of the given consul keys, in the same order.
+  - Keys that share a folder are read with a single recursive request once there are
+    at least O(batch_threshold) of them, counting the keys read before. With O(prefix),
+    everything under the prefix is read with one request.
+  - Keys read are kept in memory by the process that renders the task, so looking up
+    many keys from a template sends a handful of requests. Values are only decoded
+    when they are returned.
+options:
+  _terms:
+    description: the keys to read, relative to O(prefix) if it is set.
+    required: true
+  url:
+    description: url of the consul API.
+    type: str
+    required: true
+    env:
+      - name: CONSUL_HTTP_ADDR
+  token:
+    description: consul ACL token with key:read.
+    type: str
+    env:
+      - name: CONSUL_HTTP_TOKEN
+  datacenter:
+    description: datacenter to read from, the one of the agent by default.
+    type: str
+  prefix:
+    description: reads every key under this prefix with one request.
+    type: str
+  batch_threshold:
+    description: number of keys in a folder from which on the whole folder is read, 0 reads every key on its own.
+    type: int
+    default: 3
+  consistency:
+    description: consistency mode of the reads, any server may answer stale reads.
+    type: str
+    choices: ["default", "stale", "consistent"]
+    default: default
+  default:
+    description: value returned for keys that do not exist.
+    type: raw
+  validate_certs:
+    description: verify the TLS certificate of the API.
+    type: bool
+    default: true
+  connection_timeout:
+    description: seconds to wait for a response of the API.
+    type: int
+    default: 10
+  max_concurrency:
+    description: max number of requests that are sent at the same time.
+    type: int
+    default: 4
+"""
+
+EXAMPLES = r"""
+- name: read a single key
+  ansible.builtin.debug:
+    msg: "{{ lookup('consul_kv', 'config/app/log_level') }}"
+
+- name: read the whole app config with one request
+  ansible.builtin.template:
+    src: app.conf.j2
+    dest: /etc/app.conf
+  vars:
+    # app.conf.j2 uses ie. {{ lookup('consul_kv', 'db/host', prefix=app_prefix) }}
+    app_prefix: config/app/
+"""
+
+RETURN = r"""
+_raw:
+  description: the values of the keys, O(default) for keys that do not exist.
+  type: list
+"""
+
+import base64
+
+from ansible.module_utils.common.text.converters import to_text
+from ansible.plugins.lookup import LookupBase
+from ansible.utils.display import Display
+
+from ..module_utils.consul import ConsulAPI
+from ..module_utils.utils import run_concurrently
+from ..plugin_utils.api import ModuleShim, api_params
+
+display = Display()
+
+# the stores of the keys read so far, per consul datacenter and token
+_memo = {}
+
+
+class KVStore(object):
+    """KVStore keeps the entries read from one consul datacenter, values are decoded on first use"""
+
+    def __init__(self):
+        self.entries = {}
+        self.missing = set()
+        # prefixes that were read recursively, keys under them are known
+        self.prefixes = set()
+        # number of keys of a folder that were read on their own
+        self.reads = {}
+        self.values = {}
+
+    def known(self, key):
+        return key in self.entries or key in self.missing or any(key.startswith(p) for p in self.prefixes)
+
+    def plan(self, keys, prefix=None, threshold=0):
+        """returns the (key, recurse) reads needed to know all the keys"""
+        pending = sorted(set(key for key in keys if not self.known(key)))
+        if not pending:
+            return []
+        if prefix:
+            return [(prefix, True)]
+        folders = {}
+        for key in pending:
+            folders.setdefault(key[: key.rfind("/") + 1], []).append(key)
+        reads = []
+        for folder, folder_keys in sorted(folders.items()):
+            # never read the whole store
+            if folder and threshold and len(folder_keys) + self.reads.get(folder, 0) >= threshold:
+                reads.append((folder, True))
+            else:
+                reads.extend((key, False) for key in folder_keys)
+        return reads
+
+    def add(self, key, recurse, entries):
+        if recurse:
+            self.prefixes.add(key)
+        else:
+            folder = key[: key.rfind("/") + 1]
+            self.reads[folder] = self.reads.get(folder, 0) + 1
+            if not entries:
+                self.missing.add(key)
+        for entry in entries or []:
+            self.entries[entry["Key"]] = entry
+
+    def value(self, key, default=None):
+        if key in self.values:
+            return self.values[key]
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        # keys without a value have a null Value
+        self.values[key] = to_text(base64.b64decode(entry.get("Value") or ""))
+        return self.values[key]
+
+
+class LookupModule(LookupBase):
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+        url = self.get_option("url")
+        token = self.get_option("token")
+        datacenter = self.get_option("datacenter")
+        consistency = self.get_option("consistency")
+
+        prefix = self.get_option("prefix")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        keys = [(prefix or "") + term for term in terms]
+
+        store = _memo.setdefault((url, token, datacenter, consistency), KVStore())
+        reads = store.plan(keys, prefix, self.get_option("batch_threshold"))
+        if reads:
+            consul = ConsulAPI(
+                ModuleShim(
+                    "consul_kv",
+                    api_params(url, token, self.get_option("validate_certs"), self.get_option("connection_timeout")),
+                    display,
+                )
+            )
+
+            def read(item):
+                key, recurse = item
+                return consul.get_kv(key, recurse=recurse, params=dict(dc=datacenter), consistency=consistency)
+
+            for (key, recurse), entries in zip(
+                reads, run_concurrently(read, reads, self.get_option("max_concurrency"))
+            ):
+                store.add(key, recurse, entries)
+
+        return [store.value(key, self.get_option("default")) for key in keys]
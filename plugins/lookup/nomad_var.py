@@ -0,0 +1,125 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+DOCUMENTATION = r"""
+name: nomad_var
+short_description: read nomad variables
+description:
+  - Returns the items of the given nomad variables, in the same order. With O(item),
+    the value of that item is returned instead.
+  - Every variable is read once, no matter how many terms or items refer to it. The
+    variables are read side by side.
+  - Variables read are kept in memory by the process that renders the task, so looking
+    up many items from a template sends one request per variable.
+options:
+  _terms:
+    description: the paths of the variables to read.
+    required: true
+  url:
+    description: url of the nomad API.
+    type: str
+    required: true
+    env:
+      - name: NOMAD_ADDR
+  token:
+    description: nomad ACL token that can read the variables.
+    type: str
+    env:
+      - name: NOMAD_TOKEN
+  namespace:
+    description: namespace of the variables.
+    type: str
+    default: default
+  item:
+    description: name of the item to return instead of all the items.
+    type: str
+  default:
+    description: value returned for variables (or items) that do not exist.
+    type: raw
+  validate_certs:
+    description: verify the TLS certificate of the API.
+    type: bool
+    default: true
+  connection_timeout:
+    description: seconds to wait for a response of the API.
+    type: int
+    default: 10
+  max_concurrency:
+    description: max number of requests that are sent at the same time.
+    type: int
+    default: 4
+"""
+
+EXAMPLES = r"""
+- name: read all the items of a variable
+  ansible.builtin.debug:
+    msg: "{{ lookup('nomad_var', 'nomad/jobs/web') }}"
+
+- name: read one item
+  ansible.builtin.debug:
+    msg: "{{ lookup('nomad_var', 'nomad/jobs/web', item='db_password') }}"
+"""
+
+RETURN = r"""
+_raw:
+  description: the items (or item values) of the variables, O(default) for those that do not exist.
+  type: list
+"""
+
+from ansible.plugins.lookup import LookupBase
+from ansible.utils.display import Display
+
+from ..module_utils.nomad import NomadAPI
+from ..module_utils.utils import run_concurrently
+from ..plugin_utils.api import ModuleShim, api_params
+
+display = Display()
+
+# the items of the variables read so far (None if there is no such variable), per namespace and token
+_memo = {}
+
+
+class LookupModule(LookupBase):
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+        url = self.get_option("url")
+        token = self.get_option("token")
+        namespace = self.get_option("namespace")
+        default = self.get_option("default")
+
+        store = _memo.setdefault((url, token, namespace), {})
+        pending = sorted(set(path for path in terms if path not in store))
+        if pending:
+            nomad = NomadAPI(
+                ModuleShim(
+                    "nomad_var",
+                    api_params(
+                        url,
+                        token,
+                        self.get_option("validate_certs"),
+                        self.get_option("connection_timeout"),
+                        namespace,
+                    ),
+                    display,
+                )
+            )
+            for path, variable in zip(
+                pending, run_concurrently(nomad.get_variable, pending, self.get_option("max_concurrency"))
+            ):
+                store[path] = None if variable is None else variable.get("Items") or {}
+
+        item = self.get_option("item")
+        values = []
+        for path in terms:
+            items = store[path]
+            if items is None:
+                values.append(default)
+            elif item is not None:
+                values.append(items.get(item, default))
+            else:
+                values.append(items)
+        return values
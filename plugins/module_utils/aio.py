@@ -0,0 +1,121 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import asyncio
+import copy
+import functools
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import _worker
+
+#
+# An asyncio flavour of the NomadAPI and ConsulAPI clients, for fan-out reads.
+#
+# Requests still go through the clients (retries, failover, metrics) and over
+# the keep-alive connections of the transport pool. The event loop schedules
+# them, a semaphore bounds how many are in flight and each one runs on a worker
+# thread, so awaiting a thousand reads costs about a thousand / max_concurrency
+# round-trips. Use one event loop per module run, ie. with run or fan_out.
+#
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class _Exit(Exception):
+    """carries the exit of a failed request (module.fail_json) out of the event loop"""
+
+    def __init__(self, exit):
+        super(_Exit, self).__init__(exit)
+        self.exit = exit
+
+
+class AsyncAPI(object):
+    """
+    AsyncAPI mirrors the methods of a NomadAPI or ConsulAPI as coroutine functions.
+    Listings (the iter_ methods) are read completely and returned as a list.
+    It must be entered (async with) within the event loop it is used in, run that loop
+    with run so that failed requests exit the module like they would without asyncio.
+    """
+
+    def __init__(self, api, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.api = api
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._executor = None
+        # within a fan-out only the first failing request gets to print a result
+        self._fail_lock = threading.Lock()
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # if one of the requests failed, don't bother starting the remaining ones
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+
+    def __getattr__(self, name):
+        # only the public surface is mirrored, this also keeps copy from looking into the api
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self.api, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            if self._executor is None:
+                raise RuntimeError("AsyncAPI is used outside of async with")
+            async with self._semaphore:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._executor, functools.partial(self._call, attr, args, kwargs)
+                )
+
+        return call
+
+    def _call(self, func, args, kwargs):
+        _worker.fail_lock = self._fail_lock
+        try:
+            result = func(*args, **kwargs)
+        except SystemExit as e:
+            raise _Exit(e)
+        # listings are generators that send requests as they are read, read them here as well
+        if isinstance(result, types.GeneratorType):
+            result = list(result)
+        return result
+
+    def with_namespace(self, namespace):
+        """returns an AsyncAPI for another nomad namespace, it shares the concurrency limit"""
+        api = copy.copy(self)
+        api.api = self.api.with_namespace(namespace)
+        return api
+
+    async def map(self, method, items, *args, **kwargs):
+        """calls method(item, *args, **kwargs) for every item, returns the results in the order of items"""
+        func = getattr(self, method)
+        return await asyncio.gather(*(func(item, *args, **kwargs) for item in items))
+
+
+def run(coro):
+    """runs a coroutine on a new event loop, a request that failed the module exits once the loop is closed"""
+    try:
+        return asyncio.run(coro)
+    except _Exit as e:
+        raise e.exit
+
+
+def fan_out(api, method, items, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """calls the method of api for every item on a new event loop, returns the results in the order of items"""
+
+    async def main():
+        async with AsyncAPI(api, max_concurrency) as aapi:
+            return await aapi.map(method, items)
+
+    return run(main())
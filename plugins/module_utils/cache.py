@@ -0,0 +1,98 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from .utils import json_body
+
+#
+# A tiny on-disk JSON cache used to skip repeated API round-trips.
+# Every entry is a single file named after the hash of its key, so
+# concurrent module runs (ie. many hosts in a play) never share a file
+# handle and writes are made atomic with a rename.
+#
+
+DEFAULT_CACHE_DIR = "~/.ansible/tmp/hashicorp-ansible"
+
+
+def cache_key(*parts):
+    """returns a stable hash for the given json serializable parts"""
+    return hashlib.sha256(json_body(parts)).hexdigest()
+
+
+class FileCache(object):
+    """
+    FileCache stores json serializable values on disk for up to ttl seconds. With
+    max_entries set, expired entries are removed on write and the oldest entries are
+    evicted once the cache holds more than max_entries.
+    """
+
+    def __init__(self, directory, ttl, max_entries=None):
+        self.directory = os.path.expanduser(directory)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """returns the cached value for key, or None if it is missing or expired"""
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        """stores value for key. failing to write the cache is never fatal."""
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(value, f, separators=(",", ":"))
+                os.replace(tmp_path, self._path(key))
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except (OSError, TypeError, ValueError):
+            return
+        if self.max_entries is not None:
+            self.prune()
+
+    def prune(self):
+        """removes expired entries, then the oldest entries above max_entries"""
+        now = time.time()
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                # removed by a concurrent module run
+                continue
+        entries.sort(reverse=True)
+        keep = len(entries) if self.max_entries is None else self.max_entries
+        for i, (mtime, path) in enumerate(entries):
+            if i >= keep or now - mtime > self.ttl:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
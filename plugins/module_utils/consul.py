@@ -6,13 +6,15 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 import json
+import time
 
-from ansible.module_utils.common.text.converters import to_native
 from ansible.module_utils.six.moves.urllib.error import HTTPError
-from ansible.module_utils.six.moves.urllib.parse import quote_plus
-from ansible.module_utils.urls import open_url
+from ansible.module_utils.six.moves.urllib.parse import quote, quote_plus
 
-from . import debug
+from . import debug, instrumentation, transport
+from .jsonstream import iter_json_array
+from .retry import Failover, RetryPolicy, gave_up
+from .utils import add_query_params, fail_json_once, json_body
 
 URL_ACL_POLICIES = "{url}/v1/acl/policies"
 URL_ACL_POLICY_ID = "{url}/v1/acl/policy/{id}"
@@ -23,8 +25,45 @@ URL_ACL_TOKENS = "{url}/v1/acl/tokens"
 URL_ACL_TOKEN = "{url}/v1/acl/token"
 URL_ACL_TOKEN_ID = "{url}/v1/acl/token/{id}"
 URL_ACL_TOKEN_SELF = "{url}/v1/acl/token/self"
+URL_CONNECT_INTENTIONS = "{url}/v1/connect/intentions"
 URL_CONNECT_INTENTION = "{url}/v1/connect/intentions/exact?source={src}&destination={dst}"
+URL_CONFIG = "{url}/v1/config"
+URL_CONFIG_KIND = "{url}/v1/config/{kind}"
+URL_CONFIG_ENTRY = "{url}/v1/config/{kind}/{name}"
+URL_CATALOG_NODES = "{url}/v1/catalog/nodes"
+URL_CATALOG_SERVICES = "{url}/v1/catalog/services"
 URL_SERVICE_NAME = "{url}/v1/catalog/service/{name}"
+URL_HEALTH_SERVICE = "{url}/v1/health/service/{name}"
+URL_KV = "{url}/v1/kv/{key}"
+URL_TXN = "{url}/v1/txn"
+
+# the url templates above, metrics are reported per template instead of per url
+ENDPOINTS = instrumentation.Endpoints([value for key, value in sorted(globals().items()) if key.startswith("URL_")])
+
+# max number of operations consul accepts in a single transaction
+TXN_MAX_OPS = 128
+# transaction verbs whose outcome depends on the state they were sent against, they are never retried
+TXN_CONDITIONAL_VERBS = frozenset(
+    ["cas", "delete-cas", "lock", "unlock", "check-index", "check-not-exists", "check-session"]
+)
+
+# default max time in seconds a blocking query waits for a change
+DEFAULT_BLOCKING_WAIT = 60
+# consistency modes supported by read endpoints. "default" sends no query parameter.
+CONSISTENCY_MODES = ["default", "stale", "consistent", "cached"]
+
+
+def query_meta(headers):
+    """returns the query metadata consul sends along with read responses"""
+    index = headers.get("X-Consul-Index")
+    last_contact = headers.get("X-Consul-LastContact")
+    return dict(
+        index=int(index) if index else None,
+        known_leader=headers.get("X-Consul-KnownLeader") == "true",
+        last_contact=int(last_contact) if last_contact else None,
+        effective_consistency=headers.get("X-Consul-Effective-Consistency") or None,
+        cache=headers.get("X-Cache") or None,
+    )
 
 
 class ConsulAPI(object):
@@ -36,42 +75,131 @@ class ConsulAPI(object):
         self.management_token = self.module.params.get("management_token")
         self.validate_certs = self.module.params.get("validate_certs")
         self.connection_timeout = self.module.params.get("connection_timeout")
+        self.retry_policy = RetryPolicy.from_params(self.module.params)
+        self.failover = Failover(self.url, self.module.params.get("failover_urls"))
+        # number of requests that were sent again after a transient failure
+        self.retries = 0
+        # per request metrics, None unless enabled
+        self.metrics = instrumentation.get_recorder(self.module)
         self.headers = {
             "Content-Type": "application/json",
             "X-Consul-Token": self.management_token,
             "User-Agent": "ansible-module-consul",
         }
 
-    def api_request(self, url, method, headers=None, body=None, json_response=True, ignore_codes=[]):
+    def api_request(
+        self,
+        url,
+        method,
+        headers=None,
+        body=None,
+        json_response=True,
+        ignore_codes=[],
+        error_response_codes=[],
+        stream=False,
+        index=None,
+        wait=None,
+        return_meta=False,
+        consistency=None,
+        max_age=None,
+        idempotent=None,
+    ):
+        """
+        Sends a request to the consul API. Reads can be turned into blocking queries
+        by passing the last seen index and the max time (in seconds) to wait for a change.
+        Reads can also choose a consistency mode. With "cached", max_age (in seconds)
+        limits how old the agent's cached response may be.
+        With stream set, a JSON array response is returned as a generator that decodes
+        its elements as they are read.
+        When return_meta is set, a tuple of (response, query meta) is returned.
+        The JSON body of a failure with one of the error_response_codes is returned like
+        a successful response, ie. the errors of a rolled back transaction.
+        Transient failures are retried according to the retry policy. By default only the
+        methods of the policy are considered idempotent, idempotent overrides that.
+        """
         if headers is None:
             headers = self.headers
-        try:
-            response = open_url(
-                url=url,
+        timeout = self.connection_timeout
+        if index is not None:
+            url = add_query_params(url, index=index, wait=None if wait is None else "%ds" % wait)
+            # consul adds up to wait/16 of jitter to the wait time
+            if wait is not None:
+                timeout += wait + wait / 16
+        if consistency not in (None, "default"):
+            url = add_query_params(url, **{consistency: ""})
+            if consistency == "cached" and max_age is not None:
+                headers = dict(headers, **{"Cache-Control": "max-age=%d" % max_age})
+        retries = []
+        timings = None
+        if self.metrics is not None:
+            timings = {}
+            start = time.monotonic()
+
+        def record(status, bytes_in):
+            if self.metrics is not None:
+                self.metrics.record(
+                    method,
+                    ENDPOINTS.template(url),
+                    status,
+                    time.monotonic() - start,
+                    timings=timings,
+                    bytes_out=instrumentation.body_size(body),
+                    bytes_in=bytes_in,
+                    retries=len(retries),
+                )
+
+        def send():
+            return transport.request(
+                url=self.failover.url(url),
                 method=method,
                 data=body,
                 headers=headers,
-                timeout=self.connection_timeout,
+                timeout=timeout,
                 validate_certs=self.validate_certs,
+                timings=timings,
             )
-            response_body = response.read().decode("utf-8")
-            debug.log_request(
-                self.module,
-                url,
-                method,
-                body,
-                response.getcode(),
-                response_body,
+
+        def on_retry(retry, error, delay):
+            retries.append(error)
+            self.retries += 1
+            # rate limits apply to the whole cluster, anything else might be specific to the server
+            if not (isinstance(error, HTTPError) and error.code == 429):
+                self.failover.rotate()
+            self.module.warn(
+                "retrying [%s] %s in %.1fs (retry %d of %d): %s"
+                % (method, url, delay, retry + 1, self.retry_policy.retries, error)
             )
-            if json_response:
-                try:
-                    return json.loads(to_native(response_body))
-                except ValueError as e:
-                    self.module.fail_json(msg="API returned invalid JSON: %s" % (str(e)))
+
+        try:
+            response = self.retry_policy.call(send, method, idempotent=idempotent, on_retry=on_retry)
+            if json_response and stream:
+                response_body = self._stream_json_array(response, url, method, body, record)
+            else:
+                response_body = response.read()
+                record(response.getcode(), len(response_body))
+                debug.log_request(
+                    self.module,
+                    url,
+                    method,
+                    body,
+                    response.getcode(),
+                    response_body,
+                )
+                if json_response:
+                    try:
+                        response_body = json.loads(response_body)
+                    except ValueError as e:
+                        fail_json_once(self.module, msg="API returned invalid JSON: %s" % (str(e)))
+                else:
+                    response_body = response_body.decode("utf-8")
+            if return_meta:
+                return response_body, query_meta(response.headers)
             return response_body
 
         except HTTPError as e:
-            response_body = e.read().decode("utf-8")
+            response_body = e.read()
+            record(e.code, len(response_body))
+            response_body = response_body.decode("utf-8")
             debug.log_request(
                 self.module,
                 url,
@@ -81,43 +209,122 @@ class ConsulAPI(object):
                 response_body,
             )
             if e.code in ignore_codes:
+                if return_meta:
+                    return None, query_meta(e.headers)
                 return None
 
+            if e.code in error_response_codes and json_response:
+                try:
+                    error_body = json.loads(response_body)
+                except ValueError:
+                    pass
+                else:
+                    if return_meta:
+                        return error_body, query_meta(e.headers)
+                    return error_body
+
             if e.code == 401 or e.code == 403:
-                self.module.fail_json(
-                    msg="Not Authorized: status=%s [%s] %s ->\n%s" % (e.code, method, url, response_body)
+                fail_json_once(
+                    self.module, msg="Not Authorized: status=%s [%s] %s ->\n%s" % (e.code, method, url, response_body)
                 )
 
-            self.module.fail_json(msg="Error: status=%s [%s] %s ->\n%s" % (e.code, method, url, response_body))
+            fail_json_once(
+                self.module,
+                msg="Error: status=%s [%s] %s%s ->\n%s" % (e.code, method, url, gave_up(retries), response_body),
+            )
 
         except Exception as e:
-            print("here")
-            self.module.fail_json(msg="Could not make API call: [%s] %s ->\n%s" % (method, url, str(e)))
+            record(None, 0)
+            fail_json_once(
+                self.module,
+                msg="Could not make API call: [%s] %s%s ->\n%s" % (method, url, gave_up(retries), str(e)),
+            )
+
+    def _stream_json_array(self, response, url, method, body, record=None):
+        """yields the elements of a JSON array response as they are decoded"""
+        debug.log_request(self.module, url, method, body, response.getcode(), "<streamed>")
+        try:
+            for item in iter_json_array(response):
+                yield item
+        except ValueError as e:
+            fail_json_once(self.module, msg="API returned invalid JSON: %s" % (str(e)))
+        except Exception as e:
+            fail_json_once(self.module, msg="Could not make API call: [%s] %s ->\n%s" % (method, url, str(e)))
+        finally:
+            # the caller may stop early, try to keep the connection alive anyway
+            getattr(response, "release", response.close)()
+            if record is not None:
+                record(response.getcode(), getattr(response, "bytes_read", None))
+
+    def wait_until(self, read, predicate, timeout, wait=DEFAULT_BLOCKING_WAIT):
+        """
+        Long-polls read with blocking queries until predicate returns True for its result.
+        read must accept the index, wait and return_meta arguments like the getters below.
+        Returns a tuple of (last result, last index, predicate satisfied).
+        """
+        deadline = time.monotonic() + timeout
+        index = 0
+        polls = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            result, meta = read(index=index, wait=max(1, int(min(wait, remaining))), return_meta=True)
+            if predicate(result):
+                return result, meta.get("index"), True
+            if time.monotonic() >= deadline:
+                return result, meta.get("index"), False
+            new_index = meta.get("index")
+            if new_index is None:
+                # no index header (ie. stripped by a proxy), keep blocking on the last index.
+                # without one the reads do not block, poll with a backoff instead.
+                if not index:
+                    time.sleep(min(2**polls, wait, max(0, deadline - time.monotonic())))
+                    polls += 1
+                continue
+            # the index can go backwards (ie. after a snapshot restore). start over if it does.
+            # otherwise it must be at least 1, since an index of 0 never blocks.
+            index = max(new_index, 1) if new_index >= index else 0
 
     #
     # ACL Policies
     #
-    def get_acl_policies(self):
+    def get_acl_policies(self, index=None, wait=None, return_meta=False, consistency=None, max_age=None):
         return self.api_request(
             url=URL_ACL_POLICIES.format(url=self.url),
             method="GET",
             json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
         )
 
-    def get_acl_policy(self, policy_id):
+    def get_acl_policy(self, policy_id, index=None, wait=None, return_meta=False, consistency=None, max_age=None):
         return self.api_request(
             url=URL_ACL_POLICY_ID.format(url=self.url, id=policy_id),
             method="GET",
             json_response=True,
             ignore_codes=[404],
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
         )
 
-    def get_acl_policy_by_name(self, policy_name):
+    def get_acl_policy_by_name(
+        self, policy_name, index=None, wait=None, return_meta=False, consistency=None, max_age=None
+    ):
         return self.api_request(
             url=URL_ACL_POLICY_NAME.format(url=self.url, name=policy_name),
             method="GET",
             json_response=True,
             ignore_codes=[404],
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
         )
 
     def delete_acl_policy(self, policy_id):
@@ -134,6 +341,7 @@ class ConsulAPI(object):
             method="PUT",
             body=body,
             json_response=True,
+            idempotent=False,
         )
 
     def update_acl_policy(self, policy_id, body):
@@ -158,14 +366,19 @@ class ConsulAPI(object):
             ignore_codes=[403],
         )
 
-    def get_acl_tokens(self):
+    def get_acl_tokens(self, index=None, wait=None, return_meta=False, consistency=None, max_age=None):
         return self.api_request(
             url=URL_ACL_TOKENS.format(url=self.url),
             method="GET",
             json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
         )
 
-    def get_acl_token(self, accessor_id):
+    def get_acl_token(self, accessor_id, index=None, wait=None, return_meta=False, consistency=None, max_age=None):
         return self.api_request(
             url=URL_ACL_TOKEN_ID.format(url=self.url, id=accessor_id),
             method="GET",
@@ -174,6 +387,11 @@ class ConsulAPI(object):
             # despite the actual response body revealing it could not find
             # the token ;)
             ignore_codes=[403],
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
         )
 
     def delete_acl_token(self, accessor_id):
@@ -190,6 +408,7 @@ class ConsulAPI(object):
             method="PUT",
             body=body,
             json_response=True,
+            idempotent=False,
         )
 
     def update_acl_token(self, accessor_id, body):
@@ -204,14 +423,31 @@ class ConsulAPI(object):
         return self.api_request(
             url=URL_ACL_BOOTSTRAP.format(url=self.url),
             method="PUT",
-            body=json.dumps(dict(BootstrapSecret=self.management_token)),
+            body=json_body(dict(BootstrapSecret=self.management_token)),
             json_response=True,
+            idempotent=False,
         )
 
     #
     # CONNECT INTENTIONS
     #
-    def get_connect_intention(self, source, destination):
+    def get_connect_intentions(
+        self, params=None, index=None, wait=None, return_meta=False, consistency=None, max_age=None
+    ):
+        return self.api_request(
+            url=add_query_params(URL_CONNECT_INTENTIONS.format(url=self.url), **(params or {})),
+            method="GET",
+            json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
+        )
+
+    def get_connect_intention(
+        self, source, destination, index=None, wait=None, return_meta=False, consistency=None, max_age=None
+    ):
         return self.api_request(
             url=URL_CONNECT_INTENTION.format(
                 url=self.url,
@@ -221,6 +457,11 @@ class ConsulAPI(object):
             method="GET",
             json_response=True,
             ignore_codes=[404],
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
         )
 
     def delete_connect_intention(self, source, destination):
@@ -247,15 +488,203 @@ class ConsulAPI(object):
             json_response=True,
         )
 
+    #
+    # Config entries
+    #
+    def get_config_entries(
+        self, kind, params=None, index=None, wait=None, return_meta=False, consistency=None, max_age=None
+    ):
+        return self.api_request(
+            url=add_query_params(URL_CONFIG_KIND.format(url=self.url, kind=kind), **(params or {})),
+            method="GET",
+            json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
+        )
+
+    def get_config_entry(
+        self, kind, name, params=None, index=None, wait=None, return_meta=False, consistency=None, max_age=None
+    ):
+        return self.api_request(
+            url=add_query_params(
+                URL_CONFIG_ENTRY.format(url=self.url, kind=kind, name=quote(name, safe="")), **(params or {})
+            ),
+            method="GET",
+            json_response=True,
+            ignore_codes=[404],
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
+        )
+
+    def apply_config_entry(self, body, cas=None, params=None):
+        """
+        creates or replaces a config entry. with cas set, only if the entry still has that
+        ModifyIndex (0: does not exist). returns False when the entry was not written.
+        """
+        return self.api_request(
+            url=add_query_params(URL_CONFIG.format(url=self.url), cas=cas, **(params or {})),
+            method="PUT",
+            body=body,
+            json_response=True,
+            # a cas write that was applied fails its cas when sent again
+            idempotent=False if cas is not None else None,
+        )
+
+    def delete_config_entry(self, kind, name, cas=None, params=None):
+        """deletes a config entry, with cas set only if it still has that ModifyIndex. returns False when it was not"""
+        response = self.api_request(
+            url=add_query_params(
+                URL_CONFIG_ENTRY.format(url=self.url, kind=kind, name=quote(name, safe="")), cas=cas, **(params or {})
+            ),
+            method="DELETE",
+            json_response=True,
+            ignore_codes=[404],
+            idempotent=False if cas is not None else None,
+        )
+        # depending on the version, consul answers true/false or {"Deleted": true/false} to a cas delete
+        if isinstance(response, dict):
+            return response.get("Deleted", True)
+        return response is not False
+
     #
     # Services
     #
-    def get_service(self, name):
+    def get_catalog_nodes(self, params=None, index=None, wait=None, return_meta=False, consistency=None, max_age=None):
         return self.api_request(
-            url=URL_SERVICE_NAME.format(
-                url=self.url,
-                name=name,
+            url=add_query_params(URL_CATALOG_NODES.format(url=self.url), **(params or {})),
+            method="GET",
+            json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
+        )
+
+    def get_catalog_services(
+        self, params=None, index=None, wait=None, return_meta=False, consistency=None, max_age=None
+    ):
+        # a map of service names to the tags of their instances
+        return self.api_request(
+            url=add_query_params(URL_CATALOG_SERVICES.format(url=self.url), **(params or {})),
+            method="GET",
+            json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
+        )
+
+    def get_service(self, name, params=None, index=None, wait=None, return_meta=False, consistency=None, max_age=None):
+        return self.api_request(
+            url=add_query_params(
+                URL_SERVICE_NAME.format(
+                    url=self.url,
+                    name=name,
+                ),
+                **(params or {})
+            ),
+            method="GET",
+            json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
+        )
+
+    def get_health_service(
+        self, name, passing=True, params=None, index=None, wait=None, return_meta=False, consistency=None, max_age=None
+    ):
+        return self.api_request(
+            url=add_query_params(
+                URL_HEALTH_SERVICE.format(url=self.url, name=quote_plus(name)),
+                passing="true" if passing else None,
+                **(params or {})
+            ),
+            method="GET",
+            json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
+        )
+
+    #
+    # KV
+    #
+    def get_kv(
+        self, key, recurse=False, params=None, index=None, wait=None, return_meta=False, consistency=None, max_age=None
+    ):
+        # a list of entries with base64 encoded values, or None if there is no such key (or prefix)
+        return self.api_request(
+            url=add_query_params(
+                URL_KV.format(url=self.url, key=quote(key, safe="/")), recurse="" if recurse else None, **(params or {})
             ),
             method="GET",
             json_response=True,
+            ignore_codes=[404],
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+            consistency=consistency,
+            max_age=max_age,
+        )
+
+    #
+    # Transactions
+    #
+    def txn(self, operations, params=None):
+        """
+        Applies up to TXN_MAX_OPS operations atomically. Returns a dict with the Results,
+        or with the Errors (each with the OpIndex of the operation that failed) when the
+        transaction was rolled back.
+        """
+        verbs = [(op.get(kind) or {}).get("Verb") for op in operations for kind in op]
+        return self.api_request(
+            url=add_query_params(URL_TXN.format(url=self.url), **(params or {})),
+            method="PUT",
+            body=json_body(operations),
+            json_response=True,
+            error_response_codes=[409],
+            idempotent=False if TXN_CONDITIONAL_VERBS.intersection(verbs) else None,
         )
+
+    def transaction(self, operations, params=None, chunk_size=TXN_MAX_OPS):
+        """
+        Applies any number of operations, in transactions of up to chunk_size operations.
+        Every transaction is atomic on its own. Once one is rolled back, the remaining
+        ones are not sent. Returns a dict with the status of every operation (ok, failed,
+        rolled_back or skipped, along with the error of those that failed), the Results
+        of the transactions that were applied and the number of transactions sent.
+        """
+        outcome = dict(operations=[], results=[], transactions=0, failed=False)
+        for start in range(0, len(operations), chunk_size):
+            chunk = operations[start : start + chunk_size]
+            if outcome["failed"]:
+                outcome["operations"].extend(dict(status="skipped") for _ in chunk)
+                continue
+
+            response = self.txn(chunk, params=params) or {}
+            outcome["transactions"] += 1
+            errors = dict((error.get("OpIndex"), error.get("What")) for error in response.get("Errors") or [])
+            if not errors:
+                outcome["operations"].extend(dict(status="ok") for _ in chunk)
+                outcome["results"].extend(response.get("Results") or [])
+                continue
+
+            outcome["failed"] = True
+            for i in range(len(chunk)):
+                if i in errors:
+                    outcome["operations"].append(dict(status="failed", error=errors[i]))
+                else:
+                    outcome["operations"].append(dict(status="rolled_back"))
+        return outcome
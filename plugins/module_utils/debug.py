@@ -5,9 +5,10 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__ = type
 
-import inspect
+import json
 import logging
 import os
+import time
 
 #
 # This logger can only be enabled if env var ANSIBLE_DEBUG_LOGGER_ENABLED
@@ -29,33 +30,49 @@ ENV_VAR = "ANSIBLE_DEBUG_LOGGER_ENABLED"
 LOG_FILE = "/tmp/DEBUG_ANSIBLE.log"
 DEBUG_LOGGER_ENABLED = os.environ.get(ENV_VAR, "").lower() in ["yes", "true"]
 
-REQUEST_LOG_TEMPLATE = """Caller: {caller_func} ({caller_file})\n
-REQUEST:\n{method} {url}\n{request_body}\n
-RESPONSE:\n{status}\n{response_body}\n\n\n"""
+# only this much of a request or response body is written to the log
+MAX_LOGGED_BODY = 4096
 
 if DEBUG_LOGGER_ENABLED:
     logging.basicConfig(
         filename=LOG_FILE,
         filemode="a",
-        format="[%(asctime)s] %(message)s",
-        datefmt="%Y-%m-%d @ %H:%M:%S",
+        format="%(message)s",
         level=logging.DEBUG,
     )
 
 
 def log_request(module, url, method, request_body=None, status=None, response_body=None):
+    """writes a request and its response to the log, one JSON object per line"""
     if DEBUG_LOGGER_ENABLED:
-        # Emit a warning if this is enabled!
-        module.warn("{var} is enabled! Sensitive information may be logged to disk!".format(var=ENV_VAR))
+        # warn once per module run that this is enabled!
+        if not getattr(module, "_debug_logger_warned", False):
+            module._debug_logger_warned = True
+            module.warn("{var} is enabled! Sensitive information may be logged to disk!".format(var=ENV_VAR))
 
         logging.debug(
-            REQUEST_LOG_TEMPLATE.format(
-                caller_file=os.path.basename(inspect.currentframe().f_back.f_code.co_filename),
-                caller_func=inspect.currentframe().f_back.f_code.co_name,
-                url=url,
-                method=method,
-                request_body=request_body,
-                status=status,
-                response_body=response_body,
+            json.dumps(
+                dict(
+                    time=round(time.time(), 3),
+                    module=getattr(module, "_name", None),
+                    method=method,
+                    url=url,
+                    request_body=_truncate(request_body),
+                    status=status,
+                    response_body=_truncate(response_body),
+                )
             )
         )
+
+
+def _truncate(body):
+    """returns a truncated text copy of a body, which may be bytes"""
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        text = body[:MAX_LOGGED_BODY].decode("utf-8", errors="replace")
+    else:
+        text = body[:MAX_LOGGED_BODY]
+    if len(body) > MAX_LOGGED_BODY:
+        text += "... (truncated {size} bytes)".format(size=len(body) - MAX_LOGGED_BODY)
+    return text
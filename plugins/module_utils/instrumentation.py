@@ -0,0 +1,205 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import json
+import os
+import re
+import threading
+import time
+
+from ansible.module_utils.six.moves.urllib.parse import urlsplit
+
+#
+# Per request metrics of the nomad and consul API clients.
+#
+# Nothing is recorded unless one of these env vars is set (ie. with the
+# environment keyword of a task or play):
+#
+#   HASHICORP_ANSIBLE_METRICS=true
+#     adds a "metrics" summary to the module result, with the time spent
+#     per endpoint (slowest first).
+#
+#   HASHICORP_ANSIBLE_METRICS_FILE=/tmp/hashicorp-ansible-metrics.jsonl
+#     appends one JSON line per request to the file, which can be collected
+#     from every host to find the modules and endpoints that dominate the
+#     wall time of a playbook.
+#
+# NOTE: like the debug logger, the file is written on the host that runs the
+# module. Request and response bodies are never recorded, and endpoints are
+# reported by their url template (ie. /v1/acl/token/{id}) instead of the url.
+#
+
+ENV_SUMMARY = "HASHICORP_ANSIBLE_METRICS"
+ENV_FILE = "HASHICORP_ANSIBLE_METRICS_FILE"
+SUMMARY_ENABLED = os.environ.get(ENV_SUMMARY, "").lower() in ["yes", "true"]
+METRICS_FILE = os.environ.get(ENV_FILE) or None
+
+# timings are reported in seconds with this many digits
+PRECISION = 6
+
+
+def get_recorder(module):
+    """returns the Recorder of a module run, or None when metrics are disabled"""
+    if not SUMMARY_ENABLED and METRICS_FILE is None:
+        return None
+    recorder = getattr(module, "_hashicorp_metrics_recorder", None)
+    if recorder is None:
+        recorder = Recorder(getattr(module, "_name", None), METRICS_FILE)
+        module._hashicorp_metrics_recorder = recorder
+        if SUMMARY_ENABLED:
+            _add_summary_to_result(module, recorder)
+    return recorder
+
+
+def _add_summary_to_result(module, recorder):
+    exit_json, fail_json = module.exit_json, module.fail_json
+
+    def exit_with_metrics(*args, **kwargs):
+        kwargs["metrics"] = recorder.summary()
+        return exit_json(*args, **kwargs)
+
+    def fail_with_metrics(*args, **kwargs):
+        kwargs["metrics"] = recorder.summary()
+        return fail_json(*args, **kwargs)
+
+    module.exit_json = exit_with_metrics
+    module.fail_json = fail_with_metrics
+
+
+# placeholders that stand for a path (ie. a consul KV key) and may span several segments
+PATH_PLACEHOLDERS = {"{key}": ".*", "{path}": ".+"}
+
+
+class Endpoints(object):
+    """Endpoints maps request urls back to the url template (ie. URL_ACL_TOKEN_ID) they were built from"""
+
+    def __init__(self, templates):
+        self.templates = templates
+        self._patterns = None
+
+    def _compile(self):
+        patterns = {}
+        for template in self.templates:
+            path = urlsplit(template.replace("{url}", "", 1)).path
+            regex = "".join(
+                PATH_PLACEHOLDERS.get(part, "[^/]+") if part.startswith("{") else re.escape(part)
+                for part in re.split(r"(\{\w+\})", path)
+                if part
+            )
+            patterns[path] = re.compile(regex)
+        # static paths first, ie. /v1/acl/token/self before /v1/acl/token/{id}
+        return sorted(patterns.items(), key=lambda item: (item[0].count("{"), item[0]))
+
+    def template(self, url):
+        if self._patterns is None:
+            self._patterns = self._compile()
+        path = urlsplit(url).path
+        for template, pattern in self._patterns:
+            if pattern.fullmatch(path):
+                return template
+        return path
+
+
+class Recorder(object):
+    """Recorder collects the metrics of every request made during a module run"""
+
+    def __init__(self, module_name=None, path=None):
+        self.module_name = module_name
+        self.path = path
+        self.start = time.monotonic()
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def record(self, method, endpoint, status, elapsed, timings=None, bytes_out=0, bytes_in=0, retries=0):
+        """
+        Records a finished request. timings are the connection phases measured by the
+        transport: dns, connect and tls are None for reused connections, first_byte is
+        the time until the response headers were received.
+        """
+        timings = timings or {}
+        entry = dict(
+            time=round(time.time(), 3),
+            module=self.module_name,
+            method=method,
+            endpoint=endpoint,
+            status=status,
+            retries=retries,
+            bytes_out=bytes_out,
+            # unknown for streamed responses that were not read over a pooled connection
+            bytes_in=bytes_in or 0,
+            reused=timings.get("reused"),
+            dns=_round(timings.get("dns")),
+            connect=_round(timings.get("connect")),
+            tls=_round(timings.get("tls")),
+            first_byte=_round(timings.get("first_byte")),
+            total=_round(elapsed),
+        )
+        with self._lock:
+            self.entries.append(entry)
+            if self.path is not None:
+                self._write(entry)
+
+    def _write(self, entry):
+        # metrics are never worth failing a module for
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        except (OSError, ValueError):
+            pass
+
+    def summary(self):
+        """returns the totals of the module run and the time spent per endpoint, slowest first"""
+        with self._lock:
+            entries = list(self.entries)
+        endpoints = {}
+        for entry in entries:
+            stats = endpoints.get((entry["method"], entry["endpoint"]))
+            if stats is None:
+                stats = endpoints[(entry["method"], entry["endpoint"])] = dict(
+                    method=entry["method"],
+                    endpoint=entry["endpoint"],
+                    requests=0,
+                    retries=0,
+                    total=0.0,
+                    max=0.0,
+                    bytes_out=0,
+                    bytes_in=0,
+                    statuses={},
+                )
+            stats["requests"] += 1
+            stats["retries"] += entry["retries"]
+            stats["total"] += entry["total"]
+            stats["max"] = max(stats["max"], entry["total"])
+            stats["bytes_out"] += entry["bytes_out"]
+            stats["bytes_in"] += entry["bytes_in"]
+            status = str(entry["status"])
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+        for stats in endpoints.values():
+            stats["total"] = _round(stats["total"])
+        return dict(
+            elapsed=_round(time.monotonic() - self.start),
+            requests=len(entries),
+            retries=sum(entry["retries"] for entry in entries),
+            connections=sum(1 for entry in entries if entry["reused"] is False),
+            request_time=_round(sum(entry["total"] for entry in entries)),
+            bytes_out=sum(entry["bytes_out"] for entry in entries),
+            bytes_in=sum(entry["bytes_in"] for entry in entries),
+            endpoints=sorted(endpoints.values(), key=lambda stats: stats["total"], reverse=True),
+        )
+
+
+def body_size(body):
+    """returns the size in bytes of a request body, which may be text"""
+    if body is None:
+        return 0
+    if isinstance(body, bytes):
+        return len(body)
+    return len(body.encode("utf-8"))
+
+
+def _round(value):
+    return None if value is None else round(value, PRECISION)
@@ -0,0 +1,122 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import codecs
+import json
+
+#
+# Incremental JSON decoding for large list responses.
+#
+# The standard json module can only decode a complete document, which means
+# the whole response needs to be held in memory (usually more than once).
+# iter_json_array reads the response in chunks and yields the elements of a
+# top level JSON array one at a time, so only the element currently being
+# decoded (and one chunk) is held in memory.
+#
+
+CHUNK_SIZE = 64 * 1024
+MAX_READ_SIZE = 4 * 1024 * 1024
+WHITESPACE = " \t\n\r"
+DELIMITERS = WHITESPACE + ",]}"
+
+_decoder = json.JSONDecoder()
+
+
+class _Buffer(object):
+    """decoded text read from a byte stream, refilled on demand"""
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.read_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        data = self.stream.read(self.read_size)
+        if not data:
+            self.text += self.decoder.decode(b"", final=True)
+            self.eof = True
+            return
+        # drop the text we are done with before appending more
+        if self.pos > self.chunk_size:
+            self.text = self.text[self.pos :]
+            self.pos = 0
+        self.text += self.decoder.decode(data)
+
+    def skip_whitespace(self):
+        """skips whitespace and returns the next character, or None at the end of the stream"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if self.eof:
+                return None
+            self.fill()
+
+    def decode_value(self):
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                # the value is not complete yet, read bigger chunks to avoid decoding it over and over
+                self.read_size = min(self.read_size * 2, MAX_READ_SIZE)
+                self.fill()
+                continue
+            # a number might have been cut off by the chunking (ie. "12" of "12.5e3").
+            # it is only complete once it is followed by a delimiter.
+            if (
+                not self.eof
+                and isinstance(value, (int, float))
+                and (end >= len(self.text) or self.text[end] not in DELIMITERS)
+            ):
+                self.fill()
+                continue
+            self.pos = end
+            self.read_size = self.chunk_size
+            return value
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """
+    Generator that decodes a JSON array from stream (any object with a read(size) method
+    returning bytes) and yields its elements one at a time. A JSON null yields nothing.
+    Raises ValueError if the stream does not contain a valid JSON array.
+    """
+    buf = _Buffer(stream, chunk_size)
+
+    char = buf.skip_whitespace()
+    if char != "[":
+        if char is None:
+            raise ValueError("Expecting value: empty response")
+        if buf.decode_value() is not None or buf.skip_whitespace() is not None:
+            raise ValueError("Expecting a JSON array at char %d" % buf.pos)
+        return
+    buf.pos += 1
+
+    if buf.skip_whitespace() == "]":
+        buf.pos += 1
+    else:
+        while True:
+            if buf.skip_whitespace() is None:
+                raise ValueError("Unterminated JSON array at char %d" % buf.pos)
+            yield buf.decode_value()
+
+            char = buf.skip_whitespace()
+            buf.pos += 1
+            if char == "]":
+                break
+            if char != ",":
+                raise ValueError("Expecting ',' delimiter at char %d" % (buf.pos - 1))
+
+    if buf.skip_whitespace() is not None:
+        raise ValueError("Extra data at char %d" % buf.pos)
@@ -5,16 +5,20 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__ = type
 
+import copy
 import json
 import sys
+import time
 
-from ansible.module_utils.common.text.converters import to_native
 from ansible.module_utils.six.moves.urllib.error import HTTPError
-from ansible.module_utils.six.moves.urllib.parse import quote_plus
-from ansible.module_utils.urls import open_url
+from ansible.module_utils.six.moves.urllib.parse import quote, quote_plus
 
-from . import debug
+from . import debug, instrumentation, transport
+from .jsonstream import iter_json_array
+from .retry import Failover, RetryPolicy, gave_up
+from .utils import add_query_params, fail_json_once, json_body
 
+URL_AGENT_SELF = "{url}/v1/agent/self"
 URL_ACL_POLICIES = "{url}/v1/acl/policies"
 URL_ACL_POLICY = "{url}/v1/acl/policy/{name}"
 URL_ACL_TOKENS = "{url}/v1/acl/tokens"
@@ -23,6 +27,7 @@ URL_ACL_TOKEN_ID = "{url}/v1/acl/token/{id}"
 URL_ACL_TOKEN_SELF = "{url}/v1/acl/token/self"
 URL_ACL_BOOTSTRAP = "{url}/v1/acl/bootstrap"
 URL_NAMESPACES = "{url}/v1/namespaces"
+URL_NODES = "{url}/v1/nodes"
 URL_NAMESPACE = "{url}/v1/namespace/{name}"
 URL_OPERATOR_SCHEDULER = "{url}/v1/operator/scheduler/configuration"
 URL_CSI_VOLUMES = "{url}/v1/volumes?type=csi&namespace={namespace}"
@@ -34,6 +39,37 @@ URL_JOB = "{url}/v1/job/{id}?namespace={namespace}"
 URL_JOB_DELETE = "{url}/v1/job/{id}?purge={purge}&namespace={namespace}"
 URL_JOB_PARSE = "{url}/v1/jobs/parse?namespace={namespace}"
 URL_JOB_PLAN = "{url}/v1/job/{id}/plan?namespace={namespace}"
+URL_JOB_SUBMISSION = "{url}/v1/job/{id}/submission?version={version}&namespace={namespace}"
+URL_ALLOCATION = "{url}/v1/allocation/{id}?namespace={namespace}"
+URL_EVALUATION = "{url}/v1/evaluation/{id}?namespace={namespace}"
+URL_DEPLOYMENT = "{url}/v1/deployment/{id}?namespace={namespace}"
+URL_DEPLOYMENT_ALLOCATIONS = "{url}/v1/deployment/allocations/{id}?namespace={namespace}"
+URL_VARIABLE = "{url}/v1/var/{path}?namespace={namespace}"
+
+# the url templates above, metrics are reported per template instead of per url
+ENDPOINTS = instrumentation.Endpoints([value for key, value in sorted(globals().items()) if key.startswith("URL_")])
+
+# default max time in seconds a blocking query waits for a change
+DEFAULT_BLOCKING_WAIT = 60
+# default page size used when iterating over list endpoints
+DEFAULT_PER_PAGE = 250
+
+
+def query_meta(headers):
+    """returns the query metadata nomad sends along with read responses"""
+    index = headers.get("X-Nomad-Index")
+    last_contact = headers.get("X-Nomad-LastContact")
+    return dict(
+        index=int(index) if index else None,
+        known_leader=headers.get("X-Nomad-KnownLeader") == "true",
+        last_contact=int(last_contact) if last_contact else None,
+        next_token=headers.get("X-Nomad-NextToken") or None,
+    )
+
+
+def filter_string(value):
+    """quotes a value for use in a nomad filter expression"""
+    return '"%s"' % value.replace("\\", "\\\\").replace('"', '\\"')
 
 
 class NomadAPI(object):
@@ -46,42 +82,130 @@ class NomadAPI(object):
         self.namespace = self.module.params.get("namespace")
         self.validate_certs = self.module.params.get("validate_certs")
         self.connection_timeout = self.module.params.get("connection_timeout")
+        self.retry_policy = RetryPolicy.from_params(self.module.params)
+        self.failover = Failover(self.url, self.module.params.get("failover_urls"))
+        # number of requests that were sent again after a transient failure
+        self.retries = 0
+        # per request metrics, None unless enabled
+        self.metrics = instrumentation.get_recorder(self.module)
         self.headers = {
             "Content-Type": "application/json",
             "X-Nomad-Token": self.management_token,
             "User-Agent": "ansible-module-nomad",
         }
 
-    def api_request(self, url, method, headers=None, body=None, json_response=True, accept_404=False):
+    def with_namespace(self, namespace):
+        """returns a NomadAPI for another namespace, both send their requests over the same connection pool"""
+        if namespace is None or namespace == self.namespace:
+            return self
+        api = copy.copy(self)
+        api.namespace = namespace
+        return api
+
+    def api_request(
+        self,
+        url,
+        method,
+        headers=None,
+        body=None,
+        json_response=True,
+        accept_404=False,
+        accept_403=False,
+        index=None,
+        wait=None,
+        return_meta=False,
+        stream=False,
+        idempotent=None,
+    ):
+        """
+        Sends a request to the nomad API. Reads can be turned into blocking queries
+        by passing the last seen index and the max time (in seconds) to wait for a change.
+        With stream set, a JSON array response is returned as a generator that decodes
+        its elements as they are read.
+        When return_meta is set, a tuple of (response, query meta) is returned.
+        accept_404 and accept_403 return None instead of failing on those status codes.
+        Transient failures are retried according to the retry policy. By default only the
+        methods of the policy are considered idempotent, idempotent overrides that.
+        """
         if headers is None:
             headers = self.headers
-        try:
-            response = open_url(
-                url=url,
+        timeout = self.connection_timeout
+        if index is not None:
+            url = add_query_params(url, index=index, wait=None if wait is None else "%ds" % wait)
+            # nomad adds up to wait/16 of jitter to the wait time
+            if wait is not None:
+                timeout += wait + wait / 16
+        retries = []
+        timings = None
+        if self.metrics is not None:
+            timings = {}
+            start = time.monotonic()
+
+        def record(status, bytes_in):
+            if self.metrics is not None:
+                self.metrics.record(
+                    method,
+                    ENDPOINTS.template(url),
+                    status,
+                    time.monotonic() - start,
+                    timings=timings,
+                    bytes_out=instrumentation.body_size(body),
+                    bytes_in=bytes_in,
+                    retries=len(retries),
+                )
+
+        def send():
+            return transport.request(
+                url=self.failover.url(url),
                 method=method,
                 data=body,
                 headers=headers,
-                timeout=self.connection_timeout,
+                timeout=timeout,
                 validate_certs=self.validate_certs,
+                timings=timings,
             )
-            response_body = response.read().decode("utf-8")
-            debug.log_request(
-                self.module,
-                url,
-                method,
-                body,
-                response.getcode(),
-                response_body,
+
+        def on_retry(retry, error, delay):
+            retries.append(error)
+            self.retries += 1
+            # rate limits apply to the whole cluster, anything else might be specific to the server
+            if not (isinstance(error, HTTPError) and error.code == 429):
+                self.failover.rotate()
+            self.module.warn(
+                "retrying [%s] %s in %.1fs (retry %d of %d): %s"
+                % (method, url, delay, retry + 1, self.retry_policy.retries, error)
             )
-            if json_response:
-                try:
-                    return json.loads(to_native(response_body))
-                except ValueError as e:
-                    self.module.fail_json(msg="API returned invalid JSON: %s" % (str(e)))
+
+        try:
+            response = self.retry_policy.call(send, method, idempotent=idempotent, on_retry=on_retry)
+            if json_response and stream:
+                response_body = self._stream_json_array(response, url, method, body, record)
+            else:
+                response_body = response.read()
+                record(response.getcode(), len(response_body))
+                debug.log_request(
+                    self.module,
+                    url,
+                    method,
+                    body,
+                    response.getcode(),
+                    response_body,
+                )
+                if json_response:
+                    try:
+                        response_body = json.loads(response_body)
+                    except ValueError as e:
+                        fail_json_once(self.module, msg="API returned invalid JSON: %s" % (str(e)))
+                else:
+                    response_body = response_body.decode("utf-8")
+            if return_meta:
+                return response_body, query_meta(response.headers)
             return response_body
 
         except HTTPError as e:
-            response_body = e.read().decode("utf-8")
+            response_body = e.read()
+            record(e.code, len(response_body))
+            response_body = response_body.decode("utf-8")
             debug.log_request(
                 self.module,
                 url,
@@ -90,34 +214,121 @@ class NomadAPI(object):
                 e.code,
                 response_body,
             )
+            if e.code == 403 and accept_403:
+                if return_meta:
+                    return None, query_meta(e.headers)
+                return None
             if e.code == 401 or e.code == 403:
-                self.module.fail_json(
-                    msg="Not Authorized: status=%s [%s] %s ->\n%s" % (e.code, method, url, response_body)
+                fail_json_once(
+                    self.module, msg="Not Authorized: status=%s [%s] %s ->\n%s" % (e.code, method, url, response_body)
                 )
             if e.code == 404 and accept_404:
+                if return_meta:
+                    return None, query_meta(e.headers)
                 return None
 
-            self.module.fail_json(msg="Error: status=%s [%s] %s ->\n%s" % (e.code, method, url, response_body))
+            fail_json_once(
+                self.module,
+                msg="Error: status=%s [%s] %s%s ->\n%s" % (e.code, method, url, gave_up(retries), response_body),
+            )
+
+        except Exception as e:
+            record(None, 0)
+            fail_json_once(
+                self.module,
+                msg="Could not make API call: [%s] %s%s ->\n%s" % (method, url, gave_up(retries), str(e)),
+            )
 
+    def _stream_json_array(self, response, url, method, body, record=None):
+        """yields the elements of a JSON array response as they are decoded"""
+        debug.log_request(self.module, url, method, body, response.getcode(), "<streamed>")
+        try:
+            for item in iter_json_array(response):
+                yield item
+        except ValueError as e:
+            fail_json_once(self.module, msg="API returned invalid JSON: %s" % (str(e)))
         except Exception as e:
-            self.module.fail_json(msg="Could not make API call: [%s] %s ->\n%s" % (method, url, str(e)))
+            fail_json_once(self.module, msg="Could not make API call: [%s] %s ->\n%s" % (method, url, str(e)))
+        finally:
+            # the caller may stop early, try to keep the connection alive anyway
+            getattr(response, "release", response.close)()
+            if record is not None:
+                record(response.getcode(), getattr(response, "bytes_read", None))
+
+    def wait_until(self, read, predicate, timeout, wait=DEFAULT_BLOCKING_WAIT):
+        """
+        Long-polls read with blocking queries until predicate returns True for its result.
+        read must accept the index, wait and return_meta arguments like the getters below.
+        Returns a tuple of (last result, last index, predicate satisfied).
+        """
+        deadline = time.monotonic() + timeout
+        index = 0
+        polls = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            result, meta = read(index=index, wait=max(1, int(min(wait, remaining))), return_meta=True)
+            if predicate(result):
+                return result, meta.get("index"), True
+            if time.monotonic() >= deadline:
+                return result, meta.get("index"), False
+            new_index = meta.get("index")
+            if new_index is None:
+                # no index header (ie. stripped by a proxy), keep blocking on the last index.
+                # without one the reads do not block, poll with a backoff instead.
+                if not index:
+                    time.sleep(min(2**polls, wait, max(0, deadline - time.monotonic())))
+                    polls += 1
+                continue
+            # the index can go backwards (ie. after a snapshot restore). start over if it does.
+            # otherwise it must be at least 1, since an index of 0 never blocks.
+            index = max(new_index, 1) if new_index >= index else 0
+
+    def paginate(self, url, per_page=DEFAULT_PER_PAGE, filter_expr=None):
+        """
+        Generator that yields every item of a list endpoint. Pages are decoded as they are read.
+        The filter expression is evaluated server side. Endpoints that do not support
+        pagination simply return everything in the first page.
+        """
+        next_token = None
+        while True:
+            page, meta = self.api_request(
+                url=add_query_params(url, per_page=per_page, next_token=next_token, filter=filter_expr),
+                method="GET",
+                json_response=True,
+                return_meta=True,
+                stream=True,
+            )
+            for item in page or []:
+                yield item
+            next_token = meta.get("next_token")
+            if next_token is None:
+                return
 
     #
     # ACL Policies
     #
-    def get_acl_policies(self):
+    def get_acl_policies(self, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_ACL_POLICIES.format(url=self.url),
             method="GET",
             json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
-    def get_acl_policy(self, policy_name):
+    def iter_acl_policies(self, per_page=DEFAULT_PER_PAGE, filter_expr=None):
+        return self.paginate(URL_ACL_POLICIES.format(url=self.url), per_page=per_page, filter_expr=filter_expr)
+
+    def get_acl_policy(self, policy_name, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_ACL_POLICY.format(url=self.url, name=policy_name),
             method="GET",
             json_response=True,
             accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
     def delete_acl_policy(self, policy_name):
@@ -134,30 +345,47 @@ class NomadAPI(object):
             method="POST",
             body=body,
             json_response=False,
+            idempotent=True,
         )
 
     #
     # ACL Tokens
     #
-    def get_acl_tokens(self):
+    def get_acl_tokens(self, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_ACL_TOKENS.format(url=self.url),
             method="GET",
             json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
-    def get_acl_token(self, accessor_id):
+    def iter_acl_tokens(self, per_page=DEFAULT_PER_PAGE, filter_expr=None):
+        return self.paginate(URL_ACL_TOKENS.format(url=self.url), per_page=per_page, filter_expr=filter_expr)
+
+    def get_acl_token(self, accessor_id, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_ACL_TOKEN_ID.format(url=self.url, id=accessor_id),
             method="GET",
             json_response=True,
             accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
     def find_acl_token_by_name(self, name):
-        for token in self.get_acl_tokens():
-            if token.get("Name") == name:
-                return self.get_acl_token(token.get("AccessorID"))
+        # let the server do the filtering, but still check the name in case it was ignored
+        filter_expr = None if name is None else "Name == %s" % filter_string(name)
+        tokens = self.iter_acl_tokens(filter_expr=filter_expr)
+        try:
+            match = next((token for token in tokens if token.get("Name") == name), None)
+        finally:
+            # done with the listing, free up its connection before the next request
+            tokens.close()
+        if match is not None:
+            return self.get_acl_token(match.get("AccessorID"))
 
     def delete_acl_token(self, accessor_id):
         return self.api_request(
@@ -181,6 +409,7 @@ class NomadAPI(object):
             method="POST",
             body=body,
             json_response=True,
+            idempotent=True,
         )
 
     def get_self_token(self):
@@ -195,26 +424,70 @@ class NomadAPI(object):
         return self.api_request(
             url=URL_ACL_BOOTSTRAP.format(url=self.url),
             method="POST",
-            body=json.dumps(dict(BootstrapSecret=self.management_token)),
+            body=json_body(dict(BootstrapSecret=self.management_token)),
+            json_response=True,
+        )
+
+    #
+    # Agent
+    #
+    def get_agent_self(self):
+        # requires agent:read, which is not granted to every token
+        return self.api_request(
+            url=URL_AGENT_SELF.format(url=self.url),
+            method="GET",
+            json_response=True,
+            accept_403=True,
+        )
+
+    def get_server_version(self):
+        """returns the nomad version of the agent, or None if the token may not read it"""
+        agent = self.get_agent_self()
+        if agent is None:
+            return None
+        return ((agent.get("config") or {}).get("Version") or {}).get("Version")
+
+    #
+    # Nodes
+    #
+    def get_nodes(self, index=None, wait=None, return_meta=False):
+        return self.api_request(
+            url=URL_NODES.format(url=self.url),
+            method="GET",
             json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
+    def iter_nodes(self, per_page=DEFAULT_PER_PAGE, filter_expr=None):
+        return self.paginate(URL_NODES.format(url=self.url), per_page=per_page, filter_expr=filter_expr)
+
     #
     # Namespaces
     #
-    def get_namespaces(self):
+    def get_namespaces(self, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_NAMESPACES.format(url=self.url),
             method="GET",
             json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
-    def get_namespace(self, name):
+    def iter_namespaces(self, per_page=DEFAULT_PER_PAGE, filter_expr=None):
+        return self.paginate(URL_NAMESPACES.format(url=self.url), per_page=per_page, filter_expr=filter_expr)
+
+    def get_namespace(self, name, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_NAMESPACE.format(url=self.url, name=name),
             method="GET",
             json_response=True,
             accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
     def delete_namespace(self, name):
@@ -231,16 +504,20 @@ class NomadAPI(object):
             method="POST",
             body=body,
             json_response=False,
+            idempotent=True,
         )
 
     #
     # Operator
     #
-    def get_scheduler_config(self):
+    def get_scheduler_config(self, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_OPERATOR_SCHEDULER.format(url=self.url),
             method="GET",
             json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
     def update_scheduler_config(self, body):
@@ -254,19 +531,32 @@ class NomadAPI(object):
     #
     # CSI Volumes
     #
-    def get_csi_volumes(self):
+    def get_csi_volumes(self, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_CSI_VOLUMES.format(url=self.url, namespace=quote_plus(self.namespace)),
             method="GET",
             json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
-    def get_csi_volume(self, id):
+    def iter_csi_volumes(self, per_page=DEFAULT_PER_PAGE, filter_expr=None):
+        return self.paginate(
+            URL_CSI_VOLUMES.format(url=self.url, namespace=quote_plus(self.namespace)),
+            per_page=per_page,
+            filter_expr=filter_expr,
+        )
+
+    def get_csi_volume(self, id, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_CSI_VOLUME.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
             method="GET",
             json_response=True,
             accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
 
     def delete_csi_volume(self, id):
@@ -294,6 +584,7 @@ class NomadAPI(object):
             method="POST",
             body=body,
             json_response=True,
+            idempotent=True,
         )
 
     def plan_job(self, id, body):
@@ -302,6 +593,7 @@ class NomadAPI(object):
             method="POST",
             body=body,
             json_response=True,
+            idempotent=True,
         )
 
     def delete_job(self, id, purge=False):
@@ -317,12 +609,99 @@ class NomadAPI(object):
             method="POST",
             body=body,
             json_response=True,
+            idempotent=True,
         )
 
-    def get_job(self, id):
+    def get_job(self, id, index=None, wait=None, return_meta=False):
         return self.api_request(
             url=URL_JOB.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
             method="GET",
             json_response=True,
             accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+        )
+
+    def get_job_submission(self, id, version):
+        # jobs registered without their source (ie. by nomad < 1.6) have no submission
+        return self.api_request(
+            url=URL_JOB_SUBMISSION.format(url=self.url, id=id, version=version, namespace=quote_plus(self.namespace)),
+            method="GET",
+            json_response=True,
+            accept_404=True,
+        )
+
+    def iter_jobs(self, per_page=DEFAULT_PER_PAGE, filter_expr=None, all_namespaces=False):
+        # job stubs, of every namespace the token can read with all_namespaces
+        return self.paginate(
+            add_query_params(URL_JOBS.format(url=self.url), namespace="*" if all_namespaces else self.namespace),
+            per_page=per_page,
+            filter_expr=filter_expr,
+        )
+
+    #
+    # Allocations
+    #
+    def get_allocation(self, id, index=None, wait=None, return_meta=False):
+        return self.api_request(
+            url=URL_ALLOCATION.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
+            method="GET",
+            json_response=True,
+            accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+        )
+
+    #
+    # Evaluations
+    #
+    def get_evaluation(self, id, index=None, wait=None, return_meta=False):
+        return self.api_request(
+            url=URL_EVALUATION.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
+            method="GET",
+            json_response=True,
+            accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+        )
+
+    #
+    # Deployments
+    #
+    def get_deployment(self, id, index=None, wait=None, return_meta=False):
+        return self.api_request(
+            url=URL_DEPLOYMENT.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
+            method="GET",
+            json_response=True,
+            accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+        )
+
+    def get_deployment_allocations(self, id, index=None, wait=None, return_meta=False):
+        return self.api_request(
+            url=URL_DEPLOYMENT_ALLOCATIONS.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
+            method="GET",
+            json_response=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
+        )
+
+    #
+    # Variables
+    #
+    def get_variable(self, path, index=None, wait=None, return_meta=False):
+        return self.api_request(
+            url=URL_VARIABLE.format(url=self.url, path=quote(path, safe="/"), namespace=quote_plus(self.namespace)),
+            method="GET",
+            json_response=True,
+            accept_404=True,
+            index=index,
+            wait=wait,
+            return_meta=return_meta,
         )
@@ -0,0 +1,114 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import re
+import time
+
+from .nomad import DEFAULT_BLOCKING_WAIT
+
+TERMINAL_EVAL_STATUSES = ("complete", "failed", "canceled")
+TERMINAL_DEPLOYMENT_STATUSES = ("successful", "failed", "cancelled")
+
+# nomad sets this status description when a failed deployment triggers an auto revert
+AUTO_REVERT_PATTERN = re.compile(r"rolling back to job version (\d+)")
+
+
+def watch_deployment(nomad, eval_id, timeout, wait=DEFAULT_BLOCKING_WAIT):
+    """
+    Follows the evaluation created by a job submission to its deployment and long-polls
+    the deployment until it finishes or the timeout (in seconds) is reached.
+
+    Returns a dict describing the outcome. The status is the final deployment status,
+    "no_deployment" when the evaluation did not create one (ie. batch jobs), or
+    "timeout". Task group timings are measured from the start of the watch.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    outcome = dict(
+        eval_id=eval_id,
+        deployment_id=None,
+        status=None,
+        status_description=None,
+        auto_reverted=False,
+        reverted_to_version=None,
+        task_groups={},
+        elapsed=None,
+    )
+
+    def finish(status, description=None):
+        outcome["status"] = status
+        outcome["status_description"] = description
+        outcome["elapsed"] = round(time.monotonic() - start, 3)
+        return outcome
+
+    # the scheduler creates the deployment while processing the evaluation
+    evaluation, _, done = nomad.wait_until(
+        lambda **kwargs: nomad.get_evaluation(eval_id, **kwargs),
+        lambda e: e is not None and e.get("Status") in TERMINAL_EVAL_STATUSES,
+        timeout=max(0, deadline - time.monotonic()),
+        wait=wait,
+    )
+    if not done:
+        return finish("timeout", "timed out waiting for evaluation {}".format(eval_id))
+    if evaluation.get("FailedTGAllocs"):
+        outcome["failed_tg_allocs"] = evaluation.get("FailedTGAllocs")
+    if evaluation.get("Status") != "complete":
+        return finish("failed", evaluation.get("StatusDescription"))
+
+    deployment_id = evaluation.get("DeploymentID")
+    if not deployment_id:
+        return finish("no_deployment")
+    outcome["deployment_id"] = deployment_id
+
+    # record when each task group was first seen fully placed and healthy
+    def observe(deployment):
+        if deployment is None:
+            return False
+        now = round(time.monotonic() - start, 3)
+        for name, group in (deployment.get("TaskGroups") or {}).items():
+            timing = outcome["task_groups"].setdefault(name, dict(placed_after=None, healthy_after=None))
+            desired = group.get("DesiredTotal", 0)
+            timing.update(
+                desired=desired,
+                placed=group.get("PlacedAllocs", 0),
+                healthy=group.get("HealthyAllocs", 0),
+                unhealthy=group.get("UnhealthyAllocs", 0),
+                auto_revert=group.get("AutoRevert", False),
+            )
+            if timing["placed_after"] is None and timing["placed"] >= desired:
+                timing["placed_after"] = now
+            if timing["healthy_after"] is None and timing["healthy"] >= desired:
+                timing["healthy_after"] = now
+        return deployment.get("Status") in TERMINAL_DEPLOYMENT_STATUSES
+
+    deployment, _, done = nomad.wait_until(
+        lambda **kwargs: nomad.get_deployment(deployment_id, **kwargs),
+        observe,
+        timeout=max(0, deadline - time.monotonic()),
+        wait=wait,
+    )
+    if not done:
+        return finish("timeout", "timed out waiting for deployment {}".format(deployment_id))
+
+    # report any allocation that did not become healthy
+    if deployment.get("Status") != "successful":
+        outcome["unhealthy_allocations"] = [
+            dict(
+                ID=alloc.get("ID"),
+                TaskGroup=alloc.get("TaskGroup"),
+                ClientStatus=alloc.get("ClientStatus"),
+            )
+            for alloc in nomad.get_deployment_allocations(deployment_id) or []
+            if not (alloc.get("DeploymentStatus") or {}).get("Healthy")
+        ]
+
+    match = AUTO_REVERT_PATTERN.search(deployment.get("StatusDescription") or "")
+    if deployment.get("Status") == "failed" and match is not None:
+        outcome["auto_reverted"] = True
+        outcome["reverted_to_version"] = int(match.group(1))
+
+    return finish(deployment.get("Status"), deployment.get("StatusDescription"))
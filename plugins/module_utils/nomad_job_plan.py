@@ -0,0 +1,81 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import importlib.util
+
+from .utils import json_body
+
+# import nomad_diff if it is available on the system
+_nomad_diff_available = False
+if importlib.util.find_spec("nomad_diff") is not None:
+    import nomad_diff
+
+    _nomad_diff_available = True
+
+
+def is_unchanged_submission(existing_job, submission, hcl_spec):
+    """
+    returns True when the running version of a job was submitted from the same HCL without
+    variables. Anything inconclusive (no stored source, a stopped job, another format) is
+    left for nomad plan to decide.
+    """
+    if existing_job is None or submission is None or existing_job.get("Stop"):
+        return False
+    if submission.get("Version") != existing_job.get("Version"):
+        return False
+    if submission.get("Format") != "hcl2" or submission.get("VariableFlags") or submission.get("Variables"):
+        return False
+    return submission.get("Source") == hcl_spec
+
+
+def plan_job(nomad, job_id, parsed_job, hcl_spec, existing_job):
+    """
+    Decides if a job needs to be submitted. Planning is expensive, so it is skipped when
+    the running version was submitted from the same HCL. Returns a dict with changed,
+    plan_skipped and the diff (None when there is nothing to show).
+    """
+    outcome = dict(changed=False, plan_skipped=False, diff=None)
+    submission = None
+    if existing_job is not None:
+        submission = nomad.get_job_submission(job_id, existing_job.get("Version", 1))
+    if is_unchanged_submission(existing_job, submission, hcl_spec):
+        outcome["plan_skipped"] = True
+        return outcome
+
+    # we can rely on nomad plan to decide if we should submit a job ;)
+    plan = nomad.plan_job(job_id, json_body(dict(Job=parsed_job, Diff=True)))
+
+    # do a nice diff if the system has nomad_diff available
+    if _nomad_diff_available and plan.get("Diff") is not None:
+        try:
+            outcome["diff"] = dict(prepared=nomad_diff.format(plan["Diff"], colors=True, verbose=False))
+        except:
+            # if we can't get a diff, it's not a big deal...
+            pass
+
+    # if nomad_diff is not available we can try to fallback to a manual diff
+    elif plan.get("Diff") is not None and submission is not None:
+        outcome["diff"] = dict(before=submission.get("Source"), after=hcl_spec)
+
+    outcome["changed"] = plan["Diff"].get("Type") != "None"
+    return outcome
+
+
+def submit_job(nomad, job_id, parsed_job, hcl_spec):
+    """registers a job along with its HCL source, so later runs can compare against it"""
+    return nomad.create_or_update_job(
+        job_id,
+        json_body(
+            dict(
+                Job=parsed_job,
+                Submission=dict(
+                    Format="hcl2",
+                    Source=hcl_spec,
+                ),
+            )
+        ),
+    )
@@ -0,0 +1,79 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import re
+
+from .cache import DEFAULT_CACHE_DIR, FileCache, cache_key
+from .utils import json_body
+
+#
+# A content addressed cache of parsed job specs.
+#
+# Parsing HCL only turns text into JSON, the result is the same as long as the
+# HCL, the namespace and the nomad version are. Parsed jobs are cached on disk
+# under the hash of those, so deploying unchanged jobs skips the parse request.
+# The server version is cached for a shorter while, keyed on the url. Tokens
+# that may not read the version parse every job, as an upgrade of nomad would
+# go unnoticed otherwise.
+#
+
+DEFAULT_PARSE_CACHE_TTL = 7 * 24 * 3600
+PARSE_CACHE_MAX_ENTRIES = 1000
+SERVER_VERSION_TTL = 600
+
+# HCL2 functions that return something new on every parse
+NON_DETERMINISTIC_FUNCTIONS = re.compile(r"\b(uuidv4|timestamp)\s*\(")
+
+
+def parse_cache_argument_spec():
+    """returns the module arguments that configure the parse cache"""
+    return dict(
+        parse_cache=dict(type="bool", default=True),
+        parse_cache_ttl=dict(type="int", default=DEFAULT_PARSE_CACHE_TTL),
+        parse_cache_dir=dict(type="path", default=os.path.join(DEFAULT_CACHE_DIR, "nomad_job_parse")),
+    )
+
+
+def parse_job(nomad, body):
+    """
+    Parses a job with the nomad API unless the same body was parsed before by the same
+    nomad version. body is the request dict, ie. dict(JobHCL=...). Returns a tuple of
+    (parsed job, cached).
+    """
+    params = nomad.module.params
+    hcl = body.get("JobHCL") or ""
+    if not params.get("parse_cache") or NON_DETERMINISTIC_FUNCTIONS.search(hcl):
+        return nomad.parse_job(json_body(body)), False
+
+    directory = params.get("parse_cache_dir")
+    version = _server_version(nomad, directory)
+    if version is None:
+        return nomad.parse_job(json_body(body)), False
+
+    cache = FileCache(directory, params.get("parse_cache_ttl"), max_entries=PARSE_CACHE_MAX_ENTRIES)
+    key = cache_key(version, nomad.namespace, body)
+    parsed = cache.get(key)
+    if parsed is not None:
+        return parsed, True
+
+    parsed = nomad.parse_job(json_body(body))
+    cache.set(key, parsed)
+    return parsed, False
+
+
+def _server_version(nomad, directory):
+    cache = FileCache(os.path.join(directory, "versions"), SERVER_VERSION_TTL)
+    key = cache_key(nomad.url)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["version"]
+    version = nomad.get_server_version()
+    # another token might be allowed to read it
+    if version is not None:
+        cache.set(key, dict(version=version))
+    return version
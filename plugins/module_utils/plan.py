@@ -0,0 +1,91 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import threading
+
+from .utils import diff
+
+#
+# Check mode and --diff for the modules that change things.
+#
+# A module decides what to change from the objects it already read, and hands
+# every change to a Plan along with the call that makes it. In check mode the
+# calls are skipped, so a dry run costs the reads only. Either way the module
+# result reports changed, and the before/after of what changed as the diff.
+#
+
+# fields that never end up in a diff
+SECRET_FIELDS = ("SecretID",)
+
+
+class Plan(object):
+    """
+    Plan makes the changes of a module run, unless the module runs in check mode,
+    and collects their diff. create, update and delete return what the call that
+    makes the change returns, or None when nothing was called.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.before = {}
+        self.after = {}
+        self.changes = 0
+        # changes may be planned from several workers (see utils.run_concurrently)
+        self._lock = threading.Lock()
+
+    @property
+    def changed(self):
+        return self.changes > 0
+
+    def create(self, desired, apply, name=None):
+        """creates an object that does not exist yet"""
+        return self.change({}, desired, apply, name)
+
+    def update(self, existing, desired, apply, name=None):
+        """updates an existing object, if desired is not a subset of it (see utils.diff)"""
+        differences = diff(desired, existing)
+        if not differences:
+            return None
+        before = dict((d["path"], d["existing"]) for d in differences)
+        after = dict((d["path"], d["desired"]) for d in differences)
+        return self.change(before, after, apply, name)
+
+    def delete(self, existing, apply, name=None):
+        """deletes an existing object"""
+        return self.change(existing, {}, apply, name)
+
+    def change(self, before, after, apply, name=None):
+        """makes a change the module worked out itself, before and after have the fields (or paths) that change"""
+        for key, value in _fields(before):
+            self.before[_join(name, key)] = value
+        for key, value in _fields(after):
+            self.after[_join(name, key)] = value
+        return self._apply(apply)
+
+    def _apply(self, apply):
+        with self._lock:
+            self.changes += 1
+        if self.module.check_mode:
+            return None
+        return apply()
+
+    def report(self, result):
+        """adds changed and the diff of the planned changes to the module result"""
+        if self.changed:
+            result["changed"] = True
+            result["diff"] = dict(before=self.before, after=self.after)
+        return result
+
+
+def _fields(obj):
+    return [(key, value) for key, value in (obj or {}).items() if key.split(".", 1)[0] not in SECRET_FIELDS]
+
+
+def _join(name, path):
+    if name is None:
+        return path
+    return "%s.%s" % (name, path) if path else name
@@ -0,0 +1,159 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import random
+import socket
+import ssl
+import time
+
+from ansible.module_utils.six.moves import http_client
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+
+#
+# Retries for transient API failures.
+#
+# Leader elections, rolling server restarts and rate limiting all cause
+# requests to fail for a short while. Those requests are retried with capped
+# exponential backoff (and full jitter, so concurrent module runs do not retry
+# in lockstep). Requests that are not idempotent are only retried when the
+# server can not have processed them. Requests can also fail over to other
+# servers of the cluster, any server forwards requests to the current leader.
+#
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+RETRY_METHODS = ["GET", "HEAD", "PUT", "DELETE", "OPTIONS"]
+
+# the request never reached the server, so it is safe to send it again
+NOT_SENT_ERRORS = (ConnectionRefusedError, socket.gaierror)
+
+
+def retry_argument_spec():
+    """returns the module arguments that configure retries and failover"""
+    return dict(
+        retries=dict(type="int", default=3),
+        retry_backoff=dict(type="float", default=0.5),
+        retry_backoff_max=dict(type="float", default=10.0),
+        retry_jitter=dict(type="bool", default=True),
+        retry_status_codes=dict(type="list", elements="int", default=RETRY_STATUS_CODES),
+        retry_methods=dict(type="list", elements="str", default=RETRY_METHODS),
+        failover_urls=dict(type="list", elements="str", default=[]),
+    )
+
+
+def gave_up(retries):
+    """describes the retries of a failed request for its error message"""
+    return " (gave up after %d retries)" % len(retries) if retries else ""
+
+
+class RetryPolicy(object):
+    """RetryPolicy decides which failed requests are sent again, and when"""
+
+    def __init__(
+        self,
+        retries=3,
+        backoff=0.5,
+        backoff_max=10.0,
+        jitter=True,
+        status_codes=RETRY_STATUS_CODES,
+        methods=RETRY_METHODS,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.status_codes = frozenset(status_codes)
+        self.methods = frozenset(m.upper() for m in methods)
+
+    @classmethod
+    def from_params(cls, params):
+        """creates a policy from the module params, modules without the retry arguments get the defaults"""
+        defaults = dict((name, spec["default"]) for name, spec in retry_argument_spec().items())
+
+        def param(name):
+            value = params.get(name)
+            return defaults[name] if value is None else value
+
+        return cls(
+            retries=param("retries"),
+            backoff=param("retry_backoff"),
+            backoff_max=param("retry_backoff_max"),
+            jitter=param("retry_jitter"),
+            status_codes=param("retry_status_codes"),
+            methods=param("retry_methods"),
+        )
+
+    def is_idempotent(self, method, idempotent=None):
+        """requests can override the method based default, ie. POST requests that upsert by name"""
+        if idempotent is not None:
+            return idempotent
+        return method.upper() in self.methods
+
+    def is_retryable(self, method, error, idempotent=None):
+        if isinstance(error, HTTPError):
+            if error.code not in self.status_codes:
+                return False
+            # rate limited requests are rejected before they are processed
+            return error.code == 429 or self.is_idempotent(method, idempotent)
+        # a bad certificate will not get any better
+        if isinstance(error, ssl.CertificateError) or isinstance(getattr(error, "reason", None), ssl.CertificateError):
+            return False
+        if isinstance(error, NOT_SENT_ERRORS) or isinstance(getattr(error, "reason", None), NOT_SENT_ERRORS):
+            return True
+        # connection resets, timeouts, truncated responses...
+        if isinstance(error, (OSError, http_client.HTTPException)):
+            return self.is_idempotent(method, idempotent)
+        return False
+
+    def backoff_time(self, retry, error=None):
+        """seconds to wait before the given retry (starting at 0). Retry-After is honored up to the cap."""
+        delay = min(self.backoff_max, self.backoff * (2**retry))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        retry_after = getattr(error, "headers", None) and error.headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = max(delay, min(self.backoff_max, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+    def call(self, send, method, idempotent=None, on_retry=None):
+        """
+        Calls send() until it returns and returns its result. Retryable errors are retried
+        with backoff, on_retry(retry, error, delay) is called before each retry.
+        The last error is raised once the request can not be retried anymore.
+        """
+        retry = 0
+        while True:
+            try:
+                return send()
+            except Exception as e:
+                if retry >= self.retries or not self.is_retryable(method, e, idempotent):
+                    raise
+                delay = self.backoff_time(retry, e)
+                if on_retry is not None:
+                    on_retry(retry, e, delay)
+                time.sleep(delay)
+                retry += 1
+
+
+class Failover(object):
+    """Failover rotates requests between the servers of a cluster, sticking to the last one that worked"""
+
+    def __init__(self, url, failover_urls=None):
+        self.base_url = url
+        self.urls = [url] + [u for u in failover_urls or [] if u != url]
+        self.current = 0
+
+    def url(self, url):
+        """rewrites a url built from the base url to point at the current server"""
+        if self.current and url.startswith(self.base_url):
+            return self.urls[self.current] + url[len(self.base_url) :]
+        return url
+
+    def rotate(self):
+        self.current = (self.current + 1) % len(self.urls)
@@ -0,0 +1,402 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import atexit
+import select
+import socket
+import ssl
+import threading
+import time
+from io import BytesIO
+
+from ansible.module_utils.common.text.converters import to_bytes
+from ansible.module_utils.six.moves import http_client
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import urljoin, urlsplit
+from ansible.module_utils.six.moves.urllib.request import getproxies, proxy_bypass
+from ansible.module_utils.urls import open_url
+
+#
+# A small keep-alive transport shared by NomadAPI and ConsulAPI.
+#
+# open_url creates a new TCP (and TLS) connection for every request. Within a
+# single module run we usually talk to the same server several times, so we
+# keep persistent HTTP/1.1 connections around keyed by scheme, host, port and
+# TLS settings. SSLContexts and TLS sessions are cached per key so that even a
+# reconnect can resume the previous TLS session instead of doing a full
+# handshake.
+#
+# If a proxy is configured for the target host, we fall back to open_url so
+# that proxy handling stays exactly the same as before.
+#
+
+# errors that indicate the server closed an idle keep-alive connection on us
+STALE_CONNECTION_ERRORS = (http_client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+# the server may have processed a request before dropping the connection, only these are sent again
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+MAX_IDLE_CONNECTIONS = 8
+# max number of unread bytes we are willing to drain to keep a connection alive
+DRAIN_LIMIT = 64 * 1024
+
+
+def _timed_connect(conn):
+    """
+    Same as HTTPConnection.connect, except that the time spent on the DNS lookup and on
+    connecting are recorded in conn.timings. The resolved addresses are tried in order.
+    """
+    start = time.monotonic()
+    addresses = socket.getaddrinfo(conn.host, conn.port, 0, socket.SOCK_STREAM)
+    resolved = time.monotonic()
+    conn.timings["dns"] = resolved - start
+
+    error = None
+    for family, socktype, proto, _, address in addresses:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(conn.timeout)
+            sock.connect(address)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.sock = sock
+        conn.timings["connect"] = time.monotonic() - resolved
+        return
+    raise error or OSError("getaddrinfo returned no addresses for %s" % conn.host)
+
+
+class _HTTPConnection(http_client.HTTPConnection):
+    """HTTPConnection that can record its connection timings"""
+
+    # set by the pool while a request that records timings is sent
+    timings = None
+
+    def connect(self):
+        if self.timings is None:
+            http_client.HTTPConnection.connect(self)
+        else:
+            _timed_connect(self)
+
+
+class _HTTPSConnection(http_client.HTTPSConnection):
+    """HTTPSConnection that resumes TLS sessions cached by the pool and can record its connection timings"""
+
+    timings = None
+
+    def __init__(self, host, port, timeout, context, pool, key):
+        http_client.HTTPSConnection.__init__(self, host, port, timeout=timeout, context=context)
+        self._pool = pool
+        self._key = key
+
+    def connect(self):
+        if self.timings is None:
+            http_client.HTTPConnection.connect(self)
+        else:
+            _timed_connect(self)
+        start = time.monotonic()
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=self.host,
+            session=self._pool.get_tls_session(self._key),
+        )
+        if self.timings is not None:
+            self.timings["tls"] = time.monotonic() - start
+
+
+class PooledResponse(object):
+    """
+    Wraps an HTTPResponse and returns the connection to the pool once the
+    body has been fully read. Mimics the parts of the open_url response we use.
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = None
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self.bytes_read = 0
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def info(self):
+        return self.headers
+
+    def read(self, amt=None):
+        try:
+            data = self._response.read(amt)
+        except Exception:
+            self.close()
+            raise
+        self.bytes_read += len(data)
+        if amt is None or not data:
+            self._release()
+        return data
+
+    def _release(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            if self._response.will_close:
+                conn.close()
+            else:
+                self._pool.checkin(self._key, conn)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            conn.close()
+
+    def release(self, drain_limit=DRAIN_LIMIT):
+        """
+        Used when the caller is done before reading the whole body. A small remainder is
+        drained so the connection can go back to the pool, otherwise the connection is closed.
+        """
+        drained = 0
+        try:
+            while self._conn is not None and drained <= drain_limit:
+                drained += len(self.read(8192))
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool(object):
+    """ConnectionPool keeps persistent connections per (scheme, host, port, TLS settings)"""
+
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._ssl_contexts = {}
+        self._tls_sessions = {}
+
+    #
+    # TLS
+    #
+    def ssl_context(self, validate_certs=True, ca_path=None, client_cert=None, client_key=None):
+        tls_settings = (validate_certs, ca_path, client_cert, client_key)
+        with self._lock:
+            context = self._ssl_contexts.get(tls_settings)
+            if context is None:
+                if validate_certs:
+                    context = ssl.create_default_context(cafile=ca_path)
+                else:
+                    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                if client_cert is not None:
+                    context.load_cert_chain(client_cert, keyfile=client_key)
+                self._ssl_contexts[tls_settings] = context
+            return context
+
+    def get_tls_session(self, key):
+        with self._lock:
+            return self._tls_sessions.get(key)
+
+    #
+    # Connections
+    #
+    def checkout(self, key, timeout):
+        """returns an idle connection for key or a new (unconnected) one, and if it was reused"""
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                break
+            if _is_connection_dropped(conn):
+                conn.close()
+                continue
+            conn.timeout = timeout
+            conn.sock.settimeout(timeout)
+            return conn, True
+        return self.connect(key, timeout), False
+
+    def connect(self, key, timeout):
+        """returns a new (unconnected) connection for key"""
+        scheme, host, port = key[0], key[1], key[2]
+        if scheme == "https":
+            context = self.ssl_context(*key[3:])
+            return _HTTPSConnection(host, port, timeout, context, self, key)
+        return _HTTPConnection(host, port, timeout=timeout)
+
+    def checkin(self, key, conn):
+        if conn.sock is None:
+            return
+        session = getattr(conn.sock, "session", None)
+        with self._lock:
+            if session is not None:
+                self._tls_sessions[key] = session
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    #
+    # Requests
+    #
+    def request(
+        self,
+        url,
+        method="GET",
+        data=None,
+        headers=None,
+        timeout=10,
+        validate_certs=True,
+        ca_path=None,
+        client_cert=None,
+        client_key=None,
+        timings=None,
+    ):
+        """
+        Sends a request over a pooled connection. Returns a PooledResponse for 2xx responses
+        and raises HTTPError otherwise, just like open_url does.
+        When a timings dict is passed, the connection phases of the (last) request are
+        recorded in it: reused, dns, connect, tls and first_byte, in seconds.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme.lower()
+            if scheme not in ("http", "https") or _use_proxy(scheme, parts.hostname):
+                return open_url(
+                    url=url,
+                    method=method,
+                    data=data,
+                    headers=headers,
+                    timeout=timeout,
+                    validate_certs=validate_certs,
+                    ca_path=ca_path,
+                    client_cert=client_cert,
+                    client_key=client_key,
+                )
+
+            if data is not None and not isinstance(data, bytes):
+                data = to_bytes(data, errors="surrogate_or_strict")
+
+            key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+            if scheme == "https":
+                key += (validate_certs, ca_path, client_cert, client_key)
+
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+
+            response = self._send(key, method, path, data, headers or {}, timeout, timings)
+            response.url = url
+
+            # like open_url, only follow redirects for safe methods
+            location = response.getheader("Location")
+            if response.status in REDIRECT_CODES and method in ("GET", "HEAD") and location is not None:
+                response.read()
+                url = urljoin(url, location)
+                continue
+
+            if response.status >= 400:
+                body = response.read()
+                raise HTTPError(url, response.status, response.reason, response.headers, BytesIO(body))
+
+            return response
+
+        raise HTTPError(url, response.status, "too many redirects", response.headers, BytesIO())
+
+    def _send(self, key, method, path, data, headers, timeout, timings=None):
+        conn, reused = self.checkout(key, timeout)
+        if timings is not None:
+            start = time.monotonic()
+            timings.update(reused=reused, dns=None, connect=None, tls=None)
+            conn.timings = timings
+        sent = False
+        try:
+            conn.request(method, path, body=data, headers=headers)
+            sent = True
+            response = conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            # a reused connection may have been closed by the server while it was idle. Unless the
+            # request was not sent completely, the server may have processed it before closing the
+            # connection, so only safe methods are sent again. Anything else is up to the RetryPolicy.
+            if not reused or (sent and method.upper() not in SAFE_METHODS):
+                raise
+            # another idle connection of the pool may be just as stale, send it over a new one
+            conn, reused = self.connect(key, timeout), False
+            if timings is not None:
+                timings["reused"] = reused
+                conn.timings = timings
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                response = conn.getresponse()
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+        if timings is not None:
+            conn.timings = None
+            timings["first_byte"] = time.monotonic() - start
+        return PooledResponse(self, key, conn, response)
+
+
+def _use_proxy(scheme, host):
+    proxy = getproxies().get(scheme)
+    return bool(proxy) and not proxy_bypass(host)
+
+
+def _is_connection_dropped(conn):
+    """an idle connection that is readable has either been closed by the server or is in a bad state"""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError, socket.error):
+        return True
+    return bool(readable)
+
+
+# a single pool is shared by every API client within a module run
+_POOL = ConnectionPool()
+atexit.register(_POOL.close)
+
+
+def get_pool():
+    return _POOL
+
+
+def request(url, method="GET", data=None, headers=None, timeout=10, validate_certs=True, **kwargs):
+    """request sends a request using the shared connection pool"""
+    return _POOL.request(
+        url,
+        method=method,
+        data=data,
+        headers=headers,
+        timeout=timeout,
+        validate_certs=validate_certs,
+        **kwargs,
+    )
@@ -5,42 +5,246 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__ = type
 
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+
+# per thread state for workers started by run_concurrently
+_worker = threading.local()
+
 
 def del_none(d):
     """
     Delete keys with the value ``None`` in a dictionary, recursively.
-    Returns a copy of the input d.
+    Dicts within lists are pruned too, ``None`` items of lists are kept.
+    Returns a copy of the input d, which is left untouched.
     """
-    cloned = d.copy()
-    for key, value in list(cloned.items()):
-        if value is None:
-            del cloned[key]
-        elif isinstance(value, dict):
-            del_none(value)
-    return cloned
+    if isinstance(d, dict):
+        return dict((key, del_none(value)) for key, value in d.items() if value is not None)
+    if isinstance(d, list):
+        return [del_none(value) for value in d]
+    return d
 
 
-def is_subset(subset, superset):
+def json_body(d, prune=False):
+    """
+    Serializes a request body to compact JSON bytes. Keys are sorted, so equal
+    bodies are equal byte for byte (ie. when hashing them). With prune set, keys
+    with the value ``None`` are deleted first, see del_none.
+    """
+    if prune:
+        d = del_none(d)
+    return json.dumps(d, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def add_query_params(url, **params):
+    """
+    Appends the given query parameters to the url, skipping those set to ``None``.
+    List values are sent as a repeated parameter.
+    """
+    pairs = []
+    for key, value in params.items():
+        if isinstance(value, (list, tuple)):
+            pairs.extend((key, item) for item in value)
+        elif value is not None:
+            pairs.append((key, value))
+    query = urlencode(pairs)
+    if not query:
+        return url
+    return url + ("&" if "?" in url else "?") + query
+
+
+# list items that are dicts are matched by the first of these keys they have
+DIFF_KEYS = ("ID", "Name")
+
+
+def is_subset(subset, superset, keys=DIFF_KEYS):
     """
     Returns True if subset is part of the superset.
     Essentially compares the dicts while ignoring missing fields ;)
+    List items are looked up by key (see DIFF_KEYS) or by hash instead of being
+    compared with every item of the superset, and the comparison stops at the first difference.
     """
 
     # NOTE: match is not available until python 3.10. the target servers have python 3.9 ;(
-    # match subset:
-    #     case dict(_):
-    #         return all(key in superset and is_subset(val, superset[key]) for key, val in subset.items())
-    #     case list(_) | set(_):
-    #         return all(any(is_subset(subitem, superitem) for superitem in superset) for subitem in subset)
-    #     # assume that subset is a plain value if none of the above match
-    #     case _:
-    #         return subset == superset
-
     # using conditional statements instead
     if isinstance(subset, dict):
-        return all(key in superset and is_subset(val, superset[key]) for key, val in subset.items())
+        if not subset:
+            return True
+        if not isinstance(superset, dict):
+            return False
+        for key, val in subset.items():
+            if key not in superset or not is_subset(val, superset[key], keys):
+                return False
+        return True
     elif isinstance(subset, list):
-        return all(any(is_subset(subitem, superitem) for superitem in superset) for subitem in subset)
+        if not subset:
+            return True
+        if not isinstance(superset, list):
+            return False
+        matcher = _ListMatcher(superset, keys)
+        for subitem in subset:
+            if not any(is_subset(subitem, superitem, keys) for superitem in matcher.candidates(subitem)):
+                return False
+        return True
     # assume that subset is a plain value if none of the above match
     else:
         return subset == superset
+
+
+def diff(desired, existing, keys=DIFF_KEYS):
+    """
+    Returns the differences that make desired not a subset of existing (see is_subset),
+    as a list of dict(path, desired, existing). Paths look like
+    TaskGroups[Name=web].Tasks[0].Config.image, the list is empty when nothing differs.
+    """
+    differences = []
+    _diff(desired, existing, keys, (), differences)
+    return differences
+
+
+def diff_to_ansible(differences):
+    """returns the differences in the before/after form ansible shows with --diff"""
+    return dict(
+        before=dict((d["path"], d["existing"]) for d in differences),
+        after=dict((d["path"], d["desired"]) for d in differences),
+    )
+
+
+def _diff(desired, existing, keys, path, differences):
+    if isinstance(desired, dict):
+        if not desired:
+            return
+        if not isinstance(existing, dict):
+            differences.append(dict(path=_path(path), desired=desired, existing=existing))
+            return
+        for key, val in desired.items():
+            if key not in existing:
+                differences.append(dict(path=_path(path + (key,)), desired=val, existing=None))
+            elif not is_subset(val, existing[key], keys):
+                _diff(val, existing[key], keys, path + (key,), differences)
+    elif isinstance(desired, list):
+        if not desired:
+            return
+        if not isinstance(existing, list):
+            differences.append(dict(path=_path(path), desired=desired, existing=existing))
+            return
+        matcher = _ListMatcher(existing, keys)
+        for i, item in enumerate(desired):
+            candidates = matcher.candidates(item)
+            if any(is_subset(item, candidate, keys) for candidate in candidates):
+                continue
+            key = matcher.key_of(item)
+            item_path = path + ((i,) if key is None else ((key, item[key]),))
+            # an item matched by key is compared field by field
+            if key is not None and len(candidates) == 1:
+                _diff(item, candidates[0], keys, item_path, differences)
+            else:
+                differences.append(dict(path=_path(item_path), desired=item, existing=None))
+    elif desired != existing:
+        differences.append(dict(path=_path(path), desired=desired, existing=existing))
+
+
+def _path(parts):
+    path = ""
+    for part in parts:
+        if isinstance(part, int):
+            path += "[%d]" % part
+        elif isinstance(part, tuple):
+            path += "[%s=%s]" % part
+        else:
+            path += "." + part if path else part
+    return path
+
+
+class _ListMatcher(object):
+    """finds the items of a list that can match a given item, without comparing it to all of them"""
+
+    def __init__(self, items, keys):
+        self.items = items
+        self.keys = keys
+        self._indexes = {}
+        self._scalars = None
+
+    def key_of(self, item):
+        """returns the first key of keys the (dict) item has a hashable value for"""
+        if isinstance(item, dict):
+            for key in self.keys:
+                if key in item and _hashable(item[key]):
+                    return key
+        return None
+
+    def candidates(self, item):
+        if isinstance(item, dict):
+            key = self.key_of(item)
+            if key is None:
+                return self.items
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = {}
+                for candidate in self.items:
+                    if isinstance(candidate, dict) and _hashable(candidate.get(key)):
+                        index.setdefault(candidate.get(key), []).append(candidate)
+            return index.get(item[key], [])
+        if isinstance(item, list) or not _hashable(item):
+            return self.items
+        if self._scalars is None:
+            self._scalars = set(candidate for candidate in self.items if _hashable(candidate))
+        return [item] if item in self._scalars else []
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def fail_json_once(module, **kwargs):
+    """
+    Same as module.fail_json, except that within run_concurrently only the first
+    failing worker gets to print a result. Any other failing worker simply exits,
+    run_concurrently raises the error of the first one instead.
+    """
+    fail_lock = getattr(_worker, "fail_lock", None)
+    if fail_lock is None or fail_lock.acquire(False):
+        module.fail_json(**kwargs)
+    raise SystemExit(1)
+
+
+def run_concurrently(func, items, max_workers=4):
+    """
+    Calls func for every item with at most max_workers calls in flight.
+    Returns the results in the same order as items.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    fail_lock = threading.Lock()
+
+    def call(item):
+        _worker.fail_lock = fail_lock
+        return func(item)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        futures = [executor.submit(call, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        except SystemExit:
+            # a worker that lost the race to fail (see fail_json_once). Outside of a module, ie. in the
+            # plugins, fail_json raises an error instead of exiting: raise that rather than a silent exit.
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            for future in futures:
+                if not future.cancelled() and not isinstance(future.exception(), (type(None), SystemExit)):
+                    raise future.exception()
+            raise
+    finally:
+        # if one of the calls failed, don't bother starting the remaining ones
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -8,6 +8,8 @@ import json
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.consul import ConsulAPI
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
 from ..module_utils.utils import del_none, is_subset
 
 
@@ -19,6 +21,7 @@ def run_module():
         connection_timeout=dict(type="int", default=10),
         management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["CONSUL_HTTP_TOKEN"])),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -26,17 +29,22 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the ConsulAPI can init itself via the module args
     consul = ConsulAPI(module)
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+
     existing_token = consul.get_self_token()
     if existing_token is None:
         # when bootstrapping, we should ensure the returned token is the same
-        token = consul.acl_bootstrap()
-        result["changed"] = True
-        if token.get("SecretID") != module.params.get("management_token"):
+        token = plan.create(
+            dict(Description="Bootstrap Token (Global Management)", Policies=[dict(Name="global-management")]),
+            consul.acl_bootstrap,
+        )
+        if token is not None and token.get("SecretID") != module.params.get("management_token"):
             module.fail_json("bootstrap token has unexpected value: " + token.get("SecretID"))
     else:
         is_mgmt = False
@@ -49,6 +57,7 @@ def run_module():
         if not is_mgmt:
             module.fail_json("token provided is not of management type")
 
+    plan.report(result)
     module.exit_json(**result)
 
 
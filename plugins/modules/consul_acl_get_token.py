@@ -7,7 +7,8 @@ import json
 
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
-from ..module_utils.consul import ConsulAPI
+from ..module_utils.consul import CONSISTENCY_MODES, ConsulAPI
+from ..module_utils.retry import retry_argument_spec
 from ..module_utils.utils import del_none, is_subset
 
 
@@ -19,7 +20,10 @@ def run_module():
         connection_timeout=dict(type="int", default=10),
         management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["CONSUL_HTTP_TOKEN"])),
         accessor_id=dict(type="str"),
+        consistency=dict(type="str", choices=CONSISTENCY_MODES, default="default"),
+        max_age=dict(type="int"),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -32,7 +36,15 @@ def run_module():
     # the ConsulAPI can init itself via the module args
     consul = ConsulAPI(module)
 
-    result["token"] = consul.get_acl_token(module.params.get("accessor_id"))
+    # stale reads can be served by followers instead of the leader
+    result["token"], meta = consul.get_acl_token(
+        module.params.get("accessor_id"),
+        return_meta=True,
+        consistency=module.params.get("consistency"),
+        max_age=module.params.get("max_age"),
+    )
+    result["effective_consistency"] = meta.get("effective_consistency")
+    result["cache"] = meta.get("cache")
 
     module.exit_json(**result)
 
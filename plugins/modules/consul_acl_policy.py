@@ -3,12 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.consul import ConsulAPI
-from ..module_utils.utils import del_none, is_subset
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, json_body
 
 
 def run_module():
@@ -25,6 +25,7 @@ def run_module():
         rules=dict(type="str", required=True),
         datacenters=dict(type="list", elements="str"),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -32,7 +33,7 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the ConsulAPI can init itself via the module args
     consul = ConsulAPI(module)
@@ -63,30 +64,35 @@ def run_module():
         if existing_policy is not None:
             policy_id = existing_policy["ID"]
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+
     if module.params.get("state") == "absent":
         if existing_policy is not None:
-            consul.delete_acl_policy(policy_id)
-            result["changed"] = True
+            plan.delete(existing_policy, lambda: consul.delete_acl_policy(policy_id))
         else:
             existing_policy = consul.get_acl_policy_by_name(policy_name)
             if existing_policy is not None:
-                consul.delete_acl_policy(policy_id)
-                result["changed"] = True
+                plan.delete(existing_policy, lambda: consul.delete_acl_policy(existing_policy["ID"]))
 
     if module.params.get("state") == "present":
         if existing_policy is None:
-            result["policy"] = consul.create_acl_policy(json.dumps(desired_policy_body))
-            result["changed"] = True
+            result["policy"] = plan.create(
+                desired_policy_body, lambda: consul.create_acl_policy(json_body(desired_policy_body))
+            )
         else:
             # compare if we need to change anything about the policy
-            if not is_subset(desired_policy_body, existing_policy):
-                result["policy"] = consul.update_acl_policy(policy_id, json.dumps(desired_policy_body))
-                result["changed"] = True
+            result["policy"] = plan.update(
+                existing_policy,
+                desired_policy_body,
+                lambda: consul.update_acl_policy(policy_id, json_body(desired_policy_body)),
+            )
 
     # post final results
     if result.get("policy") is None and existing_policy is not None:
         result["policy"] = existing_policy
 
+    plan.report(result)
     module.exit_json(**result)
 
 
@@ -3,12 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.consul import ConsulAPI
-from ..module_utils.utils import del_none, is_subset
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, json_body
 
 
 def run_module():
@@ -31,6 +31,7 @@ def run_module():
         is_local=dict(type="bool", default=False),
         expiration_ttl=dict(type="str"),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -38,7 +39,7 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the ConsulAPI can init itself via the module args
     consul = ConsulAPI(module)
@@ -87,34 +88,38 @@ def run_module():
     if accessor_id is not None:
         existing_token = consul.get_acl_token(accessor_id)
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+
     # delete token only when it exists
     if module.params.get("state") == "absent":
         if existing_token is not None:
-            consul.delete_acl_token(accessor_id)
-            result["changed"] = True
+            plan.delete(existing_token, lambda: consul.delete_acl_token(accessor_id))
 
     if module.params.get("state") == "present":
         # decide to create a token if accessor_id is not set
         # or one does not already exist
         if accessor_id is None or existing_token is None:
-            result["token"] = consul.create_acl_token(json.dumps(desired_token_body))
-            result["changed"] = True
+            result["token"] = plan.create(
+                desired_token_body, lambda: consul.create_acl_token(json_body(desired_token_body))
+            )
 
         else:
             # compare if we need to change anything about the token
             # NOTE: DO NOT compare expiration
             if desired_token_body.get("ExpirationTTL") is not None:
                 desired_token_body.pop("ExpirationTTL")
-            if not is_subset(desired_token_body, existing_token):
-                result["token"] = consul.update_acl_token(
-                    existing_token.get("AccessorID"), json.dumps(desired_token_body)
-                )
-                result["changed"] = True
+            result["token"] = plan.update(
+                existing_token,
+                desired_token_body,
+                lambda: consul.update_acl_token(existing_token.get("AccessorID"), json_body(desired_token_body)),
+            )
 
     # post final results
     if result.get("token") is None and existing_token is not None:
         result["token"] = existing_token
 
+    plan.report(result)
     module.exit_json(**result)
 
 
@@ -3,12 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.consul import ConsulAPI
-from ..module_utils.utils import del_none, is_subset
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, json_body
 
 
 def run_module():
@@ -25,6 +25,7 @@ def run_module():
         action=dict(type="str"),
         permissions=dict(type="list"),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -32,7 +33,7 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the ConsulAPI can init itself via the module args
     consul = ConsulAPI(module)
@@ -51,23 +52,33 @@ def run_module():
         )
     )
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+    source = module.params.get("source")
+    destination = module.params.get("destination")
+
     if module.params.get("state") == "absent":
         if existing_intention is not None:
-            consul.delete_connect_intention(
-                source=module.params.get("source"),
-                destination=module.params.get("destination"),
+            plan.delete(
+                existing_intention,
+                lambda: consul.delete_connect_intention(source=source, destination=destination),
             )
-            result["changed"] = True
 
     if module.params.get("state") == "present":
-        if existing_intention is None or not is_subset(desired_intention_body, existing_intention):
-            consul.create_or_update_connect_intention(
-                source=module.params.get("source"),
-                destination=module.params.get("destination"),
-                body=json.dumps(desired_intention_body),
+
+        def apply():
+            return consul.create_or_update_connect_intention(
+                source=source,
+                destination=destination,
+                body=json_body(desired_intention_body),
             )
-            result["changed"] = True
 
+        if existing_intention is None:
+            plan.create(desired_intention_body, apply)
+        else:
+            plan.update(existing_intention, desired_intention_body, apply)
+
+    plan.report(result)
     module.exit_json(**result)
 
 
@@ -4,12 +4,51 @@
 
 
 import json
+import os
 
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
-from ..module_utils.consul import ConsulAPI
+from ..module_utils.cache import DEFAULT_CACHE_DIR, FileCache, cache_key
+from ..module_utils.consul import CONSISTENCY_MODES, ConsulAPI
+from ..module_utils.retry import retry_argument_spec
 from ..module_utils.utils import del_none, is_subset
 
+# the fields of a catalog entry (/v1/catalog/service) and where they are in a health entry (/v1/health/service)
+CATALOG_NODE_FIELDS = dict(
+    ID="ID",
+    Node="Node",
+    Address="Address",
+    Datacenter="Datacenter",
+    TaggedAddresses="TaggedAddresses",
+    NodeMeta="Meta",
+)
+CATALOG_SERVICE_FIELDS = dict(
+    ServiceKind="Kind",
+    ServiceID="ID",
+    ServiceName="Service",
+    ServiceTags="Tags",
+    ServiceAddress="Address",
+    ServiceTaggedAddresses="TaggedAddresses",
+    ServiceWeights="Weights",
+    ServiceMeta="Meta",
+    ServicePort="Port",
+    ServiceEnableTagOverride="EnableTagOverride",
+    ServiceProxy="Proxy",
+    ServiceConnect="Connect",
+    CreateIndex="CreateIndex",
+    ModifyIndex="ModifyIndex",
+)
+
+
+def catalog_entry(entry):
+    """returns a health entry ({Node, Service, Checks}) in the shape of a catalog entry"""
+    instance = {}
+    for fields, obj in ((CATALOG_NODE_FIELDS, entry.get("Node")), (CATALOG_SERVICE_FIELDS, entry.get("Service"))):
+        for field, health_field in fields.items():
+            if obj and health_field in obj:
+                instance[field] = obj[health_field]
+    return instance
+
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
@@ -23,7 +62,18 @@ def run_module():
         connection_timeout=dict(type="int", default=10),
         management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["NOMAD_TOKEN"])),
         service_name=dict(type="str", required=True),
+        consistency=dict(type="str", choices=CONSISTENCY_MODES, default="default"),
+        max_age=dict(type="int"),
+        passing_only=dict(type="bool", default=False),
+        tags=dict(type="list", elements="str"),
+        node_meta=dict(type="dict"),
+        filter=dict(type="str"),
+        datacenter=dict(type="str"),
+        near=dict(type="str"),
+        cache_ttl=dict(type="int", default=0),
+        cache_dir=dict(type="path", default=os.path.join(DEFAULT_CACHE_DIR, "consul_services")),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -31,18 +81,75 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the ConsulAPI can init itself via the module args
     consul = ConsulAPI(module)
 
-    result["instances"] = consul.get_service(module.params.get("service_name"))
+    # let consul do the filtering and sorting instead of templating it afterwards
+    service_name = module.params.get("service_name")
+    node_meta = module.params.get("node_meta") or {}
+    params = dict(
+        tag=module.params.get("tags"),
+        filter=module.params.get("filter"),
+        dc=module.params.get("datacenter"),
+        near=module.params.get("near"),
+    )
+    params["node-meta"] = ["{}:{}".format(key, value) for key, value in sorted(node_meta.items())]
+
+    # repeated lookups of the same query (ie. from many hosts in a play) can be served from disk
+    cache = None
+    if module.params.get("cache_ttl") > 0:
+        cache = FileCache(module.params.get("cache_dir"), module.params.get("cache_ttl"))
+        key = cache_key(
+            consul.url,
+            consul.management_token,
+            service_name,
+            module.params.get("passing_only"),
+            module.params.get("consistency"),
+            module.params.get("max_age"),
+            params,
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            result.update(cached)
+            result["cached"] = True
+            module.exit_json(**result)
+
+    # stale and cached reads can be served by followers or the local agent instead of the leader
+    if module.params.get("passing_only"):
+        instances, meta = consul.get_health_service(
+            service_name,
+            passing=True,
+            params=params,
+            return_meta=True,
+            consistency=module.params.get("consistency"),
+            max_age=module.params.get("max_age"),
+        )
+        # the instances have the same shape either way
+        instances = [catalog_entry(entry) for entry in instances or []]
+    else:
+        instances, meta = consul.get_service(
+            service_name,
+            params=params,
+            return_meta=True,
+            consistency=module.params.get("consistency"),
+            max_age=module.params.get("max_age"),
+        )
+    result["instances"] = instances or []
+    result["index"] = meta.get("index")
+    result["effective_consistency"] = meta.get("effective_consistency")
+    result["cache"] = meta.get("cache")
 
     # since the point of this module is to figure out a service IP and port
     # let's throw an error if we don't find one...
     if len(result["instances"]) == 0:
         module.fail_json("could not find consul service named " + module.params.get("service_name"))
 
+    if cache is not None:
+        cache.set(key, dict((k, result[k]) for k in ("instances", "index", "effective_consistency", "cache")))
+    result["cached"] = False
+
     module.exit_json(**result)
 
 
@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.consul import ConsulAPI
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, fail_json_once, is_subset, json_body, run_concurrently
+
+# the intentions of a destination service are a single config entry of this kind
+KIND = "service-intentions"
+
+
+def merge_sources(entry, declared, exclusive):
+    """
+    Returns the sources a service-intentions config entry should have, and the sources that
+    change as two dicts (before and after) by source name. declared maps the name of a source
+    to its desired body, or to None when the source should be absent. With exclusive set,
+    the sources that are not declared are removed.
+    """
+    existing = (entry or {}).get("Sources") or []
+    sources = []
+    before = {}
+    after = {}
+    for source in existing:
+        name = source.get("Name")
+        if name not in declared:
+            if exclusive:
+                before[name] = source
+            else:
+                sources.append(source)
+            continue
+        desired = declared[name]
+        if desired is None:
+            before[name] = source
+        elif is_subset(desired, source):
+            sources.append(source)
+        else:
+            updated = dict(source)
+            # a source has either an action (L4) or permissions (L7), never both
+            if "Permissions" in desired:
+                updated.pop("Action", None)
+            if "Action" in desired:
+                updated.pop("Permissions", None)
+            updated.update(desired)
+            sources.append(updated)
+            before[name] = source
+            after[name] = updated
+
+    names = set(source.get("Name") for source in existing)
+    for name, desired in declared.items():
+        if desired is not None and name not in names:
+            sources.append(desired)
+            after[name] = desired
+    return sources, before, after
+
+
+def source_paths(sources):
+    """keys the changed sources like the paths of utils.diff"""
+    return dict(("Sources[Name=%s]" % name, source) for name, source in sources.items())
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    intention_spec = dict(
+        state=dict(type="str", choices=["present", "absent"], default="present"),
+        source=dict(type="str", required=True),
+        destination=dict(type="str", required=True),
+        action=dict(type="str", choices=["allow", "deny"]),
+        permissions=dict(type="list", elements="dict"),
+        description=dict(type="str"),
+    )
+    module_args = dict(
+        url=dict(type="str", required=True, fallback=(env_fallback, ["CONSUL_HTTP_ADDR"])),
+        validate_certs=dict(type="bool", default=True),
+        connection_timeout=dict(type="int", default=10),
+        management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["CONSUL_HTTP_TOKEN"])),
+        datacenter=dict(type="str"),
+        intentions=dict(
+            type="list",
+            elements="dict",
+            required=True,
+            options=intention_spec,
+            mutually_exclusive=[("action", "permissions")],
+        ),
+        exclusive=dict(type="bool", default=False),
+        cas_retries=dict(type="int", default=3),
+        max_concurrency=dict(type="int", default=4),
+    )
+    module_args.update(retry_argument_spec())
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = dict(
+        changed=False,
+        destinations=[],
+    )
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # validate the desired intentions and group them by destination before we make any requests
+    destinations = {}
+    for intention in module.params.get("intentions"):
+        source, destination = intention.get("source"), intention.get("destination")
+        declared = destinations.setdefault(destination, {})
+        if source in declared:
+            module.fail_json("duplicate consul intention: %s -> %s" % (source, destination))
+        if intention.get("state") == "absent":
+            declared[source] = None
+            continue
+        if intention.get("action") is None and intention.get("permissions") is None:
+            module.fail_json("consul intention %s -> %s needs an action or permissions" % (source, destination))
+        declared[source] = del_none(
+            dict(
+                Name=source,
+                Action=intention.get("action"),
+                Permissions=intention.get("permissions"),
+                Description=intention.get("description"),
+            )
+        )
+
+    # the ConsulAPI can init itself via the module args
+    consul = ConsulAPI(module)
+    params = dict(dc=module.params.get("datacenter"))
+    exclusive = module.params.get("exclusive")
+    cas_retries = module.params.get("cas_retries")
+
+    # fetch every service-intentions entry at once and index them by destination
+    entries = dict((entry.get("Name"), entry) for entry in consul.get_config_entries(KIND, params) or [])
+
+    def write(destination, entry, sources):
+        """writes the sources of a destination unless its entry changed since it was read, returns False if it did"""
+        if not sources:
+            if entry is None:
+                return True
+            return consul.delete_config_entry(KIND, destination, cas=entry.get("ModifyIndex"), params=params)
+        # keep the other fields of the entry (ie. JWT, Meta, Namespace or Partition), the raft indexes are not written
+        body = dict((key, value) for key, value in (entry or {}).items() if key not in ("CreateIndex", "ModifyIndex"))
+        body.update(Kind=KIND, Name=destination, Sources=sources)
+        cas = 0 if entry is None else entry.get("ModifyIndex")
+        return consul.apply_config_entry(json_body(body), cas=cas, params=params)
+
+    # only write the entries that change, none in check mode
+    plan = Plan(module)
+
+    def reconcile(item):
+        destination, declared = item["name"], item["declared"]
+        entry = entries.get(destination)
+        sources, before, after = merge_sources(entry, declared, exclusive)
+        item["sources"] = [source.get("Name") for source in sources]
+        if not before and not after:
+            return
+        item["action"] = "created" if entry is None else "updated" if sources else "deleted"
+
+        def apply():
+            current, current_sources = entry, sources
+            for conflicts in range(cas_retries + 1):
+                if write(destination, current, current_sources):
+                    return conflicts
+                # changed by somebody else since it was read, merge into what it is now
+                current = consul.get_config_entry(KIND, destination, params=params)
+                current_sources, changed_before, changed_after = merge_sources(current, declared, exclusive)
+                if not changed_before and not changed_after:
+                    return conflicts + 1
+            fail_json_once(
+                module,
+                msg="the %s config entry of %s kept changing, gave up after %d cas conflicts"
+                % (KIND, destination, cas_retries + 1),
+            )
+
+        item["conflicts"] = plan.change(source_paths(before), source_paths(after), apply, name=destination) or 0
+
+    items = [
+        dict(name=destination, declared=declared, action="unchanged", sources=[], conflicts=0)
+        for destination, declared in destinations.items()
+    ]
+    run_concurrently(reconcile, items, module.params.get("max_concurrency"))
+
+    # post final results
+    for item in items:
+        item.pop("declared")
+        result["destinations"].append(item)
+
+    plan.report(result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import base64
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+from ansible.module_utils.common.text.converters import to_bytes, to_text
+
+from ..module_utils.consul import TXN_MAX_OPS, ConsulAPI
+from ..module_utils.retry import retry_argument_spec
+
+OPERATION_KINDS = ("KV", "Node", "Service", "Check")
+# verbs that do not change anything
+READ_VERBS = frozenset(["get", "get-tree", "check-index", "check-session", "check-not-exists"])
+# the verb that reads the current entries a KV write would change
+READ_BEFORE = {"set": "get", "delete": "get", "delete-tree": "get-tree"}
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = dict(
+        url=dict(type="str", required=True, fallback=(env_fallback, ["CONSUL_HTTP_ADDR"])),
+        validate_certs=dict(type="bool", default=True),
+        connection_timeout=dict(type="int", default=10),
+        management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["CONSUL_HTTP_TOKEN"])),
+        datacenter=dict(type="str"),
+        operations=dict(type="list", elements="dict", required=True),
+        encode_values=dict(type="bool", default=True),
+        chunk_size=dict(type="int", default=TXN_MAX_OPS),
+    )
+    module_args.update(retry_argument_spec())
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = dict(
+        changed=False,
+        operations=[],
+        results=[],
+        transactions=0,
+    )
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    chunk_size = module.params.get("chunk_size")
+    if chunk_size < 1 or chunk_size > TXN_MAX_OPS:
+        module.fail_json("chunk_size must be between 1 and %d" % TXN_MAX_OPS)
+
+    # every operation is a dict with a single KV, Node, Service or Check operation
+    operations = []
+    for i, operation in enumerate(module.params.get("operations")):
+        if len(operation) != 1 or list(operation)[0] not in OPERATION_KINDS:
+            module.fail_json("operation %d must have exactly one of: %s" % (i, ", ".join(OPERATION_KINDS)))
+        kind = list(operation)[0]
+        op = dict(operation[kind] or {})
+        if kind == "KV" and module.params.get("encode_values") and op.get("Value") is not None:
+            op["Value"] = to_text(base64.b64encode(to_bytes(op["Value"])))
+        operations.append({kind: op})
+
+    # the ConsulAPI can init itself via the module args
+    consul = ConsulAPI(module)
+    params = dict(dc=module.params.get("datacenter"))
+
+    # KV writes that would not change anything are left out. The current entries are read
+    # in transactions as well: get for the keys of set and delete, get-tree for the prefixes
+    # of delete-tree. get fails on a key that does not exist, and the transaction reports
+    # every operation that failed, so the other keys are read again without them.
+    reads = sorted(
+        set(
+            (op["KV"]["Key"], READ_BEFORE[op["KV"]["Verb"]])
+            for op in operations
+            if "KV" in op and op["KV"].get("Verb") in READ_BEFORE
+        )
+    )
+    reads = [dict(KV=dict(Verb=verb, Key=key)) for key, verb in reads]
+    existing = {}
+    for start in range(0, len(reads), chunk_size):
+        chunk = reads[start : start + chunk_size]
+        while chunk:
+            response = consul.txn(chunk, params=params) or {}
+            result["transactions"] += 1
+            errors = response.get("Errors") or []
+            if not errors:
+                for entry in response.get("Results") or []:
+                    entry = entry.get("KV") or {}
+                    existing[entry.get("Key")] = entry
+                break
+            missing = set(error.get("OpIndex") for error in errors)
+            if not missing.issubset(i for i, op in enumerate(chunk) if op["KV"]["Verb"] == "get"):
+                module.fail_json("could not read the current KV entries", errors=errors)
+            chunk = [op for i, op in enumerate(chunk) if i not in missing]
+
+    def is_unchanged(op):
+        kv = op.get("KV")
+        if kv is None:
+            return False
+        current = existing.get(kv.get("Key"))
+        if kv.get("Verb") == "delete":
+            return current is None
+        if kv.get("Verb") == "delete-tree":
+            return not any(key.startswith(kv.get("Key")) for key in existing)
+        if kv.get("Verb") == "set":
+            return (
+                current is not None
+                and (current.get("Value") or "") == (kv.get("Value") or "")
+                and (current.get("Flags") or 0) == (kv.get("Flags") or 0)
+            )
+        return False
+
+    pending = []
+    for op in operations:
+        kind = list(op)[0]
+        report = dict(kind=kind, verb=op[kind].get("Verb"), status="unchanged")
+        if not is_unchanged(op):
+            report["status"] = "pending"
+            pending.append((op, report))
+        result["operations"].append(report)
+
+    writes = [report for _, report in pending if report["verb"] not in READ_VERBS]
+
+    # exit now if in check mode
+    if module.check_mode:
+        result["changed"] = len(writes) > 0
+        module.exit_json(**result)
+
+    outcome = consul.transaction([op for op, _ in pending], params, chunk_size)
+    result["transactions"] += outcome["transactions"]
+    for (_, report), status in zip(pending, outcome["operations"]):
+        report.update(status)
+    result["changed"] = any(report["status"] == "ok" for report in writes)
+
+    # the entries read by get and get-tree, with decoded values
+    for entry in outcome["results"]:
+        kv = entry.get("KV")
+        if kv is not None and module.params.get("encode_values") and kv.get("Value") is not None:
+            entry = dict(entry, KV=dict(kv, Value=to_text(base64.b64decode(kv["Value"]))))
+        result["results"].append(entry)
+
+    if outcome["failed"]:
+        msg = "transaction rolled back"
+        for i, report in enumerate(result["operations"]):
+            if report["status"] == "failed":
+                msg += ", operation {} ({} {}) failed: {}".format(
+                    i, report["kind"], report["verb"], report.get("error")
+                )
+                break
+        module.fail_json(msg=msg, **result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
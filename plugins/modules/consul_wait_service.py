@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.consul import DEFAULT_BLOCKING_WAIT, ConsulAPI
+from ..module_utils.retry import retry_argument_spec
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = dict(
+        url=dict(type="str", required=True, fallback=(env_fallback, ["CONSUL_HTTP_ADDR"])),
+        validate_certs=dict(type="bool", default=True),
+        connection_timeout=dict(type="int", default=10),
+        management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["CONSUL_HTTP_TOKEN"])),
+        service_name=dict(type="str", required=True),
+        passing_instances=dict(type="int", default=1),
+        timeout=dict(type="int", default=300),
+        wait_time=dict(type="int", default=DEFAULT_BLOCKING_WAIT),
+    )
+    module_args.update(retry_argument_spec())
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = dict(
+        changed=False,
+    )
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # the ConsulAPI can init itself via the module args
+    consul = ConsulAPI(module)
+
+    service_name = module.params.get("service_name")
+    passing_instances = module.params.get("passing_instances")
+
+    # blocking queries return as soon as the service health changes on the server,
+    # so there is no need to sleep between checks.
+    start = time.monotonic()
+    instances, index, satisfied = consul.wait_until(
+        lambda **kwargs: consul.get_health_service(service_name, passing=True, **kwargs),
+        lambda instances: len(instances or []) >= passing_instances,
+        timeout=module.params.get("timeout"),
+        wait=module.params.get("wait_time"),
+    )
+
+    result["instances"] = instances or []
+    result["passing"] = len(result["instances"])
+    result["index"] = index
+    result["elapsed"] = round(time.monotonic() - start, 3)
+
+    if not satisfied:
+        module.fail_json(
+            msg="timed out waiting for {} passing instances of consul service {} after {}s".format(
+                passing_instances, service_name, module.params.get("timeout")
+            ),
+            **result,
+        )
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import contextlib
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.aio import AsyncAPI, run
+from ..module_utils.consul import ConsulAPI
+from ..module_utils.nomad import NomadAPI
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, diff, diff_to_ansible
+
+SERVICES = dict(nomad=NomadAPI, consul=ConsulAPI)
+
+
+async def list_scheduler_config(api):
+    config = await api.get_scheduler_config()
+    return [config.get("SchedulerConfig")]
+
+
+# the object types of the desired document, per service: how to list the live objects, the key
+# objects are matched by (and the ID that matches them instead, when it is declared), how to
+# fetch an object when the listing only has a stub of it and the body (as the API returns it)
+# a declared object should be a subset of
+OBJECT_TYPES = dict(
+    nomad=dict(
+        namespaces=dict(
+            list=lambda api: api.iter_namespaces(),
+            key=lambda obj: obj["Name"],
+            get=None,
+            body=lambda d: dict(
+                Name=d["name"],
+                Description=d["description"],
+                Meta=d["meta"],
+                Capabilities=d["capabilities"],
+            ),
+        ),
+        acl_policies=dict(
+            list=lambda api: api.iter_acl_policies(),
+            key=lambda obj: obj["Name"],
+            get=lambda api, stub: api.get_acl_policy(stub["Name"]),
+            body=lambda d: dict(
+                Name=d["name"],
+                Description=d["description"],
+                Rules=d["rules"],
+                JobACL=d["job_acl"]
+                and dict(
+                    Namespace=d["job_acl"]["namespace"],
+                    JobID=d["job_acl"]["job_id"],
+                    Group=d["job_acl"]["group"],
+                    Task=d["job_acl"]["task"],
+                ),
+            ),
+        ),
+        # nomad token names are not unique, tokens are matched by name unless their accessor ID is declared
+        acl_tokens=dict(
+            list=lambda api: api.iter_acl_tokens(),
+            key=lambda obj: obj["Name"],
+            id=lambda obj: obj.get("AccessorID"),
+            get=None,
+            body=lambda d: dict(
+                AccessorID=d["accessor_id"],
+                Name=d["name"],
+                Type=d["type"],
+                Policies=d["policies"],
+                Global=d["is_global"],
+            ),
+        ),
+        scheduler=dict(
+            list=list_scheduler_config,
+            key=lambda obj: "scheduler",
+            get=None,
+            body=lambda d: dict(
+                SchedulerAlgorithm=d["scheduler_algorithm"],
+                MemoryOversubscriptionEnabled=d["memory_oversubscription_enabled"],
+                RejectJobRegistration=d["reject_job_registration"],
+                PauseEvalBroker=d["pause_eval_broker"],
+                PreemptionConfig=d["preemption_config"]
+                and dict(
+                    SystemSchedulerEnabled=d["preemption_config"]["system_scheduler_enabled"],
+                    SysBatchSchedulerEnabled=d["preemption_config"]["sys_batch_scheduler_enabled"],
+                    BatchSchedulerEnabled=d["preemption_config"]["batch_scheduler_enabled"],
+                    ServiceSchedulerEnabled=d["preemption_config"]["service_scheduler_enabled"],
+                ),
+            ),
+        ),
+    ),
+    consul=dict(
+        acl_policies=dict(
+            list=lambda api: api.get_acl_policies(),
+            key=lambda obj: obj["Name"],
+            get=lambda api, stub: api.get_acl_policy(stub["ID"]),
+            body=lambda d: dict(
+                Name=d["name"],
+                Description=d["description"],
+                Rules=d["rules"],
+                Datacenters=d["datacenters"],
+            ),
+        ),
+        # consul tokens have no name, they are matched by description unless their accessor ID is declared
+        acl_tokens=dict(
+            list=lambda api: api.get_acl_tokens(),
+            key=lambda obj: obj["Description"],
+            id=lambda obj: obj.get("AccessorID"),
+            get=None,
+            body=lambda d: dict(
+                AccessorID=d["accessor_id"],
+                Description=d["description"],
+                Policies=d["policies"] and [dict(ID=p["id"], Name=p["name"]) for p in d["policies"]],
+                Roles=d["roles"] and [dict(ID=r["id"], Name=r["name"]) for r in d["roles"]],
+                Local=d["is_local"],
+            ),
+        ),
+        intentions=dict(
+            list=lambda api: api.get_connect_intentions(),
+            key=lambda obj: "%s -> %s" % (obj["SourceName"], obj["DestinationName"]),
+            get=None,
+            body=lambda d: dict(
+                SourceName=d["source"],
+                DestinationName=d["destination"],
+                Action=d["action"],
+                Description=d["description"],
+                Permissions=d["permissions"],
+            ),
+        ),
+    ),
+)
+
+
+class ServiceModule(object):
+    """
+    ServiceModule is the module as the API client of one service sees it: the params have the
+    url and token of that service. Anything else (fail_json, exit_json, metrics) is the module's.
+    """
+
+    def __init__(self, module, service):
+        params = dict(
+            module.params,
+            url=module.params.get(service + "_url"),
+            management_token=module.params.get(service + "_token"),
+            failover_urls=module.params.get(service + "_failover_urls"),
+            namespace="default",
+        )
+        self.__dict__.update(_module=module, params=params)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._module, name, value)
+
+
+def declared_key(spec, body):
+    """the key of a declared object, its ID if the type has one and it is declared"""
+    if spec.get("id") is not None and spec["id"](body):
+        return spec["id"](body)
+    return spec["key"](body)
+
+
+def matches(spec, body, by_key, by_id):
+    """returns the live objects a declared object matches, by its ID if it declares one or else by its key"""
+    if spec.get("id") is not None and spec["id"](body):
+        obj = by_id.get(spec["id"](body))
+        return [] if obj is None else [obj]
+    return by_key.get(spec["key"](body), [])
+
+
+def is_stub(stub, body):
+    """returns True if the listed stub of an object lacks fields the body declares"""
+    return any(stub.get(field) is None for field in body)
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    policies_and_roles_spec = dict(
+        id=dict(type="str"),
+        name=dict(type="str"),
+    )
+    job_acl_spec = dict(
+        namespace=dict(type="str", default=""),
+        job_id=dict(type="str", default=""),
+        group=dict(type="str", default=""),
+        task=dict(type="str", default=""),
+    )
+    preemption_config_spec = dict(
+        system_scheduler_enabled=dict(type="bool"),
+        sys_batch_scheduler_enabled=dict(type="bool"),
+        batch_scheduler_enabled=dict(type="bool"),
+        service_scheduler_enabled=dict(type="bool"),
+    )
+    # apart from the job_acl fields (as in nomad_acl_policy) nothing defaults, only what is declared is compared
+    nomad_spec = dict(
+        namespaces=dict(
+            type="list",
+            elements="dict",
+            options=dict(
+                name=dict(type="str", required=True),
+                description=dict(type="str"),
+                meta=dict(type="dict"),
+                capabilities=dict(type="dict"),
+            ),
+        ),
+        acl_policies=dict(
+            type="list",
+            elements="dict",
+            options=dict(
+                name=dict(type="str", required=True),
+                description=dict(type="str"),
+                rules=dict(type="str"),
+                job_acl=dict(type="dict", options=job_acl_spec),
+            ),
+        ),
+        acl_tokens=dict(
+            type="list",
+            elements="dict",
+            options=dict(
+                name=dict(type="str", required=True),
+                accessor_id=dict(type="str"),
+                type=dict(type="str", choices=["client", "management"]),
+                policies=dict(type="list", elements="str"),
+                is_global=dict(type="bool"),
+            ),
+        ),
+        scheduler=dict(
+            type="dict",
+            options=dict(
+                scheduler_algorithm=dict(type="str", choices=["binpack", "spread"]),
+                memory_oversubscription_enabled=dict(type="bool"),
+                reject_job_registration=dict(type="bool"),
+                pause_eval_broker=dict(type="bool"),
+                preemption_config=dict(type="dict", options=preemption_config_spec),
+            ),
+        ),
+    )
+    consul_spec = dict(
+        acl_policies=dict(
+            type="list",
+            elements="dict",
+            options=dict(
+                name=dict(type="str", required=True),
+                description=dict(type="str"),
+                rules=dict(type="str"),
+                datacenters=dict(type="list", elements="str"),
+            ),
+        ),
+        acl_tokens=dict(
+            type="list",
+            elements="dict",
+            options=dict(
+                description=dict(type="str", required=True),
+                accessor_id=dict(type="str"),
+                policies=dict(type="list", elements="dict", options=policies_and_roles_spec),
+                roles=dict(type="list", elements="dict", options=policies_and_roles_spec),
+                is_local=dict(type="bool"),
+            ),
+        ),
+        intentions=dict(
+            type="list",
+            elements="dict",
+            options=dict(
+                source=dict(type="str", required=True),
+                destination=dict(type="str", required=True),
+                action=dict(type="str", choices=["allow", "deny"]),
+                description=dict(type="str"),
+                permissions=dict(type="list", elements="dict"),
+            ),
+        ),
+    )
+    module_args = dict(
+        nomad_url=dict(type="str", fallback=(env_fallback, ["NOMAD_ADDR"])),
+        nomad_token=dict(type="str", no_log=True, fallback=(env_fallback, ["NOMAD_TOKEN"])),
+        nomad_failover_urls=dict(type="list", elements="str", default=[]),
+        consul_url=dict(type="str", fallback=(env_fallback, ["CONSUL_HTTP_ADDR"])),
+        consul_token=dict(type="str", no_log=True, fallback=(env_fallback, ["CONSUL_HTTP_TOKEN"])),
+        consul_failover_urls=dict(type="list", elements="str", default=[]),
+        validate_certs=dict(type="bool", default=True),
+        connection_timeout=dict(type="int", default=10),
+        desired=dict(
+            type="dict",
+            required=True,
+            options=dict(
+                nomad=dict(type="dict", options=nomad_spec),
+                consul=dict(type="dict", options=consul_spec),
+            ),
+        ),
+        report_unmanaged=dict(type="bool", default=False),
+        fail_on_drift=dict(type="bool", default=False),
+        max_concurrency=dict(type="int", default=8),
+    )
+    module_args.update(retry_argument_spec())
+    # the failover urls are per service
+    module_args.pop("failover_urls")
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = dict(
+        changed=False,
+        drift=False,
+        summary=dict(declared=0, in_sync=0, drifted=0, missing=0, unmanaged=0),
+        objects=[],
+    )
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # the declared objects per service and type, by key
+    declared = {}
+    for service, types in OBJECT_TYPES.items():
+        document = module.params.get("desired").get(service) or {}
+        for name, spec in types.items():
+            objects = document.get(name)
+            if objects is None:
+                continue
+            if isinstance(objects, dict):
+                objects = [objects]
+            bodies = declared.setdefault(service, {})[name] = {}
+            for obj in objects:
+                body = del_none(spec["body"](obj))
+                key = declared_key(spec, body)
+                if key in bodies:
+                    module.fail_json("duplicate %s %s in desired: %s" % (service, name, key))
+                bodies[key] = body
+        if service in declared:
+            for param in ("url", "token"):
+                if not module.params.get(service + "_" + param):
+                    module.fail_json("%s_%s is required to compare the declared %s objects" % (service, param, service))
+
+    async def fetch(api, service, name):
+        """returns the live objects of a type"""
+        spec = OBJECT_TYPES[service][name]
+        live = list(await spec["list"](api))
+        # complete the listed stubs of the declared objects, the others are never looked at
+        if spec["get"] is not None:
+            bodies = declared[service][name]
+            stubs = [
+                (i, obj)
+                for i, obj in enumerate(live)
+                if spec["key"](obj) in bodies and is_stub(obj, bodies[spec["key"](obj)])
+            ]
+            objects = await asyncio.gather(*(spec["get"](api, stub) for _, stub in stubs))
+            for (i, _), obj in zip(stubs, objects):
+                live[i] = obj
+            # deleted since it was listed
+            live = [obj for obj in live if obj is not None]
+        return live
+
+    async def fetch_all():
+        types = [(service, name) for service in declared for name in declared[service]]
+        async with contextlib.AsyncExitStack() as stack:
+            apis = {}
+            for service in declared:
+                client = SERVICES[service](ServiceModule(module, service))
+                apis[service] = await stack.enter_async_context(AsyncAPI(client, module.params.get("max_concurrency")))
+            # every listing of every service at once
+            listings = await asyncio.gather(*(fetch(apis[service], service, name) for service, name in types))
+        return dict(zip(types, listings))
+
+    live = run(fetch_all())
+
+    summary = result["summary"]
+    differences = []
+    for (service, name), objects in live.items():
+        spec = OBJECT_TYPES[service][name]
+        by_key = {}
+        by_id = {}
+        for obj in objects:
+            by_key.setdefault(spec["key"](obj), []).append(obj)
+            if spec.get("id") is not None:
+                by_id[spec["id"](obj)] = obj
+        matched = set()
+        for key, body in declared[service][name].items():
+            summary["declared"] += 1
+            path = "%s.%s[%s]" % (service, name, key)
+            candidates = matches(spec, body, by_key, by_id)
+            # names and descriptions are not unique, nor are consul intentions across namespaces and partitions
+            if len(candidates) > 1:
+                msg = "%s %s %s matches %d objects" % (service, name, key, len(candidates))
+                if spec.get("id") is not None:
+                    msg += ", declare the ID of the one meant: %s" % ", ".join(
+                        sorted(spec["id"](c) for c in candidates)
+                    )
+                module.fail_json(msg)
+            existing = candidates[0] if candidates else None
+            if existing is None:
+                summary["missing"] += 1
+                result["objects"].append(dict(service=service, type=name, key=key, status="missing"))
+                differences.append(dict(path=path, desired=body, existing=None))
+                continue
+            matched.add(id(existing))
+            object_differences = diff(body, existing)
+            if not object_differences:
+                summary["in_sync"] += 1
+                continue
+            summary["drifted"] += 1
+            result["objects"].append(
+                dict(service=service, type=name, key=key, status="drifted", differences=object_differences)
+            )
+            differences.extend(dict(d, path="%s.%s" % (path, d["path"])) for d in object_differences)
+        if module.params.get("report_unmanaged"):
+            unmanaged = [obj for obj in objects if id(obj) not in matched]
+            for obj in sorted(unmanaged, key=spec["key"]):
+                summary["unmanaged"] += 1
+                entry = dict(service=service, type=name, key=spec["key"](obj), status="unmanaged")
+                if spec.get("id") is not None:
+                    entry["id"] = spec["id"](obj)
+                result["objects"].append(entry)
+
+    result["drift"] = summary["drifted"] + summary["missing"] > 0
+    if differences:
+        result["diff"] = diff_to_ansible(differences)
+
+    if result["drift"] and module.params.get("fail_on_drift"):
+        module.fail_json(
+            msg="drift detected: %d drifted and %d missing of %d declared objects"
+            % (summary["drifted"], summary["missing"], summary["declared"]),
+            **result,
+        )
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
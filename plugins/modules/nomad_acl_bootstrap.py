@@ -8,6 +8,8 @@ import json
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
 
 
 def run_module():
@@ -18,6 +20,7 @@ def run_module():
         connection_timeout=dict(type="int", default=10),
         management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["NOMAD_TOKEN"])),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -25,21 +28,24 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the NomadAPI can init itself via the module args
     nomad = NomadAPI(module)
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+
     existing_token = nomad.get_self_token()
     if existing_token is None:
         # when bootstrapping, we should ensure the returned token is the same
-        token = nomad.acl_bootstrap()
-        result["changed"] = True
-        if token.get("SecretID") != module.params.get("management_token"):
+        token = plan.create(dict(Name="Bootstrap Token", Type="management"), nomad.acl_bootstrap)
+        if token is not None and token.get("SecretID") != module.params.get("management_token"):
             module.fail_json("bootstrap token has unexpected value: " + token.get("SecretID"))
     elif existing_token.get("Type") != "management":
         module.fail_json("token provided is not of management type")
 
+    plan.report(result)
     module.exit_json(**result)
 
 
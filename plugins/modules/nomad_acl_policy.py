@@ -3,12 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
-from ..module_utils.utils import del_none, is_subset
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, json_body
 
 
 def run_module():
@@ -30,6 +30,7 @@ def run_module():
         rules=dict(type="str"),
         job_acl=dict(type="dict", default={}, options=job_acl_spec),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -39,7 +40,7 @@ def run_module():
     # the AnsibleModule object
     module = AnsibleModule(
         argument_spec=module_args,
-        supports_check_mode=False,
+        supports_check_mode=True,
         required_if=[("state", "present", ("rules",))],
     )
 
@@ -62,27 +63,30 @@ def run_module():
         )
     )
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+
     if module.params.get("state") == "absent":
         if existing_policy is not None:
-            nomad.delete_acl_policy(policy_name)
-            result["changed"] = True
+            plan.delete(existing_policy, lambda: nomad.delete_acl_policy(policy_name))
 
     if module.params.get("state") == "present":
+
+        def apply():
+            nomad.create_or_update_acl_policy(policy_name, json_body(desired_policy_body))
+            return nomad.get_acl_policy(policy_name)
+
         if existing_policy is None:
-            nomad.create_or_update_acl_policy(policy_name, json.dumps(desired_policy_body))
-            result["policy"] = nomad.get_acl_policy(policy_name)
-            result["changed"] = True
+            result["policy"] = plan.create(desired_policy_body, apply)
         else:
             # compare if we need to change anything about the policy
-            if not is_subset(desired_policy_body, existing_policy):
-                nomad.create_or_update_acl_policy(policy_name, json.dumps(desired_policy_body))
-                result["policy"] = nomad.get_acl_policy(policy_name)
-                result["changed"] = True
+            result["policy"] = plan.update(existing_policy, desired_policy_body, apply)
 
     # post final results
     if result.get("policy") is None and existing_policy is not None:
         result["policy"] = existing_policy
 
+    plan.report(result)
     module.exit_json(**result)
 
 
@@ -3,12 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
-from ..module_utils.utils import del_none, is_subset
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, json_body
 
 
 def run_module():
@@ -35,6 +35,7 @@ def run_module():
         expiration_ttl=dict(type="str"),
         accessor_id=dict(type="str"),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -42,12 +43,12 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # if the acl token is of client type and present, then policies are required
     if module.params.get("type") == "client" and module.params.get("state") == "present":
         policies = module.params.get("policies")
-        if policies is None or policies.len() == 0:
+        if policies is None or len(policies) == 0:
             module.fail_json("policies are required for nomad acl tokens of client type.")
 
     # the NomadAPI can init itself via the module args
@@ -73,28 +74,35 @@ def run_module():
     if module.params.get("accessor_id") is not None:
         existing_token = nomad.get_acl_token(module.params.get("accessor_id"))
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+
     if module.params.get("state") == "absent":
         if existing_token is not None:
-            nomad.delete_acl_token(existing_token.get("AccessorID"))
-            result["changed"] = True
+            plan.delete(existing_token, lambda: nomad.delete_acl_token(existing_token.get("AccessorID")))
 
     if module.params.get("state") == "present":
         if existing_token is None:
-            result["token"] = nomad.create_acl_token(json.dumps(desired_token_body))
-            result["changed"] = True
+            result["token"] = plan.create(
+                desired_token_body, lambda: nomad.create_acl_token(json_body(desired_token_body))
+            )
         else:
             # compare if we need to change anything about the token
             # NOTE: DO NOT compare expiration
             if desired_token_body.get("ExpirationTTL") is not None:
                 desired_token_body.pop("ExpirationTTL")
-            if not is_subset(desired_token_body, existing_token):
-                result["token"] = nomad.update_acl_token(existing_token.get("AccessorID"), json.dumps(existing_token))
-                result["changed"] = True
+            desired_token_body["AccessorID"] = existing_token.get("AccessorID")
+            result["token"] = plan.update(
+                existing_token,
+                desired_token_body,
+                lambda: nomad.update_acl_token(existing_token.get("AccessorID"), json_body(desired_token_body)),
+            )
 
     # post final results
     if result.get("token") is None and existing_token is not None:
         result["token"] = existing_token
 
+    plan.report(result)
     module.exit_json(**result)
 
 
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.nomad import NomadAPI
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, is_subset, json_body, run_concurrently
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    token_spec = dict(
+        state=dict(type="str", choices=["present", "absent"], default="present"),
+        name=dict(type="str", required=True),
+        type=dict(type="str", choices=["client", "management"], default="client"),
+        is_global=dict(type="bool", default=False),
+        policies=dict(type="list", elements="str"),
+        expiration_ttl=dict(type="str"),
+    )
+    module_args = dict(
+        url=dict(type="str", required=True, fallback=(env_fallback, ["NOMAD_ADDR"])),
+        validate_certs=dict(type="bool", default=True),
+        connection_timeout=dict(type="int", default=10),
+        management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["NOMAD_TOKEN"])),
+        tokens=dict(type="list", elements="dict", required=True, options=token_spec),
+        max_concurrency=dict(type="int", default=4),
+    )
+    module_args.update(retry_argument_spec())
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = dict(
+        changed=False,
+        tokens=[],
+    )
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # validate the desired tokens before we make any requests
+    names = set()
+    for token in module.params.get("tokens"):
+        if token.get("name") in names:
+            module.fail_json("duplicate nomad acl token name: " + token.get("name"))
+        names.add(token.get("name"))
+        if token.get("type") == "client" and token.get("state") == "present" and not token.get("policies"):
+            module.fail_json("policies are required for nomad acl tokens of client type: " + token.get("name"))
+
+    # the NomadAPI can init itself via the module args
+    nomad = NomadAPI(module)
+
+    # fetch the token listing once (page by page) and index it by name.
+    # like find_acl_token_by_name, the first token with a matching name wins.
+    existing_tokens = {}
+    for token in nomad.iter_acl_tokens():
+        existing_tokens.setdefault(token.get("Name"), token)
+
+    # decide what needs to happen to each token locally
+    actions = []
+    for token in module.params.get("tokens"):
+        existing_token = existing_tokens.get(token.get("name"))
+        desired_token_body = del_none(
+            dict(
+                Name=token.get("name"),
+                Type=token.get("type"),
+                Policies=token.get("policies"),
+                Global=token.get("is_global"),
+                ExpirationTTL=token.get("expiration_ttl"),
+            )
+        )
+
+        if token.get("state") == "absent":
+            action = "deleted" if existing_token is not None else "unchanged"
+        elif existing_token is None:
+            action = "created"
+        else:
+            # NOTE: DO NOT compare expiration
+            desired_token_body.pop("ExpirationTTL", None)
+            if is_subset(desired_token_body, existing_token):
+                action = "unchanged"
+            else:
+                action = "updated"
+                desired_token_body["AccessorID"] = existing_token.get("AccessorID")
+
+        actions.append(dict(name=token.get("name"), action=action, body=desired_token_body, existing=existing_token))
+
+    # only issue the writes we actually need, none in check mode
+    plan = Plan(module)
+
+    def apply(item):
+        body, existing, name = item["body"], item["existing"], item["name"]
+        if item["action"] == "created":
+            return plan.create(body, lambda: nomad.create_acl_token(json_body(body)), name=name)
+        if item["action"] == "updated":
+            return plan.update(
+                existing,
+                body,
+                lambda: nomad.update_acl_token(existing.get("AccessorID"), json_body(body)),
+                name=name,
+            )
+        if item["action"] == "deleted":
+            plan.delete(existing, lambda: nomad.delete_acl_token(existing.get("AccessorID")), name=name)
+        return None
+
+    writes = [item for item in actions if item["action"] != "unchanged"]
+    responses = run_concurrently(apply, writes, module.params.get("max_concurrency"))
+    for item, response in zip(writes, responses):
+        item["response"] = response
+
+    # post final results
+    for item in actions:
+        token = item.get("response") or item["existing"]
+        result["tokens"].append(dict(name=item["name"], action=item["action"], token=token))
+
+    plan.report(result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
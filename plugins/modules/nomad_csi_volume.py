@@ -3,12 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
-from ..module_utils.utils import del_none, is_subset
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, diff, json_body
 
 
 def run_module():
@@ -36,6 +36,7 @@ def run_module():
         capacity_gb=dict(type="int", required=False),
         parameters=dict(type="dict", required=False),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -44,7 +45,7 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the NomadAPI can init itself via the module args
     nomad = NomadAPI(module)
@@ -93,26 +94,32 @@ def run_module():
     volume_id = module.params.get("id")
     existing_volume = nomad.get_csi_volume(volume_id)
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+
     if module.params.get("state") == "absent":
         if existing_volume is not None:
-            nomad.delete_csi_volume(volume_id)
-            result["changed"] = True
+            plan.delete(existing_volume, lambda: nomad.delete_csi_volume(volume_id))
 
     if module.params.get("state") == "present":
         # NOTE: remember we cannot modify existing CSI volumes.
         #       simply report the mismatch.
         if existing_volume is not None:
-            if not is_subset(desired_volume, existing_volume):
+            differences = diff(desired_volume, existing_volume)
+            if differences:
                 result["mismatched"] = True
+                result["mismatches"] = [d["path"] for d in differences]
         else:
             request_body = {"Volumes": [desired_volume]}
-            result["volume"] = nomad.create_csi_volume(volume_id, json.dumps(request_body))
-            result["changed"] = True
+            result["volume"] = plan.create(
+                desired_volume, lambda: nomad.create_csi_volume(volume_id, json_body(request_body))
+            )
 
     # post final results
     if result.get("volume") is None and existing_volume is not None:
         result["volume"] = existing_volume
 
+    plan.report(result)
     module.exit_json(**result)
 
 
@@ -3,21 +3,13 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
-
-# import nomad_diff if it is available on the system
-_nomad_diff_available = False
-import importlib.util
-
-nomad_diff_spec = importlib.util.find_spec("nomad_diff")
-if nomad_diff_spec is not None:
-    import nomad_diff
-
-    _nomad_diff_available = True
+from ..module_utils.nomad_deployment import watch_deployment
+from ..module_utils.nomad_job_plan import plan_job, submit_job
+from ..module_utils.nomad_parse_cache import parse_cache_argument_spec, parse_job
+from ..module_utils.retry import retry_argument_spec
 
 
 def run_module():
@@ -31,7 +23,11 @@ def run_module():
         name=dict(type="str"),
         namespace=dict(type="str", default="default"),
         hcl_spec=dict(type="str"),
+        wait_for_deployment=dict(type="bool", default=False),
+        deployment_timeout=dict(type="int", default=600),
     )
+    module_args.update(retry_argument_spec())
+    module_args.update(parse_cache_argument_spec())
 
     # the AnsibleModule object
     module = AnsibleModule(
@@ -56,7 +52,8 @@ def run_module():
     if module.params.get("name") is not None:
         job_id = module.params.get("name")
     else:
-        parsed_job = nomad.parse_job(json.dumps(dict(JobHCL=module.params.get("hcl_spec"))))
+        # unchanged HCL is parsed from the local cache instead of the server
+        parsed_job, result["parse_cached"] = parse_job(nomad, dict(JobHCL=module.params.get("hcl_spec")))
         job_id = parsed_job["ID"]
 
     existing_job = nomad.get_job(job_id)
@@ -82,54 +79,36 @@ def run_module():
 
     # we can rely on nomad plan to decide if we should submit a job ;)
     if module.params.get("state") == "present":
-        plan = nomad.plan_job(
-            job_id,
-            json.dumps(
-                dict(
-                    Job=parsed_job,
-                    Diff=True,
-                )
-            ),
-        )
-
-        # do a nice diff if the system has nomad_diff available
-        if _nomad_diff_available and plan.get("Diff") is not None:
-            try:
-                result["diff"] = dict(prepared=nomad_diff.format(plan["Diff"], colors=True, verbose=False))
-            except:
-                # if we can't get a diff, it's not a big deal...
-                pass
-
-        # if nomad_diff is not available we can try to fallback to a manual diff
-        elif plan.get("Diff") is not None and existing_job is not None:
-            submission = nomad.get_job_submission(
-                job_id,
-                existing_job.get("Version", 1),
-            )
-            if submission is not None:
-                result["diff"] = dict(
-                    before=submission.get("Source"),
-                    after=module.params.get("hcl_spec"),
-                )
-
-        if plan["Diff"].get("Type") != "None":
+        # but planning is expensive, it is skipped when the running version was submitted from the same HCL
+        outcome = plan_job(nomad, job_id, parsed_job, module.params.get("hcl_spec"), existing_job)
+        if outcome["plan_skipped"]:
+            result["plan_skipped"] = True
+            module.exit_json(**result)
+        if outcome["diff"] is not None:
+            result["diff"] = outcome["diff"]
+
+        if outcome["changed"]:
             result["changed"] = True
             # exit now if in check mode
             if module.check_mode:
                 module.exit_json(**result)
 
-            result["submit_response"] = nomad.create_or_update_job(
-                job_id,
-                json.dumps(
-                    dict(
-                        Job=parsed_job,
-                        Submission=dict(
-                            Format="hcl2",
-                            Source=module.params.get("hcl_spec"),
-                        ),
+            result["submit_response"] = submit_job(nomad, job_id, parsed_job, module.params.get("hcl_spec"))
+
+            # follow the rollout until the deployment finishes.
+            # periodic and parameterized jobs do not create an evaluation.
+            eval_id = result["submit_response"].get("EvalID")
+            if module.params.get("wait_for_deployment") and eval_id:
+                result["deployment"] = watch_deployment(nomad, eval_id, module.params.get("deployment_timeout"))
+                if result["deployment"]["status"] not in ("successful", "no_deployment"):
+                    module.fail_json(
+                        msg="deployment of job {} did not succeed: {} {}".format(
+                            job_id,
+                            result["deployment"]["status"],
+                            result["deployment"]["status_description"] or "",
+                        ).strip(),
+                        **result,
                     )
-                ),
-            )
 
     module.exit_json(**result)
 
@@ -3,11 +3,11 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
+from ..module_utils.nomad_parse_cache import parse_cache_argument_spec, parse_job
+from ..module_utils.retry import retry_argument_spec
 from ..module_utils.utils import del_none
 
 
@@ -21,6 +21,8 @@ def run_module():
         namespace=dict(type="str", default="default"),
         hcl_spec=dict(type="str", required=True),
     )
+    module_args.update(retry_argument_spec())
+    module_args.update(parse_cache_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -28,20 +30,19 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the NomadAPI can init itself via the module args
     nomad = NomadAPI(module)
 
-    result["parsed"] = nomad.parse_job(
-        json.dumps(
-            del_none(
-                dict(
-                    namespace=module.params.get("namespace"),
-                    JobHCL=module.params.get("hcl_spec"),
-                )
+    result["parsed"], result["cached"] = parse_job(
+        nomad,
+        del_none(
+            dict(
+                namespace=module.params.get("namespace"),
+                JobHCL=module.params.get("hcl_spec"),
             )
-        )
+        ),
     )
 
     module.exit_json(**result)
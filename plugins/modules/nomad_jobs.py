@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.nomad import NomadAPI
+from ..module_utils.nomad_deployment import watch_deployment
+from ..module_utils.nomad_job_plan import plan_job, submit_job
+from ..module_utils.nomad_parse_cache import parse_cache_argument_spec, parse_job
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import run_concurrently
+
+
+def job_key(job):
+    """job IDs are unique per namespace"""
+    return (job["namespace"], job["id"])
+
+
+def submit_waves(jobs):
+    """
+    Groups the jobs into waves, every job comes after the jobs it depends on (the keys in dependencies).
+    Jobs keep their order within a wave. Returns None if the dependencies form a cycle.
+    """
+    waves = []
+    done = set()
+    pending = list(jobs)
+    while pending:
+        wave = [job for job in pending if all(dep in done for dep in job["dependencies"])]
+        if not wave:
+            return None
+        waves.append(wave)
+        done.update(job_key(job) for job in wave)
+        pending = [job for job in pending if job_key(job) not in done]
+    return waves
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    job_spec = dict(
+        hcl_spec=dict(type="str", required=True),
+        namespace=dict(type="str"),
+        depends_on=dict(type="list", elements="str", default=[]),
+    )
+    module_args = dict(
+        url=dict(type="str", required=True, fallback=(env_fallback, ["NOMAD_ADDR"])),
+        validate_certs=dict(type="bool", default=True),
+        connection_timeout=dict(type="int", default=10),
+        management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["NOMAD_TOKEN"])),
+        namespace=dict(type="str", default="default"),
+        jobs=dict(type="list", elements="dict", required=True, options=job_spec),
+        submit_order=dict(type="str", choices=["sequential", "parallel"], default="sequential"),
+        max_concurrency=dict(type="int", default=4),
+        wait_for_deployment=dict(type="bool", default=False),
+        deployment_timeout=dict(type="int", default=600),
+    )
+    module_args.update(retry_argument_spec())
+    module_args.update(parse_cache_argument_spec())
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = dict(
+        changed=False,
+        jobs=[],
+    )
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # the NomadAPI can init itself via the module args, jobs in other namespaces get a copy of it.
+    nomad = NomadAPI(module)
+
+    # parse and plan every job concurrently, nothing is submitted yet
+    def prepare(job):
+        api = nomad.with_namespace(job.get("namespace"))
+        parsed_job, parse_cached = parse_job(api, dict(JobHCL=job.get("hcl_spec")))
+        job_id = parsed_job["ID"]
+        existing_job = api.get_job(job_id)
+        outcome = plan_job(api, job_id, parsed_job, job.get("hcl_spec"), existing_job)
+        return dict(
+            id=job_id,
+            namespace=api.namespace,
+            api=api,
+            parsed=parsed_job,
+            hcl_spec=job.get("hcl_spec"),
+            depends_on=job.get("depends_on"),
+            parse_cached=parse_cached,
+            plan_skipped=outcome["plan_skipped"],
+            changed=outcome["changed"],
+            diff=outcome["diff"],
+        )
+
+    jobs = run_concurrently(prepare, module.params.get("jobs"), module.params.get("max_concurrency"))
+
+    # validate the batch before we submit anything
+    keys = set()
+    namespaces = {}
+    for job in jobs:
+        if job_key(job) in keys:
+            module.fail_json("duplicate nomad job in jobs: {} in namespace {}".format(job["id"], job["namespace"]))
+        keys.add(job_key(job))
+        namespaces.setdefault(job["id"], []).append(job["namespace"])
+    # depends_on names a job of the same namespace, or the only job with that ID
+    for job in jobs:
+        job["dependencies"] = []
+        for dep in job["depends_on"]:
+            if (job["namespace"], dep) in keys:
+                job["dependencies"].append((job["namespace"], dep))
+            elif len(namespaces.get(dep, [])) == 1:
+                job["dependencies"].append((namespaces[dep][0], dep))
+            elif dep in namespaces:
+                module.fail_json(
+                    "nomad job {} depends on {}, which is in several namespaces: {}".format(
+                        job["id"], dep, ", ".join(namespaces[dep])
+                    )
+                )
+            else:
+                module.fail_json("nomad job {} depends on {}, which is not in jobs".format(job["id"], dep))
+    waves = submit_waves(jobs)
+    if waves is None:
+        module.fail_json("the depends_on of jobs form a cycle")
+
+    def report():
+        result["changed"] = any(job["changed"] for job in jobs)
+        result["jobs"] = [
+            dict((k, v) for k, v in job.items() if k not in ("api", "parsed", "hcl_spec", "depends_on", "dependencies"))
+            for job in jobs
+        ]
+        return result
+
+    # exit now if in check mode
+    if module.check_mode:
+        module.exit_json(**report())
+
+    # only submit the changed jobs, wave after wave.
+    # sequential submits one job at a time, in the order of jobs.
+    def submit(job):
+        job["submit_response"] = submit_job(job["api"], job["id"], job["parsed"], job["hcl_spec"])
+
+        # follow the rollout until the deployment finishes.
+        # periodic and parameterized jobs do not create an evaluation.
+        eval_id = job["submit_response"].get("EvalID")
+        if module.params.get("wait_for_deployment") and eval_id:
+            job["deployment"] = watch_deployment(job["api"], eval_id, module.params.get("deployment_timeout"))
+
+    max_workers = 1 if module.params.get("submit_order") == "sequential" else module.params.get("max_concurrency")
+    for wave in waves:
+        run_concurrently(submit, [job for job in wave if job["changed"]], max_workers)
+        failed = [
+            job
+            for job in wave
+            if job.get("deployment") is not None and job["deployment"]["status"] not in ("successful", "no_deployment")
+        ]
+        # jobs that depend on a failed deployment are never submitted
+        if failed:
+            module.fail_json(
+                msg="deployment of job {} did not succeed: {} {}".format(
+                    failed[0]["id"],
+                    failed[0]["deployment"]["status"],
+                    failed[0]["deployment"]["status_description"] or "",
+                ).strip(),
+                **report(),
+            )
+
+    module.exit_json(**report())
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
-from ..module_utils.utils import del_none, is_subset
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import del_none, json_body
 
 
 def run_module():
@@ -23,6 +23,7 @@ def run_module():
         description=dict(type="str"),
         meta=dict(type="str"),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -30,7 +31,7 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the NomadAPI can init itself via the module args
     nomad = NomadAPI(module)
@@ -45,27 +46,25 @@ def run_module():
         )
     )
 
+    # writes are skipped in check mode
+    plan = Plan(module)
+
     if module.params.get("state") == "absent":
         if existing_namespace is not None:
-            nomad.delete_namespace(module.params.get("name"))
-            result["changed"] = True
+            plan.delete(existing_namespace, lambda: nomad.delete_namespace(module.params.get("name")))
 
-    # decide if we should create/update a namespace
-    create_namespace = False
+    # create or update the namespace, if it differs
     if module.params.get("state") == "present":
+
+        def apply():
+            return nomad.create_or_update_namespace(module.params.get("name"), json_body(desired_namespace))
+
         if existing_namespace is None:
-            create_namespace = True
+            plan.create(desired_namespace, apply)
         else:
-            if not is_subset(desired_namespace, existing_namespace):
-                create_namespace = True
-
-    if create_namespace:
-        nomad.create_or_update_namespace(
-            module.params.get("name"),
-            json.dumps(desired_namespace),
-        )
-        result["changed"] = True
+            plan.update(existing_namespace, desired_namespace, apply)
 
+    plan.report(result)
     module.exit_json(**result)
 
 
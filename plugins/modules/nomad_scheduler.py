@@ -3,12 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 
-import json
-
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
-from ..module_utils.utils import is_subset
+from ..module_utils.plan import Plan
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import json_body
 
 
 def run_module():
@@ -30,6 +30,7 @@ def run_module():
         pause_eval_broker=dict(type="bool", default=False),
         preemption_config=dict(type=dict, aliases=["PreemptionConfig"], options=preemption_config_spec),
     )
+    module_args.update(retry_argument_spec())
 
     # seed the final result dict in the object. Default nothing changed ;)
     result = dict(
@@ -37,7 +38,7 @@ def run_module():
     )
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
 
     # the NomadAPI can init itself via the module args
     nomad = NomadAPI(module)
@@ -56,11 +57,12 @@ def run_module():
             ServiceSchedulerEnabled=module.params.get("preemption_config").get("service_scheduler_enabled", False),
         ),
     )
-    if not is_subset(desired_config, existing_config):
-        nomad.update_scheduler_config(json.dumps(desired_config))
-        result["changed"] = True
+    # writes are skipped in check mode
+    plan = Plan(module)
+    plan.update(existing_config, desired_config, lambda: nomad.update_scheduler_config(json_body(desired_config)))
 
     result["scheduler_config"] = desired_config
+    plan.report(result)
     module.exit_json(**result)
 
 
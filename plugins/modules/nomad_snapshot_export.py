@@ -0,0 +1,254 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.aio import AsyncAPI, run
+from ..module_utils.nomad import NomadAPI
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import json_body
+
+STATE_VERSION = 1
+
+# the object types of a snapshot: how to list them, the key of an object within its type
+# and how to fetch the object when the listing only has stubs of it
+OBJECT_TYPES = dict(
+    namespaces=dict(
+        list=lambda api: api.iter_namespaces(),
+        key=lambda stub: stub["Name"],
+        get=None,
+    ),
+    acl_policies=dict(
+        list=lambda api: api.iter_acl_policies(),
+        key=lambda stub: stub["Name"],
+        get=lambda api, stub: api.get_acl_policy(stub["Name"]),
+    ),
+    acl_tokens=dict(
+        list=lambda api: api.iter_acl_tokens(),
+        key=lambda stub: stub["AccessorID"],
+        get=None,
+    ),
+    jobs=dict(
+        list=lambda api: api.iter_jobs(all_namespaces=True),
+        key=lambda stub: "%s/%s" % (stub["Namespace"], stub["ID"]),
+        get=lambda api, stub: api.with_namespace(stub["Namespace"]).get_job(stub["ID"]),
+    ),
+    csi_volumes=dict(
+        list=lambda api: api.with_namespace("*").iter_csi_volumes(),
+        key=lambda stub: "%s/%s" % (stub["Namespace"], stub["ID"]),
+        get=lambda api, stub: api.with_namespace(stub["Namespace"]).get_csi_volume(stub["ID"]),
+    ),
+)
+
+
+class SnapshotWriter(object):
+    """
+    SnapshotWriter appends batches of records to a gzip compressed JSON-lines file.
+    Every batch is a gzip member of its own, so the file can be cut back to the end of
+    the last batch that made it to disk and appended to from there.
+    """
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        with open(path, "ab") as f:
+            f.truncate(offset)
+        self.offset = offset
+
+    def write(self, records):
+        if not records:
+            return
+        with open(self.path, "ab") as f:
+            with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+                for record in records:
+                    gz.write(json_body(record) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self.offset = f.tell()
+
+
+def load_state(path):
+    """returns the export state kept next to the snapshot, or None if there is none"""
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("version") != STATE_VERSION:
+        return None
+    return state
+
+
+def save_state(path, state):
+    """writes the export state, atomically so that an interrupted run never leaves half of it"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = dict(
+        url=dict(type="str", required=True, fallback=(env_fallback, ["NOMAD_ADDR"])),
+        validate_certs=dict(type="bool", default=True),
+        connection_timeout=dict(type="int", default=10),
+        management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["NOMAD_TOKEN"])),
+        dest=dict(type="path", required=True),
+        state_file=dict(type="path"),
+        types=dict(type="list", elements="str", choices=list(OBJECT_TYPES), default=list(OBJECT_TYPES)),
+        mode=dict(type="str", choices=["full", "incremental"], default="full"),
+        resume=dict(type="bool", default=True),
+        max_concurrency=dict(type="int", default=8),
+        batch_size=dict(type="int", default=100),
+    )
+    module_args.update(retry_argument_spec())
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = dict(
+        changed=False,
+        resumed=False,
+        objects={},
+    )
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+
+    dest = module.params.get("dest")
+    state_file = module.params.get("state_file") or dest + ".state"
+    mode = module.params.get("mode")
+    types = [name for name in OBJECT_TYPES if name in module.params.get("types")]
+    batch_size = module.params.get("batch_size")
+    result.update(dest=dest, state_file=state_file)
+
+    # the indexes and the size of the snapshot after the last complete export, and the
+    # progress of an interrupted one. a full export writes a new snapshot next to dest and
+    # moves it onto dest once complete, an incremental one appends what changed (and what
+    # was deleted) to dest, later records win.
+    # an interrupted run is only picked up again by a run with the same mode and types.
+    partial = dest + ".partial"
+    state = load_state(state_file)
+    if state is not None and state["run"] is None and os.path.exists(partial):
+        # the last full export completed, but was not moved onto dest yet
+        os.replace(partial, dest)
+    state = state or dict(version=STATE_VERSION, indexes={}, size=0, run=None)
+    previous = state["indexes"]
+    if (os.path.getsize(dest) if os.path.exists(dest) else 0) < state["size"]:
+        # the snapshot is not the one the state belongs to, start over
+        previous = {}
+        state.update(indexes={}, size=0, run=None)
+    progress = state.get("run")
+    if (
+        module.params.get("resume")
+        and progress
+        and progress["mode"] == mode
+        and progress["types"] == types
+        and (mode == "incremental" or os.path.exists(partial) and os.path.getsize(partial) >= progress["offset"])
+    ):
+        result["resumed"] = True
+    else:
+        start = state["size"] if mode == "incremental" else 0
+        progress = dict(mode=mode, types=types, start=start, offset=start, seen={}, written={}, done=[], counts={})
+        if os.path.exists(partial):
+            # what an interrupted full export left behind
+            os.unlink(partial)
+    state["run"] = progress
+    checksum = module.sha256(dest) if os.path.exists(dest) else None
+    writer = SnapshotWriter(dest if mode == "incremental" else partial, progress["offset"])
+
+    def checkpoint():
+        progress["offset"] = writer.offset
+        save_state(state_file, state)
+
+    async def export_type(api, name, stubs):
+        spec = OBJECT_TYPES[name]
+        counts = dict(listed=len(stubs), exported=0, unchanged=0, deleted=0)
+        progress["counts"][name] = counts
+
+        seen = {}
+        todo = []
+        for stub in stubs:
+            key = "%s/%s" % (name, spec["key"](stub))
+            seen[key] = stub.get("ModifyIndex")
+            if progress["written"].get(key) == seen[key]:
+                # exported before the run was interrupted
+                counts["exported"] += 1
+            elif mode == "incremental" and previous.get(key) == seen[key]:
+                counts["unchanged"] += 1
+            else:
+                todo.append((key, stub))
+
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start : start + batch_size]
+            if spec["get"] is None:
+                objects = [stub for _, stub in batch]
+            else:
+                objects = await asyncio.gather(*(spec["get"](api, stub) for _, stub in batch))
+            records = []
+            for (key, stub), obj in zip(batch, objects):
+                # gone since it was listed, the next export will notice
+                if obj is None:
+                    seen.pop(key)
+                    continue
+                # secrets never end up in a snapshot
+                obj = dict(obj)
+                obj.pop("SecretID", None)
+                records.append(dict(type=name, key=key, modify_index=seen[key], object=obj))
+                progress["written"][key] = seen[key]
+            writer.write(records)
+            counts["exported"] += len(records)
+            checkpoint()
+
+        # objects of the last export that are gone. an incremental export records them.
+        deleted = sorted(key for key in previous if key.startswith(name + "/") and key not in seen)
+        counts["deleted"] = len(deleted)
+        if mode == "incremental":
+            writer.write([dict(type=name, key=key, deleted=True) for key in deleted])
+        progress["seen"].update(seen)
+        progress["done"].append(name)
+        checkpoint()
+
+    async def export():
+        async with AsyncAPI(NomadAPI(module), module.params.get("max_concurrency")) as api:
+            pending = [name for name in types if name not in progress["done"]]
+            # walk the listings of all the types at once, then export type by type
+            listings = await asyncio.gather(*(OBJECT_TYPES[name]["list"](api) for name in pending))
+            for name, stubs in zip(pending, listings):
+                await export_type(api, name, stubs)
+
+    run(export())
+
+    # the export is complete, the next incremental export compares against it.
+    # the snapshot keeps the other types after an incremental export only.
+    indexes = {}
+    if mode == "incremental":
+        indexes = dict((key, index) for key, index in previous.items() if key.split("/", 1)[0] not in types)
+    indexes.update(progress["seen"])
+    save_state(state_file, dict(version=STATE_VERSION, indexes=indexes, size=writer.offset, run=None))
+
+    result["objects"] = progress["counts"]
+    if mode == "incremental":
+        result["changed"] = writer.offset > progress["start"]
+    else:
+        result["changed"] = module.sha256(partial) != checksum
+        os.replace(partial, dest)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.nomad import DEFAULT_BLOCKING_WAIT, NomadAPI
+from ..module_utils.retry import retry_argument_spec
+from ..module_utils.utils import is_subset
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = dict(
+        state=dict(type="str", choices=["present", "absent"], default="present"),
+        url=dict(type="str", required=True, fallback=(env_fallback, ["NOMAD_ADDR"])),
+        validate_certs=dict(type="bool", default=True),
+        connection_timeout=dict(type="int", default=10),
+        management_token=dict(type="str", required=True, no_log=True, fallback=(env_fallback, ["NOMAD_TOKEN"])),
+        namespace=dict(type="str", default="default"),
+        type=dict(type="str", choices=["job", "allocation", "volume"], required=True),
+        id=dict(type="str", required=True),
+        conditions=dict(type="dict", default={}),
+        timeout=dict(type="int", default=300),
+        wait_time=dict(type="int", default=DEFAULT_BLOCKING_WAIT),
+    )
+    module_args.update(retry_argument_spec())
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = dict(
+        changed=False,
+    )
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # the NomadAPI can init itself via the module args
+    nomad = NomadAPI(module)
+
+    readers = dict(
+        job=nomad.get_job,
+        allocation=nomad.get_allocation,
+        volume=nomad.get_csi_volume,
+    )
+    read = readers[module.params.get("type")]
+    object_id = module.params.get("id")
+    conditions = module.params.get("conditions")
+
+    # when absent, wait for the object to disappear.
+    # otherwise wait for it to exist and match all of the conditions.
+    def predicate(obj):
+        if module.params.get("state") == "absent":
+            return obj is None
+        return obj is not None and is_subset(conditions, obj)
+
+    # blocking queries return as soon as the object changes on the server,
+    # so there is no need to sleep between checks.
+    start = time.monotonic()
+    obj, index, satisfied = nomad.wait_until(
+        lambda **kwargs: read(object_id, **kwargs),
+        predicate,
+        timeout=module.params.get("timeout"),
+        wait=module.params.get("wait_time"),
+    )
+
+    result["object"] = obj
+    result["index"] = index
+    result["elapsed"] = round(time.monotonic() - start, 3)
+
+    if not satisfied:
+        module.fail_json(
+            msg="timed out waiting for nomad {} {} after {}s".format(
+                module.params.get("type"), object_id, module.params.get("timeout")
+            ),
+            **result,
+        )
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
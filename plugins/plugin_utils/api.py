@@ -0,0 +1,41 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from ansible.errors import AnsibleError
+
+#
+# Lets the controller side plugins (inventory, lookups) use the NomadAPI and
+# ConsulAPI clients of the modules. Retries, keep-alive connections and metrics
+# work the same, failures are raised as AnsibleError instead of exiting.
+#
+
+
+class ModuleShim(object):
+    """stands in for the AnsibleModule the API clients expect"""
+
+    def __init__(self, name, params, display):
+        self._name = name
+        self.params = params
+        self.display = display
+
+    def warn(self, msg):
+        self.display.warning(msg)
+
+    def fail_json(self, msg=None, **kwargs):
+        raise AnsibleError("%s: %s" % (self._name, msg))
+
+
+def api_params(url, token, validate_certs=True, connection_timeout=10, namespace="default"):
+    """returns the module params the API clients init themselves with"""
+    return dict(
+        url=url,
+        # anonymous requests, unless a token is set
+        management_token=token or "",
+        namespace=namespace,
+        validate_certs=validate_certs,
+        connection_timeout=connection_timeout,
+    )
@@ -0,0 +1,198 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+#
+# Benchmarks of the modules against in-process fake nomad and consul servers.
+#
+#   pytest tests/benchmarks --fake-latency=0.002 --fake-payload-size=1000
+#
+# Every benchmark reports the requests and connections a single module run
+# needs, along with its peak (python) memory, in the benchmark extra_info.
+#
+
+import contextlib
+import importlib
+import json
+import os
+import sys
+import tracemalloc
+from unittest import mock
+
+import pytest
+
+# the modules are imported as plugins.modules.<name> from the root of the repo
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT)
+
+from ansible.module_utils import basic
+from ansible.module_utils.common.text.converters import to_bytes
+from ansible.plugins.loader import init_plugin_loader
+from fake_server import CONSUL_TOKEN, NOMAD_TOKEN, FakeConsul, FakeNomad
+
+from plugins.module_utils import transport
+
+try:
+    from ansible.module_utils.testing import patch_module_args
+except ImportError:
+    # ansible-core < 2.19
+
+    @contextlib.contextmanager
+    def patch_module_args(args=None):
+        serialized = to_bytes(json.dumps(dict(ANSIBLE_MODULE_ARGS=args or {})))
+        with mock.patch.object(basic, "_ANSIBLE_ARGS", serialized):
+            yield
+
+
+DEFAULT_ROUNDS = 10
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("fake servers")
+    group.addoption(
+        "--fake-latency",
+        type=float,
+        default=0.0,
+        help="seconds the fake nomad and consul servers wait before answering a request",
+    )
+    group.addoption(
+        "--fake-payload-size",
+        type=int,
+        default=50,
+        help="number of objects seeded into every collection of the fake servers",
+    )
+
+
+class ModuleExit(SystemExit):
+    """raised instead of printing the result and exiting, like a real module run would"""
+
+    def __init__(self, result):
+        super().__init__(1 if result.get("failed") else 0)
+        self.result = result
+
+
+def _exit_json(self, **kwargs):
+    raise ModuleExit(kwargs)
+
+
+def _fail_json(self, msg=None, **kwargs):
+    kwargs.update(failed=True, msg=msg)
+    raise ModuleExit(kwargs)
+
+
+def call_module(name, args):
+    """runs plugins/modules/<name>.py with the given args and returns its result"""
+    module = importlib.import_module("plugins.modules." + name)
+    # every module runs in a new process, so it never starts with pooled connections
+    transport.get_pool().close()
+    with patch_module_args(args), mock.patch.multiple(basic.AnsibleModule, exit_json=_exit_json, fail_json=_fail_json):
+        try:
+            module.run_module()
+        except ModuleExit as e:
+            return e.result
+    raise AssertionError("module %s returned without calling exit_json or fail_json" % name)
+
+
+class ModuleRun(object):
+    def __init__(self, result, requests, connections, peak_memory):
+        self.result = result
+        self.requests = requests
+        self.connections = connections
+        self.peak_memory = peak_memory
+
+
+@pytest.fixture(scope="session")
+def fake_options(request):
+    return dict(
+        latency=request.config.getoption("--fake-latency"),
+        payload_size=request.config.getoption("--fake-payload-size"),
+    )
+
+
+@pytest.fixture(scope="session")
+def _nomad_server(fake_options):
+    server = FakeNomad(**fake_options).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def _consul_server(fake_options):
+    server = FakeConsul(**fake_options).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def collection(tmp_path_factory):
+    """the repo installed as the gbolo.hashicorp collection, plugins load through the ansible plugin loaders"""
+    path = tmp_path_factory.mktemp("collections")
+    namespace = path / "ansible_collections" / "gbolo"
+    namespace.mkdir(parents=True)
+    (namespace / "hashicorp").symlink_to(ROOT)
+    init_plugin_loader([str(path)])
+    return "gbolo.hashicorp"
+
+
+@pytest.fixture(autouse=True)
+def _home(tmp_path, monkeypatch):
+    """keeps the on-disk caches of the modules out of the real home directory"""
+    monkeypatch.setenv("HOME", str(tmp_path))
+
+
+@pytest.fixture
+def nomad(_nomad_server):
+    """the fake nomad server, with freshly seeded state"""
+    _nomad_server.reset()
+    return _nomad_server
+
+
+@pytest.fixture
+def consul(_consul_server):
+    """the fake consul server, with freshly seeded state"""
+    _consul_server.reset()
+    return _consul_server
+
+
+@pytest.fixture
+def nomad_args(nomad):
+    return dict(url=nomad.url, management_token=NOMAD_TOKEN)
+
+
+@pytest.fixture
+def consul_args(consul):
+    return dict(url=consul.url, management_token=CONSUL_TOKEN)
+
+
+@pytest.fixture
+def run_module(benchmark):
+    """
+    Benchmarks a module against a fake server and returns a ModuleRun for a single
+    run of it. setup is called before every run, ie. to undo the changes of the previous
+    run when benchmarking a module that creates something.
+    """
+
+    def run(name, args, server, setup=None, rounds=DEFAULT_ROUNDS):
+        # measure the module, not the first import of it
+        importlib.import_module("plugins.modules." + name)
+        if setup is not None:
+            setup()
+        server.reset_stats()
+        tracemalloc.start()
+        try:
+            result = call_module(name, args)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        measured = ModuleRun(result, len(server.requests), server.connections, peak_memory)
+        assert not result.get("failed"), result.get("msg")
+
+        benchmark.extra_info.update(
+            requests=measured.requests,
+            connections=measured.connections,
+            peak_memory_kib=round(peak_memory / 1024.0, 1),
+            payload_size=server.payload_size,
+        )
+        benchmark.pedantic(call_module, args=(name, args), setup=setup, rounds=rounds, iterations=1)
+        return measured
+
+    return run
@@ -0,0 +1,1185 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+#
+# In-process fakes of the nomad and consul HTTP APIs used by the modules.
+#
+# They keep just enough state in memory for the modules to behave like they
+# do against a real cluster (ie. a second run reports no changes), speak
+# HTTP/1.1 with keep-alive, and record every request and connection so the
+# benchmarks can assert on them. Blocking queries are answered right away.
+#
+
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+NOMAD_TOKEN = "00000000-0000-4000-8000-00000000000a"
+CONSUL_TOKEN = "00000000-0000-4000-8000-00000000000b"
+
+FILTER_PATTERN = re.compile(r'^(\w+) == "((?:[^"\\]|\\.)*)"$')
+
+
+def fake_id(*parts):
+    """returns a stable uuid for the given parts"""
+    return str(uuid.UUID(hashlib.md5("/".join(str(p) for p in parts).encode("utf-8")).hexdigest()))
+
+
+def route(method, pattern):
+    """marks a FakeServer method as the handler of method requests to paths matching pattern"""
+
+    def decorator(func):
+        func.route = (method, re.compile(pattern))
+        return func
+
+    return decorator
+
+
+class Response(object):
+    def __init__(self, code, data=None, headers=None):
+        self.code = code
+        self.data = data
+        self.headers = headers or {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # like the go http servers of nomad and consul, otherwise small responses wait for delayed acks
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.fake.lock:
+            self.server.fake.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        parts = urlsplit(self.path)
+        query = dict((k, v[-1]) for k, v in parse_qs(parts.query, keep_blank_values=True).items())
+
+        if fake.latency:
+            time.sleep(fake.latency)
+        with fake.lock:
+            fake.requests.append((self.command, self.path))
+            response = fake.dispatch(self.command, unquote(parts.path), query, self.headers, body)
+
+        if response.data is None:
+            out = b""
+        elif isinstance(response.data, str):
+            out = response.data.encode("utf-8")
+        else:
+            out = json.dumps(response.data).encode("utf-8")
+        self.send_response(response.code)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    do_GET = do_POST = do_PUT = do_DELETE = respond
+
+
+class FakeServer(object):
+    """
+    Base class of the fakes. Subclasses keep their state in self.state and register
+    handlers with the route decorator. A handler receives the query parameters, request
+    headers, decoded JSON body (if any) and path groups, and returns a Response.
+    """
+
+    index_header = None
+    token_header = None
+    management_token = None
+
+    def __init__(self, latency=0.0, payload_size=50):
+        self.latency = latency
+        self.payload_size = payload_size
+        self.lock = threading.RLock()
+        self.routes = [
+            getattr(self, name).route + (getattr(self, name),)
+            for name in dir(type(self))
+            if hasattr(getattr(type(self), name), "route")
+        ]
+        # static paths first, ie. /token/self before /token/<id>
+        self.routes.sort(key=lambda r: r[1].groups)
+        self.reset()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self.url = "http://127.0.0.1:%d" % self._httpd.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self):
+        """restores the seeded state and clears the recorded requests"""
+        with self.lock:
+            self.index = 1
+            self.state = self.seed()
+            self.faults = []
+            self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = []
+            self.connections = 0
+
+    def seed(self):
+        raise NotImplementedError
+
+    def fail_next(self, count, code=500, message="No cluster leader", headers=None, method=None, path=None):
+        """makes the next count requests (using method and starting with path, if set) fail with the given response"""
+        with self.lock:
+            self.faults.extend((method, path, Response(code, message, dict(headers or {}))) for _ in range(count))
+
+    def bump(self):
+        """increments and returns the raft index, like every write does"""
+        self.index += 1
+        return self.index
+
+    def dispatch(self, method, path, query, headers, body):
+        for fault in self.faults:
+            if fault[0] in (None, method) and (fault[1] is None or path.startswith(fault[1])):
+                self.faults.remove(fault)
+                return fault[2]
+        if headers.get(self.token_header) != self.management_token and not self.is_anonymous(method, path):
+            return Response(403, "Permission denied")
+        if body:
+            try:
+                body = json.loads(body)
+            except ValueError as e:
+                return Response(400, "invalid json: %s" % e)
+        for route_method, pattern, handler in self.routes:
+            if route_method != method:
+                continue
+            match = pattern.fullmatch(path)
+            if match is not None:
+                response = handler(query, headers, body, *match.groups())
+                response.headers.setdefault(self.index_header, str(self.index))
+                return response
+        return Response(404, "no route for %s %s" % (method, path))
+
+    def is_anonymous(self, method, path):
+        """requests that do not need the management token"""
+        return False
+
+    def listing(self, items, query, key):
+        """applies the filter, per_page and next_token query parameters nomad supports to a list"""
+        match = FILTER_PATTERN.match(query.get("filter", ""))
+        if match is not None:
+            field, value = match.group(1), match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            items = [item for item in items if item.get(field) == value]
+        next_token = query.get("next_token")
+        if next_token:
+            items = [item for item in items if item[key] >= next_token]
+        headers = {}
+        per_page = int(query.get("per_page") or 0)
+        if per_page and len(items) > per_page:
+            headers["X-Nomad-NextToken"] = items[per_page][key]
+            items = items[:per_page]
+        return Response(200, items, headers)
+
+
+class FakeNomad(FakeServer):
+    index_header = "X-Nomad-Index"
+    token_header = "X-Nomad-Token"
+    management_token = NOMAD_TOKEN
+    version = "1.7.2"
+
+    def seed(self):
+        state = dict(
+            bootstrapped=True,
+            tokens={},
+            policies={},
+            namespaces={},
+            volumes={},
+            jobs={},
+            submissions={},
+            evaluations={},
+            deployments={},
+            allocations={},
+            nodes={},
+            variables={},
+            scheduler=dict(
+                SchedulerAlgorithm="binpack",
+                MemoryOversubscriptionEnabled=False,
+                RejectJobRegistration=False,
+                PauseEvalBroker=False,
+                PreemptionConfig=dict(
+                    SystemSchedulerEnabled=True,
+                    SysBatchSchedulerEnabled=False,
+                    BatchSchedulerEnabled=False,
+                    ServiceSchedulerEnabled=False,
+                ),
+            ),
+        )
+        self.state = state
+        self.add_token("Bootstrap Token", "management", secret_id=NOMAD_TOKEN)
+        self.add_namespace("default", "Default shared namespace")
+        for i in range(self.payload_size):
+            self.add_policy("policy-%04d" % i, 'namespace "default" { policy = "read" }')
+            self.add_token("token-%04d" % i, "client", policies=["policy-%04d" % i])
+            self.add_namespace("namespace-%04d" % i, "namespace %d" % i)
+            self.add_volume("volume-%04d" % i)
+            self.add_node("node-%04d" % i, i)
+            self.add_variable("nomad/jobs/job-%04d" % i, dict(password="secret-%04d" % i, user="user-%04d" % i))
+        return state
+
+    def is_anonymous(self, method, path):
+        return path == "/v1/acl/bootstrap" or (not self.state["bootstrapped"] and path == "/v1/acl/token/self")
+
+    #
+    # helpers used to seed the state (also from the benchmarks)
+    #
+    def add_node(self, name, i):
+        """a client node, every fifth one in the gpu pool with the gpu class"""
+        index = self.bump()
+        node = dict(
+            ID=fake_id("nomad-node", name),
+            Name=name,
+            Address="10.0.%d.%d" % (i // 250, i % 250 + 1),
+            Datacenter="dc%d" % (i % 2 + 1),
+            NodePool="gpu" if i % 5 == 4 else "default",
+            NodeClass="gpu" if i % 5 == 4 else "",
+            Status="ready",
+            Drain=False,
+            SchedulingEligibility="eligible",
+            Version="1.7.2",
+            Drivers=dict(docker=dict(Detected=True, Healthy=True)),
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+        self.state["nodes"][node["ID"]] = node
+        return node
+
+    def add_variable(self, path, items, namespace="default"):
+        index = self.bump()
+        self.state["variables"][(namespace, path)] = dict(
+            Namespace=namespace,
+            Path=path,
+            Items=items,
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+
+    def add_token(self, name, type, policies=None, secret_id=None):
+        index = self.bump()
+        token = dict(
+            AccessorID=fake_id("nomad-token", name),
+            SecretID=secret_id or fake_id("nomad-secret", name),
+            Name=name,
+            Type=type,
+            Policies=policies,
+            Roles=None,
+            Global=False,
+            CreateTime="2023-09-01T00:00:00Z",
+            ExpirationTime=None,
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+        self.state["tokens"][token["AccessorID"]] = token
+        return token
+
+    def add_policy(self, name, rules, description=""):
+        index = self.bump()
+        self.state["policies"][name] = dict(
+            Name=name, Description=description, Rules=rules, JobACL=None, CreateIndex=index, ModifyIndex=index
+        )
+
+    def add_namespace(self, name, description=""):
+        index = self.bump()
+        self.state["namespaces"][name] = dict(
+            Name=name,
+            Description=description,
+            Quota="",
+            Meta=None,
+            Capabilities=None,
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+
+    def add_volume(self, id, namespace="default", plugin_id="hostpath"):
+        index = self.bump()
+        self.state["volumes"][(namespace, id)] = dict(
+            ID=id,
+            Name=id,
+            Namespace=namespace,
+            PluginID=plugin_id,
+            Provider="hostpath.csi.k8s.io",
+            Schedulable=True,
+            AccessMode="",
+            AttachmentMode="",
+            RequestedCapabilities=[dict(AccessMode="single-node-writer", AttachmentMode="file-system")],
+            MountOptions=None,
+            Parameters=None,
+            RequestedCapacityMin=1 << 30,
+            RequestedCapacityMax=1 << 30,
+            ReadAllocs={},
+            WriteAllocs={},
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+
+    @staticmethod
+    def stub(item, *fields):
+        return dict((field, item.get(field)) for field in fields)
+
+    #
+    # Agent
+    #
+    @route("GET", r"/v1/agent/self")
+    def agent_self(self, query, headers, body):
+        return Response(200, dict(config=dict(Region="global", Version=dict(Version=self.version)), member={}))
+
+    #
+    # ACL
+    #
+    @route("GET", r"/v1/acl/token/self")
+    def self_token(self, query, headers, body):
+        for token in self.state["tokens"].values():
+            if token["SecretID"] == headers.get(self.token_header) and self.state["bootstrapped"]:
+                return Response(200, token)
+        return Response(404, "ACL token not found")
+
+    @route("POST", r"/v1/acl/bootstrap")
+    def acl_bootstrap(self, query, headers, body):
+        if self.state["bootstrapped"]:
+            return Response(400, "ACL bootstrap already done")
+        self.state["bootstrapped"] = True
+        secret_id = (body or {}).get("BootstrapSecret") or fake_id("bootstrap")
+        for token in self.state["tokens"].values():
+            if token["SecretID"] == secret_id:
+                return Response(200, token)
+        return Response(200, self.add_token("Bootstrap Token", "management", secret_id=secret_id))
+
+    @route("GET", r"/v1/acl/tokens")
+    def list_tokens(self, query, headers, body):
+        stubs = [
+            self.stub(t, "AccessorID", "Name", "Type", "Policies", "Roles", "Global", "CreateTime", "ModifyIndex")
+            for t in sorted(self.state["tokens"].values(), key=lambda t: t["AccessorID"])
+        ]
+        return self.listing(stubs, query, "AccessorID")
+
+    @route("GET", r"/v1/acl/token/([^/]+)")
+    def get_token(self, query, headers, body, accessor_id):
+        token = self.state["tokens"].get(accessor_id)
+        return Response(200, token) if token else Response(404, "ACL token not found")
+
+    @route("POST", r"/v1/acl/token")
+    def create_token(self, query, headers, body):
+        token = self.add_token(body.get("Name"), body.get("Type", "client"), policies=body.get("Policies"))
+        token["Global"] = body.get("Global", False)
+        return Response(200, token)
+
+    @route("POST", r"/v1/acl/token/([^/]+)")
+    def update_token(self, query, headers, body, accessor_id):
+        token = self.state["tokens"].get(accessor_id)
+        if token is None:
+            return Response(404, "ACL token not found")
+        for field in ("Name", "Type", "Policies", "Global"):
+            if field in body:
+                token[field] = body[field]
+        token["ModifyIndex"] = self.bump()
+        return Response(200, token)
+
+    @route("DELETE", r"/v1/acl/token/([^/]+)")
+    def delete_token(self, query, headers, body, accessor_id):
+        self.state["tokens"].pop(accessor_id, None)
+        self.bump()
+        return Response(200)
+
+    @route("GET", r"/v1/acl/policies")
+    def list_policies(self, query, headers, body):
+        stubs = [
+            self.stub(p, "Name", "Description", "CreateIndex", "ModifyIndex")
+            for p in sorted(self.state["policies"].values(), key=lambda p: p["Name"])
+        ]
+        return self.listing(stubs, query, "Name")
+
+    @route("GET", r"/v1/acl/policy/([^/]+)")
+    def get_policy(self, query, headers, body, name):
+        policy = self.state["policies"].get(name)
+        return Response(200, policy) if policy else Response(404, "ACL policy not found")
+
+    @route("POST", r"/v1/acl/policy/([^/]+)")
+    def upsert_policy(self, query, headers, body, name):
+        policy = self.state["policies"].get(name)
+        if policy is None:
+            self.add_policy(name, body.get("Rules"))
+            policy = self.state["policies"][name]
+        policy.update(body)
+        policy["ModifyIndex"] = self.bump()
+        return Response(200)
+
+    @route("DELETE", r"/v1/acl/policy/([^/]+)")
+    def delete_policy(self, query, headers, body, name):
+        self.state["policies"].pop(name, None)
+        self.bump()
+        return Response(200)
+
+    #
+    # Nodes
+    #
+    @route("GET", r"/v1/nodes")
+    def list_nodes(self, query, headers, body):
+        return self.listing(sorted(self.state["nodes"].values(), key=lambda n: n["ID"]), query, "ID")
+
+    #
+    # Namespaces
+    #
+    @route("GET", r"/v1/namespaces")
+    def list_namespaces(self, query, headers, body):
+        return self.listing(sorted(self.state["namespaces"].values(), key=lambda n: n["Name"]), query, "Name")
+
+    @route("GET", r"/v1/namespace/([^/]+)")
+    def get_namespace(self, query, headers, body, name):
+        namespace = self.state["namespaces"].get(name)
+        return Response(200, namespace) if namespace else Response(404, "namespace not found")
+
+    @route("POST", r"/v1/namespace/([^/]+)")
+    def upsert_namespace(self, query, headers, body, name):
+        if name not in self.state["namespaces"]:
+            self.add_namespace(name)
+        namespace = self.state["namespaces"][name]
+        namespace.update(body)
+        namespace["ModifyIndex"] = self.bump()
+        return Response(200)
+
+    @route("DELETE", r"/v1/namespace/([^/]+)")
+    def delete_namespace(self, query, headers, body, name):
+        self.state["namespaces"].pop(name, None)
+        self.bump()
+        return Response(200)
+
+    #
+    # Operator
+    #
+    @route("GET", r"/v1/operator/scheduler/configuration")
+    def get_scheduler(self, query, headers, body):
+        return Response(200, dict(SchedulerConfig=self.state["scheduler"], Index=self.index))
+
+    @route("PUT", r"/v1/operator/scheduler/configuration")
+    def update_scheduler(self, query, headers, body):
+        self.state["scheduler"].update(body)
+        return Response(200, dict(Updated=True, Index=self.bump()))
+
+    #
+    # CSI Volumes
+    #
+    @route("GET", r"/v1/volumes")
+    def list_volumes(self, query, headers, body):
+        namespace = query.get("namespace", "default")
+        stubs = [
+            self.stub(v, "ID", "Name", "Namespace", "PluginID", "Provider", "Schedulable", "ModifyIndex")
+            for (ns, _), v in sorted(self.state["volumes"].items(), key=lambda item: (item[0][1], item[0][0]))
+            if namespace == "*" or ns == namespace
+        ]
+        return self.listing(stubs, query, "ID")
+
+    @route("GET", r"/v1/volume/csi/([^/]+)")
+    def get_volume(self, query, headers, body, id):
+        volume = self.state["volumes"].get((query.get("namespace", "default"), id))
+        return Response(200, volume) if volume else Response(404, "volume not found")
+
+    @route("PUT", r"/v1/volume/csi/([^/]+)/create")
+    def create_volume(self, query, headers, body, id):
+        volumes = []
+        for requested in body.get("Volumes") or []:
+            self.add_volume(id, requested.get("Namespace", "default"), requested.get("PluginID"))
+            volume = self.state["volumes"][(requested.get("Namespace", "default"), id)]
+            volume.update(requested)
+            volumes.append(volume)
+        return Response(200, dict(Volumes=volumes, Warnings=None))
+
+    @route("DELETE", r"/v1/volume/csi/([^/]+)/delete")
+    def delete_volume(self, query, headers, body, id):
+        self.state["volumes"].pop((query.get("namespace", "default"), id), None)
+        self.bump()
+        return Response(200)
+
+    #
+    # Jobs
+    #
+    def job_from_hcl(self, hcl, namespace):
+        """a parsed job with one task group per payload item, like nomad would return it"""
+        match = re.search(r'job\s+"([^"]+)"', hcl or "")
+        if match is None:
+            return None
+        job_id = match.group(1)
+        groups = []
+        for i in range(self.payload_size):
+            groups.append(
+                dict(
+                    Name="group-%04d" % i,
+                    Count=1,
+                    Tasks=[
+                        dict(
+                            Name="task",
+                            Driver="docker",
+                            Config=dict(image="nginx:1.25", ports=["http"]),
+                            Env=dict(("ENV_%02d" % e, "value-%d-%d" % (i, e)) for e in range(10)),
+                            Resources=dict(CPU=100, MemoryMB=128),
+                        )
+                    ],
+                    Update=dict(MaxParallel=1, HealthCheck="checks", AutoRevert=True),
+                )
+            )
+        return dict(
+            ID=job_id,
+            Name=job_id,
+            Namespace=namespace,
+            Type="batch" if "batch" in hcl else "service",
+            Priority=50,
+            Datacenters=["dc1"],
+            TaskGroups=groups,
+            Meta=dict(source_hash=hashlib.sha256(hcl.encode("utf-8")).hexdigest()),
+        )
+
+    def add_job(self, id, namespace="default"):
+        """registers a job, like nomad job run would"""
+        job = self.job_from_hcl('job "%s" {}' % id, namespace)
+        return self.register_job(dict(namespace=namespace), {}, dict(Job=job), id)
+
+    @route("GET", r"/v1/jobs")
+    def list_jobs(self, query, headers, body):
+        namespace = query.get("namespace", "default")
+        jobs = [
+            self.stub(
+                job, "ID", "Name", "Namespace", "Type", "Status", "Stop", "Version", "JobModifyIndex", "ModifyIndex"
+            )
+            for (ns, _), job in sorted(self.state["jobs"].items(), key=lambda item: (item[0][1], item[0][0]))
+            if namespace == "*" or ns == namespace
+        ]
+        return self.listing(jobs, query, "ID")
+
+    @route("POST", r"/v1/jobs/parse")
+    def parse_job(self, query, headers, body):
+        job = self.job_from_hcl(body.get("JobHCL"), query.get("namespace", "default"))
+        return Response(200, job) if job else Response(400, "error parsing job")
+
+    @route("GET", r"/v1/job/([^/]+)")
+    def get_job(self, query, headers, body, id):
+        job = self.state["jobs"].get((query.get("namespace", "default"), id))
+        return Response(200, job) if job else Response(404, "job not found")
+
+    @route("GET", r"/v1/job/([^/]+)/submission")
+    def get_job_submission(self, query, headers, body, id):
+        key = (query.get("namespace", "default"), id, int(query.get("version", -1)))
+        submission = self.state["submissions"].get(key)
+        return Response(200, submission) if submission else Response(404, "job source not found")
+
+    @route("POST", r"/v1/job/([^/]+)/plan")
+    def plan_job(self, query, headers, body, id):
+        existing = self.state["jobs"].get((query.get("namespace", "default"), id))
+        if existing is None:
+            diff_type = "Added"
+        elif existing["Stop"] or existing["Spec"] != body.get("Job"):
+            diff_type = "Edited"
+        else:
+            diff_type = "None"
+        return Response(
+            200,
+            dict(
+                Diff=dict(ID=id, Type=diff_type, Fields=None, Objects=None, TaskGroups=[]),
+                Annotations=dict(DesiredTGUpdates={}),
+                JobModifyIndex=existing["JobModifyIndex"] if existing else 0,
+                FailedTGAllocs=None,
+                Warnings="",
+            ),
+        )
+
+    @route("POST", r"/v1/job/([^/]+)")
+    def register_job(self, query, headers, body, id):
+        spec = body.get("Job")
+        namespace = query.get("namespace", "default")
+        existing = self.state["jobs"].get((namespace, id))
+        index = self.bump()
+        job = dict(
+            spec,
+            Spec=spec,
+            Stop=False,
+            Status="running",
+            Version=existing["Version"] + 1 if existing else 0,
+            SubmitTime=time.time_ns(),
+            CreateIndex=existing["CreateIndex"] if existing else index,
+            ModifyIndex=index,
+            JobModifyIndex=index,
+        )
+        self.state["jobs"][(namespace, id)] = job
+        if body.get("Submission"):
+            self.state["submissions"][(namespace, id, job["Version"])] = dict(
+                body["Submission"],
+                JobID=id,
+                Namespace=namespace,
+                Version=job["Version"],
+                JobModifyIndex=index,
+            )
+
+        # the scheduler is instant here: every allocation is placed and healthy
+        eval_id = fake_id("eval", namespace, id, index)
+        deployment_id = None
+        if job["Type"] == "service":
+            deployment_id = fake_id("deployment", namespace, id, index)
+            self.state["deployments"][deployment_id] = dict(
+                ID=deployment_id,
+                JobID=id,
+                Namespace=namespace,
+                JobVersion=job["Version"],
+                Status="successful",
+                StatusDescription="Deployment completed successfully",
+                TaskGroups=dict(
+                    (
+                        group["Name"],
+                        dict(
+                            AutoRevert=True,
+                            DesiredTotal=group["Count"],
+                            PlacedAllocs=group["Count"],
+                            HealthyAllocs=group["Count"],
+                            UnhealthyAllocs=0,
+                        ),
+                    )
+                    for group in spec.get("TaskGroups") or []
+                ),
+                ModifyIndex=index,
+            )
+        self.state["evaluations"][eval_id] = dict(
+            ID=eval_id,
+            JobID=id,
+            Namespace=namespace,
+            Status="complete",
+            DeploymentID=deployment_id,
+            ModifyIndex=index,
+        )
+        return Response(200, dict(EvalID=eval_id, EvalCreateIndex=index, JobModifyIndex=index, Warnings=""))
+
+    @route("DELETE", r"/v1/job/([^/]+)")
+    def deregister_job(self, query, headers, body, id):
+        key = (query.get("namespace", "default"), id)
+        index = self.bump()
+        if query.get("purge") in ("true", "True"):
+            self.state["jobs"].pop(key, None)
+        elif key in self.state["jobs"]:
+            self.state["jobs"][key]["Stop"] = True
+            self.state["jobs"][key]["Status"] = "dead"
+        return Response(200, dict(EvalID=fake_id("eval", key, index), EvalCreateIndex=index, JobModifyIndex=index))
+
+    #
+    # Evaluations, deployments and allocations
+    #
+    @route("GET", r"/v1/evaluation/([^/]+)")
+    def get_evaluation(self, query, headers, body, id):
+        evaluation = self.state["evaluations"].get(id)
+        return Response(200, evaluation) if evaluation else Response(404, "eval not found")
+
+    @route("GET", r"/v1/deployment/([^/]+)")
+    def get_deployment(self, query, headers, body, id):
+        deployment = self.state["deployments"].get(id)
+        return Response(200, deployment) if deployment else Response(404, "deployment not found")
+
+    @route("GET", r"/v1/deployment/allocations/([^/]+)")
+    def get_deployment_allocations(self, query, headers, body, id):
+        return Response(200, [a for a in self.state["allocations"].values() if a.get("DeploymentID") == id])
+
+    #
+    # Variables
+    #
+    @route("GET", r"/v1/var/(.+)")
+    def get_variable(self, query, headers, body, path):
+        variable = self.state["variables"].get((query.get("namespace", "default"), path))
+        return Response(200, variable) if variable else Response(404, "variable not found")
+
+    @route("GET", r"/v1/allocation/([^/]+)")
+    def get_allocation(self, query, headers, body, id):
+        allocation = self.state["allocations"].get(id)
+        return Response(200, allocation) if allocation else Response(404, "alloc not found")
+
+
+class FakeConsul(FakeServer):
+    index_header = "X-Consul-Index"
+    token_header = "X-Consul-Token"
+    management_token = CONSUL_TOKEN
+
+    GLOBAL_MANAGEMENT_ID = "00000000-0000-0000-0000-000000000001"
+
+    def seed(self):
+        state = dict(bootstrapped=True, tokens={}, policies={}, intentions={}, intention_entries={}, services={}, kv={})
+        self.state = state
+        self.add_policy("global-management", 'acl = "write"', id=self.GLOBAL_MANAGEMENT_ID)
+        self.add_token(
+            "Initial Management Token",
+            [dict(ID=self.GLOBAL_MANAGEMENT_ID, Name="global-management")],
+            secret_id=CONSUL_TOKEN,
+        )
+        for i in range(self.payload_size):
+            self.add_policy("policy-%04d" % i, 'service_prefix "" { policy = "read" }')
+            self.add_token("token %04d" % i, [dict(Name="policy-%04d" % i)])
+            self.add_intention("service-%04d" % i, "web", "allow")
+            self.add_kv("config/app/key-%04d" % i, "value-%04d" % i)
+        self.add_service("web", self.payload_size)
+        self.add_service("api", max(1, self.payload_size // 5))
+        return state
+
+    def is_anonymous(self, method, path):
+        return path == "/v1/acl/bootstrap"
+
+    def dispatch(self, method, path, query, headers, body):
+        response = super().dispatch(method, path, query, headers, body)
+        # reads report the consistency mode that served them
+        if method == "GET" and response.code == 200:
+            for mode in ("stale", "consistent"):
+                if mode in query:
+                    response.headers["X-Consul-Effective-Consistency"] = mode
+            if "cached" in query:
+                response.headers["X-Cache"] = "MISS"
+            if "stale" in query:
+                response.headers["X-Consul-LastContact"] = "0"
+            response.headers.setdefault("X-Consul-KnownLeader", "true")
+        return response
+
+    #
+    # helpers used to seed the state (also from the benchmarks)
+    #
+    def add_token(self, description, policies=None, secret_id=None):
+        index = self.bump()
+        token = dict(
+            AccessorID=fake_id("consul-token", description),
+            SecretID=secret_id or fake_id("consul-secret", description),
+            Description=description,
+            Policies=policies,
+            Local=False,
+            CreateTime="2023-09-01T00:00:00Z",
+            Hash="",
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+        self.state["tokens"][token["AccessorID"]] = token
+        return token
+
+    def add_policy(self, name, rules, description="", id=None):
+        index = self.bump()
+        policy = dict(
+            ID=id or fake_id("consul-policy", name),
+            Name=name,
+            Description=description,
+            Rules=rules,
+            Datacenters=None,
+            Hash="",
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+        self.state["policies"][policy["ID"]] = policy
+        return policy
+
+    def add_intention(self, source, destination, action, description="", permissions=None):
+        index = self.bump()
+        self.state["intentions"][(source, destination)] = dict(
+            ID=fake_id("intention", source, destination),
+            SourceName=source,
+            DestinationName=destination,
+            SourceNS="default",
+            DestinationNS="default",
+            SourceType="consul",
+            Action=action,
+            Permissions=permissions,
+            Description=description,
+            Precedence=9,
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+        self.touch_intentions(destination, index)
+
+    def touch_intentions(self, destination, index):
+        """the intentions of a destination are a service-intentions config entry, with an index of its own"""
+        if not any(d == destination for _, d in self.state["intentions"]):
+            self.state["intention_entries"].pop(destination, None)
+            return
+        self.state["intention_entries"].setdefault(destination, dict(CreateIndex=index))["ModifyIndex"] = index
+
+    def intentions_entry(self, destination):
+        entry = self.state["intention_entries"].get(destination)
+        if entry is None:
+            return None
+        sources = []
+        for (source, d), intention in sorted(self.state["intentions"].items()):
+            if d != destination:
+                continue
+            sources.append(
+                dict(
+                    (key, value)
+                    for key, value in dict(
+                        Name=source,
+                        Action=intention["Action"] or None,
+                        Permissions=intention.get("Permissions"),
+                        Description=intention["Description"] or None,
+                        Precedence=intention["Precedence"],
+                        Type="consul",
+                    ).items()
+                    if value is not None
+                )
+            )
+        return dict(Kind="service-intentions", Name=destination, Sources=sources, **entry)
+
+    def add_kv(self, key, value, flags=0):
+        index = self.bump()
+        self.state["kv"][key] = dict(
+            Key=key,
+            Value=None if value is None else base64.b64encode(value.encode("utf-8")).decode("ascii"),
+            Flags=flags,
+            LockIndex=0,
+            CreateIndex=index,
+            ModifyIndex=index,
+        )
+
+    def add_service(self, name, instances):
+        index = self.bump()
+        self.state["services"][name] = [
+            dict(
+                ID=fake_id("node", name, i),
+                Node="node-%04d" % i,
+                Address="10.0.%d.%d" % (i // 250, i % 250 + 1),
+                Datacenter="dc1",
+                NodeMeta=dict(rack="rack-%d" % (i % 4)),
+                ServiceID="%s-%04d" % (name, i),
+                ServiceName=name,
+                ServiceTags=["v1", "primary" if i == 0 else "secondary"],
+                ServiceAddress="10.0.%d.%d" % (i // 250, i % 250 + 1),
+                ServicePort=8080,
+                ServiceMeta=dict(version="1.0.%d" % i),
+                Checks=[
+                    dict(
+                        CheckID="service:%s-%04d" % (name, i),
+                        Name="http",
+                        Status="passing" if i % 10 else "critical",
+                        Output="HTTP GET http://localhost:8080/health: 200 OK",
+                    )
+                ],
+                CreateIndex=index,
+                ModifyIndex=index,
+            )
+            for i in range(instances)
+        ]
+
+    #
+    # ACL
+    #
+    @route("GET", r"/v1/acl/token/self")
+    def self_token(self, query, headers, body):
+        for token in self.state["tokens"].values():
+            if token["SecretID"] == headers.get(self.token_header) and self.state["bootstrapped"]:
+                return Response(200, token)
+        return Response(403, "ACL not found")
+
+    @route("PUT", r"/v1/acl/bootstrap")
+    def acl_bootstrap(self, query, headers, body):
+        if self.state["bootstrapped"]:
+            return Response(403, "Permission denied: ACL bootstrap no longer allowed")
+        self.state["bootstrapped"] = True
+        secret_id = (body or {}).get("BootstrapSecret") or fake_id("bootstrap")
+        for token in self.state["tokens"].values():
+            if token["SecretID"] == secret_id:
+                return Response(200, token)
+        return Response(200, self.add_token("Bootstrap Token (Global Management)", secret_id=secret_id))
+
+    @route("GET", r"/v1/acl/tokens")
+    def list_tokens(self, query, headers, body):
+        return Response(200, [dict(t, SecretID=None) for t in self.state["tokens"].values()])
+
+    @route("GET", r"/v1/acl/token/([^/]+)")
+    def get_token(self, query, headers, body, accessor_id):
+        token = self.state["tokens"].get(accessor_id)
+        return Response(200, token) if token else Response(403, "ACL not found")
+
+    @route("PUT", r"/v1/acl/token")
+    def create_token(self, query, headers, body):
+        token = self.add_token(body.get("Description") or fake_id("token", self.index), body.get("Policies"))
+        token.update(body)
+        return Response(200, token)
+
+    @route("PUT", r"/v1/acl/token/([^/]+)")
+    def update_token(self, query, headers, body, accessor_id):
+        token = self.state["tokens"].get(accessor_id)
+        if token is None:
+            return Response(403, "ACL not found")
+        token.update(body)
+        token["ModifyIndex"] = self.bump()
+        return Response(200, token)
+
+    @route("DELETE", r"/v1/acl/token/([^/]+)")
+    def delete_token(self, query, headers, body, accessor_id):
+        self.state["tokens"].pop(accessor_id, None)
+        self.bump()
+        return Response(200, True)
+
+    @route("GET", r"/v1/acl/policies")
+    def list_policies(self, query, headers, body):
+        return Response(200, [dict(p, Rules=None) for p in self.state["policies"].values()])
+
+    @route("GET", r"/v1/acl/policy/name/([^/]+)")
+    def get_policy_by_name(self, query, headers, body, name):
+        for policy in self.state["policies"].values():
+            if policy["Name"] == name:
+                return Response(200, policy)
+        return Response(404, "ACL policy not found")
+
+    @route("GET", r"/v1/acl/policy/([^/]+)")
+    def get_policy(self, query, headers, body, id):
+        policy = self.state["policies"].get(id)
+        return Response(200, policy) if policy else Response(404, "ACL policy not found")
+
+    @route("PUT", r"/v1/acl/policy")
+    def create_policy(self, query, headers, body):
+        policy = self.add_policy(body.get("Name"), body.get("Rules"))
+        policy.update(body)
+        return Response(200, policy)
+
+    @route("PUT", r"/v1/acl/policy/([^/]+)")
+    def update_policy(self, query, headers, body, id):
+        policy = self.state["policies"].get(id)
+        if policy is None:
+            return Response(404, "ACL policy not found")
+        policy.update(body)
+        policy["ModifyIndex"] = self.bump()
+        return Response(200, policy)
+
+    @route("DELETE", r"/v1/acl/policy/([^/]+)")
+    def delete_policy(self, query, headers, body, id):
+        self.state["policies"].pop(id, None)
+        self.bump()
+        return Response(200, True)
+
+    #
+    # Connect intentions
+    #
+    @route("GET", r"/v1/connect/intentions")
+    def list_intentions(self, query, headers, body):
+        return Response(200, list(self.state["intentions"].values()))
+
+    @route("GET", r"/v1/connect/intentions/exact")
+    def get_intention(self, query, headers, body):
+        intention = self.state["intentions"].get((query.get("source"), query.get("destination")))
+        return Response(200, intention) if intention else Response(404, "Intention not found")
+
+    @route("PUT", r"/v1/connect/intentions/exact")
+    def upsert_intention(self, query, headers, body):
+        key = (query.get("source"), query.get("destination"))
+        if key not in self.state["intentions"]:
+            self.add_intention(key[0], key[1], body.get("Action"))
+        intention = self.state["intentions"][key]
+        intention.update(body)
+        intention["ModifyIndex"] = self.bump()
+        self.touch_intentions(key[1], intention["ModifyIndex"])
+        return Response(200, True)
+
+    @route("DELETE", r"/v1/connect/intentions/exact")
+    def delete_intention(self, query, headers, body):
+        self.state["intentions"].pop((query.get("source"), query.get("destination")), None)
+        self.touch_intentions(query.get("destination"), self.bump())
+        return Response(200, True)
+
+    #
+    # Config entries, only service-intentions
+    #
+    def cas_mismatch(self, destination, query):
+        if "cas" not in query:
+            return False
+        entry = self.state["intention_entries"].get(destination)
+        return int(query["cas"]) != (entry["ModifyIndex"] if entry else 0)
+
+    @route("GET", r"/v1/config/service-intentions")
+    def list_intentions_entries(self, query, headers, body):
+        return Response(200, [self.intentions_entry(d) for d in sorted(self.state["intention_entries"])])
+
+    @route("GET", r"/v1/config/service-intentions/([^/]+)")
+    def get_intentions_entry(self, query, headers, body, destination):
+        entry = self.intentions_entry(destination)
+        return Response(200, entry) if entry else Response(404, "Config entry not found")
+
+    @route("PUT", r"/v1/config")
+    def apply_config_entry(self, query, headers, body):
+        if body.get("Kind") != "service-intentions":
+            return Response(400, "unsupported config entry kind: %s" % body.get("Kind"))
+        destination = body["Name"]
+        if self.cas_mismatch(destination, query):
+            return Response(200, False)
+        for source in body.get("Sources") or []:
+            if bool(source.get("Action")) == bool(source.get("Permissions")):
+                return Response(400, "source %s must have exactly one of Action or Permissions" % source.get("Name"))
+        for key in [key for key in self.state["intentions"] if key[1] == destination]:
+            self.state["intentions"].pop(key)
+        previous = self.state["intention_entries"].pop(destination, None)
+        for source in body.get("Sources") or []:
+            self.add_intention(
+                source["Name"],
+                destination,
+                source.get("Action") or "",
+                source.get("Description") or "",
+                source.get("Permissions"),
+            )
+        self.touch_intentions(destination, self.bump())
+        entry = self.state["intention_entries"].get(destination)
+        if entry is not None:
+            if previous is not None:
+                entry["CreateIndex"] = previous["CreateIndex"]
+            # the other fields of the entry (ie. Meta or JWT) are whatever the write had
+            entry.update((k, v) for k, v in body.items() if k not in ("Kind", "Name", "Sources") and "Index" not in k)
+        return Response(200, True)
+
+    @route("DELETE", r"/v1/config/service-intentions/([^/]+)")
+    def delete_intentions_entry(self, query, headers, body, destination):
+        if self.cas_mismatch(destination, query):
+            return Response(200, dict(Deleted=False))
+        for key in [key for key in self.state["intentions"] if key[1] == destination]:
+            self.state["intentions"].pop(key)
+        self.touch_intentions(destination, self.bump())
+        return Response(200, dict(Deleted=True))
+
+    #
+    # Services
+    #
+    def instances(self, name, query):
+        instances = self.state["services"].get(name) or []
+        if "tag" in query:
+            instances = [i for i in instances if query["tag"] in i["ServiceTags"]]
+        return instances
+
+    @route("GET", r"/v1/catalog/nodes")
+    def catalog_nodes(self, query, headers, body):
+        nodes = {}
+        for instances in self.state["services"].values():
+            for i in instances:
+                nodes.setdefault(
+                    i["Node"],
+                    dict(
+                        ID=i["ID"], Node=i["Node"], Address=i["Address"], Datacenter=i["Datacenter"], Meta=i["NodeMeta"]
+                    ),
+                )
+        return Response(200, [nodes[name] for name in sorted(nodes)])
+
+    @route("GET", r"/v1/catalog/services")
+    def catalog_services(self, query, headers, body):
+        services = {}
+        for name, instances in self.state["services"].items():
+            services[name] = sorted(set(tag for i in instances for tag in i["ServiceTags"]))
+        return Response(200, services)
+
+    @route("GET", r"/v1/catalog/service/([^/]+)")
+    def catalog_service(self, query, headers, body, name):
+        return Response(200, [dict(i, Checks=None) for i in self.instances(name, query)])
+
+    @route("GET", r"/v1/health/service/([^/]+)")
+    def health_service(self, query, headers, body, name):
+        entries = []
+        for instance in self.instances(name, query):
+            checks = instance["Checks"]
+            if "passing" in query and any(c["Status"] != "passing" for c in checks):
+                continue
+            entries.append(
+                dict(
+                    Node=dict(
+                        ID=instance["ID"],
+                        Node=instance["Node"],
+                        Address=instance["Address"],
+                        Datacenter=instance["Datacenter"],
+                        Meta=instance["NodeMeta"],
+                    ),
+                    Service=dict(
+                        ID=instance["ServiceID"],
+                        Service=instance["ServiceName"],
+                        Tags=instance["ServiceTags"],
+                        Address=instance["ServiceAddress"],
+                        Port=instance["ServicePort"],
+                        Meta=instance["ServiceMeta"],
+                    ),
+                    Checks=checks,
+                )
+            )
+        return Response(200, entries)
+
+    #
+    # KV
+    #
+    @route("GET", r"/v1/kv/(.*)")
+    def get_kv(self, query, headers, body, key):
+        if "recurse" in query:
+            entries = [self.state["kv"][k] for k in sorted(self.state["kv"]) if k.startswith(key)]
+        else:
+            entries = [self.state["kv"][key]] if key in self.state["kv"] else []
+        return Response(200, entries) if entries else Response(404)
+
+    #
+    # Transactions
+    #
+    def apply_kv(self, kv, op):
+        """applies a KV transaction operation to kv, returns its results or raises ValueError"""
+        verb, key = op.get("Verb"), op.get("Key")
+        entry = kv.get(key)
+        if verb in ("get", "check-index") and entry is None:
+            raise ValueError('key "%s" doesn\'t exist' % key)
+        if verb == "check-index" and entry["ModifyIndex"] != op.get("Index"):
+            raise ValueError("current modify index %d != %d" % (entry["ModifyIndex"], op.get("Index")))
+        if verb == "check-not-exists" and entry is not None:
+            raise ValueError('key "%s" exists' % key)
+        if verb in ("cas", "delete-cas") and (entry["ModifyIndex"] if entry else 0) != op.get("Index"):
+            raise ValueError('failed to set key "%s", index is stale' % key)
+        if verb == "get":
+            return [dict(KV=entry)]
+        if verb == "get-tree":
+            return [dict(KV=kv[k]) for k in sorted(kv) if k.startswith(key)]
+        if verb in ("set", "cas"):
+            index = self.index + 1
+            kv[key] = dict(
+                Key=key,
+                Value=op.get("Value"),
+                Flags=op.get("Flags") or 0,
+                LockIndex=0,
+                CreateIndex=entry["CreateIndex"] if entry else index,
+                ModifyIndex=index,
+            )
+            return [dict(KV=dict(kv[key], Value=None))]
+        if verb in ("delete", "delete-cas"):
+            kv.pop(key, None)
+        elif verb == "delete-tree":
+            for k in [k for k in kv if k.startswith(key)]:
+                del kv[k]
+        elif verb not in ("check-index", "check-not-exists"):
+            raise ValueError('unknown KV verb "%s"' % verb)
+        return []
+
+    @route("PUT", r"/v1/txn")
+    def txn(self, query, headers, body):
+        if len(body) > 128:
+            return Response(413, "Transaction contains too many operations (%d > 128)" % len(body))
+        kv = dict(self.state["kv"])
+        results, errors = [], []
+        for i, op in enumerate(body):
+            try:
+                if "KV" in op:
+                    results.extend(self.apply_kv(kv, op["KV"]))
+                elif op.get(list(op)[0], {}).get("Verb") == "set":
+                    results.append(op)
+            except ValueError as e:
+                errors.append(dict(OpIndex=i, What=str(e)))
+        if errors:
+            return Response(409, dict(Results=None, Errors=errors))
+        # like any write, a transaction that changed something gets a new raft index
+        if kv != self.state["kv"]:
+            self.bump()
+        self.state["kv"] = kv
+        return Response(200, dict(Results=results or None, Errors=None))
@@ -0,0 +1,99 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from ansible.errors import AnsibleError
+from ansible.utils.display import Display
+from fake_server import NOMAD_TOKEN
+
+from plugins.module_utils import transport
+from plugins.module_utils.aio import AsyncAPI, fan_out, run
+from plugins.module_utils.nomad import NomadAPI
+from plugins.plugin_utils.api import ModuleShim, api_params
+
+
+@pytest.fixture
+def nomad_api(nomad):
+    transport.get_pool().close()
+    return NomadAPI(ModuleShim("test_aio", api_params(nomad.url, NOMAD_TOKEN), Display()))
+
+
+def token_ids(nomad):
+    return sorted(nomad.state["tokens"])
+
+
+def test_fan_out(benchmark, nomad, nomad_api):
+    ids = token_ids(nomad)
+    nomad.reset_stats()
+    tokens = fan_out(nomad_api, "get_acl_token", ids, max_concurrency=8)
+    assert [token["AccessorID"] for token in tokens] == ids
+    assert len(nomad.requests) == len(ids)
+    assert nomad.connections <= 8
+    benchmark.extra_info.update(requests=len(ids), payload_size=nomad.payload_size)
+    benchmark.pedantic(fan_out, args=(nomad_api, "get_acl_token", ids, 8), rounds=5, iterations=1)
+
+
+def test_fan_out_latency(nomad, nomad_api, monkeypatch):
+    ids = token_ids(nomad)[:40]
+    monkeypatch.setattr(nomad, "latency", 0.02)
+
+    start = time.monotonic()
+    expected = [nomad_api.get_acl_token(id) for id in ids]
+    sequential = time.monotonic() - start
+
+    start = time.monotonic()
+    assert fan_out(nomad_api, "get_acl_token", ids, max_concurrency=8) == expected
+    concurrent = time.monotonic() - start
+    # about 40 / 8 round-trips instead of 40
+    assert concurrent < sequential / 3
+
+
+def test_every_job_in_every_namespace(nomad, nomad_api):
+    for i in range(30):
+        nomad.add_job("job-%04d" % i, namespace="namespace-%04d" % (i % 3))
+    nomad.reset_stats()
+
+    async def main():
+        async with AsyncAPI(nomad_api, max_concurrency=4) as api:
+            stubs = await api.iter_jobs(all_namespaces=True)
+            return await asyncio.gather(*(api.with_namespace(s["Namespace"]).get_job(s["ID"]) for s in stubs))
+
+    jobs = run(main())
+    assert [(job["Namespace"], job["ID"]) for job in jobs] == [
+        ("namespace-%04d" % (i % 3), "job-%04d" % i) for i in range(30)
+    ]
+    # the listing, then one request per job
+    assert len(nomad.requests) == 31
+    assert nomad_api.namespace == "default"
+
+
+def test_fan_out_failure(nomad, nomad_api):
+    ids = token_ids(nomad)
+    nomad.fail_next(1, code=403, message="Permission denied")
+    with pytest.raises(AnsibleError, match="Not Authorized"):
+        fan_out(nomad_api, "get_acl_token", ids, max_concurrency=4)
+
+
+def test_outside_of_async_with(nomad_api):
+    with pytest.raises(RuntimeError):
+        asyncio.run(AsyncAPI(nomad_api).get_acl_token("x"))
+
+
+def test_fan_out_exits_once(nomad, capsys):
+    class Module(ModuleShim):
+        def fail_json(self, msg=None, **kwargs):
+            print("failed: " + msg)
+            raise SystemExit(1)
+
+    api = NomadAPI(Module("test_aio", api_params(nomad.url, NOMAD_TOKEN), Display()))
+    nomad.fail_next(3, code=403, message="Permission denied")
+    with pytest.raises(SystemExit):
+        fan_out(api, "get_acl_token", token_ids(nomad), max_concurrency=4)
+    # like a module, only the first failed request prints a result
+    assert capsys.readouterr().out.count("failed: ") == 1
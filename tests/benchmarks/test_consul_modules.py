@@ -0,0 +1,411 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+import base64
+import time
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from conftest import call_module
+from fake_server import CONSUL_TOKEN, fake_id
+
+from plugins.module_utils.consul import ConsulAPI
+from plugins.plugin_utils.api import ModuleShim, api_params
+
+
+def test_consul_acl_bootstrap(run_module, consul, consul_args):
+    run = run_module("consul_acl_bootstrap", consul_args, consul)
+    assert run.result["changed"] is False
+    assert run.requests == 1
+    assert run.connections == 1
+
+
+@pytest.mark.parametrize("consistency", ["default", "stale"])
+def test_consul_acl_get_token(run_module, consul, consul_args, consistency):
+    args = dict(consul_args, accessor_id=fake_id("consul-token", "token 0000"), consistency=consistency)
+    run = run_module("consul_acl_get_token", args, consul)
+    assert run.result["token"]["Description"] == "token 0000"
+    assert run.result["effective_consistency"] == (None if consistency == "default" else consistency)
+    assert run.requests == 1
+
+
+def test_consul_acl_policy_unchanged(run_module, consul, consul_args):
+    args = dict(consul_args, name="policy-0000", rules='service_prefix "" { policy = "read" }')
+    run = run_module("consul_acl_policy", args, consul)
+    assert run.result["changed"] is False
+    assert run.requests == 1
+
+
+def test_consul_acl_policy_create(run_module, consul, consul_args):
+    args = dict(consul_args, name="new-policy", rules='key_prefix "" { policy = "read" }')
+    run = run_module("consul_acl_policy", args, consul, setup=consul.reset)
+    assert run.result["changed"] is True
+    assert run.requests == 2
+    assert run.connections == 1
+
+
+def test_consul_acl_token_unchanged(run_module, consul, consul_args):
+    args = dict(
+        consul_args,
+        accessor_id=fake_id("consul-token", "token 0000"),
+        description="token 0000",
+        policies=[dict(name="policy-0000")],
+    )
+    run = run_module("consul_acl_token", args, consul)
+    assert run.result["changed"] is False
+    assert run.requests == 1
+
+
+def test_consul_connect_intention_unchanged(run_module, consul, consul_args):
+    args = dict(consul_args, source="service-0000", destination="web", action="allow")
+    run = run_module("consul_connect_intention", args, consul)
+    assert run.result["changed"] is False
+    assert run.requests == 1
+
+
+def test_consul_connect_intention_create(run_module, consul, consul_args):
+    args = dict(consul_args, source="api", destination="web", action="allow")
+    run = run_module("consul_connect_intention", args, consul, setup=consul.reset)
+    assert run.result["changed"] is True
+    assert run.requests == 2
+    assert run.connections == 1
+
+
+@pytest.mark.parametrize(
+    "name, args, before, after",
+    [
+        (
+            "consul_acl_policy",
+            dict(name="new-policy", rules='key_prefix "" { policy = "read" }'),
+            {},
+            dict(Name="new-policy", Rules='key_prefix "" { policy = "read" }'),
+        ),
+        (
+            "consul_acl_policy",
+            dict(name="policy-0000", rules="", state="absent"),
+            dict(Name="policy-0000"),
+            {},
+        ),
+        (
+            "consul_acl_token",
+            dict(
+                accessor_id=fake_id("consul-token", "token 0000"),
+                description="token 0000",
+                policies=[dict(name="policy-0001")],
+            ),
+            {"Policies[Name=policy-0001]": None},
+            {"Policies[Name=policy-0001]": dict(Name="policy-0001")},
+        ),
+        (
+            "consul_connect_intention",
+            dict(source="service-0000", destination="web", action="deny"),
+            dict(Action="allow"),
+            dict(Action="deny"),
+        ),
+    ],
+)
+def test_consul_check_mode(consul, consul_args, name, args, before, after):
+    consul.reset_stats()
+    result = call_module(name, dict(consul_args, _ansible_check_mode=True, **args))
+    assert result["changed"] is True
+    for diff, expected in ((result["diff"]["before"], before), (result["diff"]["after"], after)):
+        assert dict((key, diff.get(key)) for key in expected) == expected
+    # a dry run only costs the reads
+    assert set(method for method, _ in consul.requests) == {"GET"}
+
+    # the real run changes what the dry run reported
+    result = call_module(name, dict(consul_args, **args))
+    assert result["changed"] is True
+    assert call_module(name, dict(consul_args, _ansible_check_mode=True, **args))["changed"] is False
+
+
+def test_consul_acl_bootstrap_check_mode(consul, consul_args):
+    consul.state["bootstrapped"] = False
+    result = call_module("consul_acl_bootstrap", dict(consul_args, _ansible_check_mode=True))
+    assert result["changed"] is True
+    assert consul.state["bootstrapped"] is False
+
+
+@pytest.mark.parametrize("passing_only", [False, True])
+def test_consul_get_service_detail(run_module, consul, consul_args, passing_only):
+    args = dict(consul_args, service_name="web", passing_only=passing_only)
+    run = run_module("consul_get_service_detail", args, consul)
+    # every tenth instance of the fake service has a critical check
+    critical = -(-consul.payload_size // 10)
+    assert len(run.result["instances"]) == consul.payload_size - (critical if passing_only else 0)
+    assert run.requests == 1
+    # the health entries are returned in the shape of the catalog entries
+    instances = dict((i["ServiceID"], i) for i in consul.state["services"]["web"])
+    for instance in run.result["instances"]:
+        expected = instances[instance["ServiceID"]]
+        assert instance["ServiceName"] == "web"
+        assert (instance["Node"], instance["ServicePort"]) == (expected["Node"], expected["ServicePort"])
+
+
+def test_consul_get_service_detail_cached(run_module, consul, consul_args, tmp_path):
+    args = dict(consul_args, service_name="web", cache_ttl=300, cache_dir=str(tmp_path))
+    call_module("consul_get_service_detail", args)
+    run = run_module("consul_get_service_detail", args, consul)
+    assert run.result["cached"] is True
+    assert run.requests == 0
+    # a different max_age is another query
+    assert call_module("consul_get_service_detail", dict(args, max_age=60))["cached"] is False
+
+
+def test_consul_wait_service(run_module, consul, consul_args):
+    run = run_module("consul_wait_service", dict(consul_args, service_name="web", passing_instances=1), consul)
+    assert run.result["passing"] >= 1
+    assert run.requests == 1
+
+
+def test_consul_wait_until_without_index(consul, monkeypatch):
+    api = ConsulAPI(ModuleShim("test", api_params(consul.url, CONSUL_TOKEN), None))
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    # the index header of every read, a proxy strips some of them
+    headers = [None, None, 5, None, None]
+    reads = []
+
+    def read(index, wait, return_meta):
+        reads.append(index)
+        return len(reads), dict(index=headers[len(reads) - 1])
+
+    assert api.wait_until(read, lambda result: result == 5, timeout=60) == (5, None, True)
+    # without an index the reads do not block and back off, once there is one they keep blocking on it
+    assert reads == [0, 0, 0, 5, 5]
+    assert sleeps == [1, 2]
+
+
+def test_consul_rate_limited(run_module, consul, consul_args):
+    def setup():
+        consul.reset()
+        consul.fail_next(2, code=429, message="rate limit exceeded", headers={"Retry-After": "0"})
+
+    args = dict(consul_args, accessor_id=fake_id("consul-token", "token 0000"), retry_backoff=0)
+    run = run_module("consul_acl_get_token", args, consul, setup=setup)
+    assert run.result["token"]["Description"] == "token 0000"
+    assert run.requests == 3
+
+
+def kv_operations(count, verb="set"):
+    return [dict(KV=dict(Verb=verb, Key="config/bulk/key-%04d" % i, Value="value-%04d" % i)) for i in range(count)]
+
+
+def test_consul_txn(run_module, consul, consul_args):
+    count = 300
+    run = run_module("consul_txn", dict(consul_args, operations=kv_operations(count)), consul, setup=consul.reset)
+    assert run.result["changed"] is True
+    assert [op["status"] for op in run.result["operations"]] == ["ok"] * count
+    # the current entries are read in 3 transactions, the writes are applied in 3 more
+    assert run.result["transactions"] == run.requests == 6
+    assert run.connections == 1
+    assert base64.b64decode(consul.state["kv"]["config/bulk/key-0299"]["Value"]) == b"value-0299"
+
+
+def test_consul_txn_unchanged(run_module, consul, consul_args):
+    count = 300
+    # deleting keys that do not exist changes nothing either
+    deletes = [dict(KV=dict(Verb="delete", Key="config/bulk/gone-%04d" % i)) for i in range(10)]
+    args = dict(consul_args, operations=kv_operations(count) + deletes)
+    assert call_module("consul_txn", args)["changed"] is True
+    run = run_module("consul_txn", args, consul)
+    assert run.result["changed"] is False
+    assert set(op["status"] for op in run.result["operations"]) == set(["unchanged"])
+    # the keys to delete do not exist, the first transaction is read again without them
+    assert run.requests == 4
+
+
+def test_consul_txn_rollback(consul, consul_args):
+    consul.add_kv("config/bulk/lock", "held")
+    operations = kv_operations(200)
+    # a cas in the second transaction fails, the first one is applied already
+    operations[150] = dict(KV=dict(Verb="cas", Key="config/bulk/lock", Value="mine", Index=0))
+    consul.reset_stats()
+    result = call_module("consul_txn", dict(consul_args, operations=operations, chunk_size=100))
+    assert result["failed"] is True
+    assert result["changed"] is True
+    assert "operation 150 (KV cas) failed" in result["msg"]
+    statuses = [op["status"] for op in result["operations"]]
+    assert statuses[:100] == ["ok"] * 100
+    assert statuses[150] == "failed"
+    assert set(statuses[100:150] + statuses[151:]) == set(["rolled_back"])
+    assert "config/bulk/key-0099" in consul.state["kv"]
+    assert "config/bulk/key-0100" not in consul.state["kv"]
+    assert result["transactions"] == 4
+
+
+def test_consul_txn_conditional_is_not_retried(consul, consul_args):
+    operations = [
+        dict(KV=dict(Verb="check-not-exists", Key="config/bulk/lock")),
+        dict(Service=dict(Verb="set", Node="node-0000", Service=dict(ID="lock-holder", Service="lock-holder"))),
+    ]
+    consul.fail_next(1, code=500, path="/v1/txn")
+    result = call_module("consul_txn", dict(consul_args, operations=operations, retry_backoff=0))
+    # the transaction may have been applied, sent again its check would fail against its own outcome
+    assert result["failed"] is True
+    assert "status=500" in result["msg"]
+    assert [path for _, path in consul.requests] == ["/v1/txn"]
+
+
+def test_consul_txn_check_mode(consul, consul_args):
+    consul.add_kv("config/bulk/key-0000", "value-0000")
+    consul.reset_stats()
+    args = dict(consul_args, operations=kv_operations(3), _ansible_check_mode=True)
+    result = call_module("consul_txn", args)
+    assert result["changed"] is True
+    assert [op["status"] for op in result["operations"]] == ["unchanged", "pending", "pending"]
+    # the read of the keys, and the read of the key that exists
+    assert [method for method, _ in consul.requests] == ["PUT", "PUT"]
+    assert "config/bulk/key-0001" not in consul.state["kv"]
+
+
+def test_consul_txn_delete_tree(consul, consul_args):
+    operations = [
+        dict(KV=dict(Verb="delete-tree", Key="config/missing/")),
+        dict(KV=dict(Verb="delete-tree", Key="config/app/")),
+        # the prefix of existing keys, but no key of its own
+        dict(KV=dict(Verb="set", Key="config/app/key-000", Value="value")),
+    ]
+    consul.reset_stats()
+    result = call_module("consul_txn", dict(consul_args, operations=operations, _ansible_check_mode=True))
+    assert [op["status"] for op in result["operations"]] == ["unchanged", "pending", "pending"]
+    # the reads fail on the missing key, then the prefixes are read again
+    assert result["transactions"] == 2
+    assert consul.requests == [("PUT", "/v1/txn"), ("PUT", "/v1/txn")]
+
+
+def test_consul_txn_get(consul, consul_args):
+    args = dict(consul_args, operations=[dict(KV=dict(Verb="get-tree", Key="config/app/key-000"))])
+    result = call_module("consul_txn", args)
+    assert result["changed"] is False
+    assert [entry["KV"]["Value"] for entry in result["results"]] == ["value-%04d" % i for i in range(10)]
+
+
+def web_sources(consul):
+    return dict(
+        (source, intention["Action"])
+        for (source, dest), intention in consul.state["intentions"].items()
+        if dest == "web"
+    )
+
+
+def test_consul_intentions(run_module, consul, consul_args):
+    size = consul.payload_size
+    intentions = [dict(source="service-%04d" % i, destination="web", action="deny") for i in range(10)]
+    intentions += [dict(source="service-%04d" % i, destination="web", state="absent") for i in range(10, 15)]
+    intentions += [dict(source="new-%04d" % i, destination="web", action="allow") for i in range(10)]
+    intentions += [dict(source="service-%04d" % i, destination="api", action="allow") for i in range(20)]
+    args = dict(consul_args, intentions=intentions)
+
+    run = run_module("consul_intentions", args, consul, setup=consul.reset)
+    assert run.result["changed"] is True
+    assert [(d["name"], d["action"]) for d in run.result["destinations"]] == [("web", "updated"), ("api", "created")]
+    # one listing of every entry, then one write per destination
+    assert run.requests == 3
+    assert run.connections <= 1 + 2
+
+    sources = web_sources(consul)
+    assert len(sources) == size - 5 + 10
+    assert [sources["service-%04d" % i] for i in range(10)] == ["deny"] * 10
+    assert "service-0010" not in sources
+    assert sources["service-%04d" % (size - 1)] == "allow"
+    assert len([dest for _, dest in consul.state["intentions"] if dest == "api"]) == 20
+
+
+def test_consul_intentions_keep_entry_fields(consul, consul_args):
+    jwt = dict(Providers=[dict(Name="okta", VerifyClaims=[dict(Path=["groups"], Value="web")])])
+    consul.state["intention_entries"]["web"].update(Meta=dict(owner="web"), JWT=jwt)
+    intentions = [dict(source="service-0000", destination="web", action="deny")]
+    assert call_module("consul_intentions", dict(consul_args, intentions=intentions))["changed"] is True
+    entry = consul.intentions_entry("web")
+    assert entry["Meta"] == dict(owner="web")
+    assert entry["JWT"] == jwt
+    assert web_sources(consul)["service-0000"] == "deny"
+
+
+def test_consul_intentions_unchanged(run_module, consul, consul_args):
+    intentions = [
+        dict(source="service-%04d" % i, destination="web", action="allow") for i in range(consul.payload_size)
+    ]
+    intentions += [dict(source="missing", destination="web", state="absent")]
+    run = run_module("consul_intentions", dict(consul_args, intentions=intentions), consul)
+    assert run.result["changed"] is False
+    assert run.result["destinations"][0]["action"] == "unchanged"
+    assert run.requests == 1
+
+
+def test_consul_intentions_exclusive(consul, consul_args):
+    intentions = [
+        dict(source="service-0000", destination="web", action="allow"),
+        dict(source="api", destination="web", permissions=[dict(Action="allow", HTTP=dict(PathPrefix="/v1"))]),
+    ]
+    result = call_module("consul_intentions", dict(consul_args, intentions=intentions, exclusive=True))
+    assert result["destinations"][0]["sources"] == ["service-0000", "api"]
+    assert web_sources(consul) == {"service-0000": "allow", "api": ""}
+
+    # an entry without sources is deleted
+    intentions = [dict(source=source, destination="web", state="absent") for source in ("service-0000", "api")]
+    result = call_module("consul_intentions", dict(consul_args, intentions=intentions))
+    assert result["destinations"][0]["action"] == "deleted"
+    assert "web" not in consul.state["intention_entries"]
+    assert web_sources(consul) == {}
+
+
+def test_consul_intentions_cas_conflict(consul, consul_args, monkeypatch):
+    apply_config_entry = ConsulAPI.apply_config_entry
+
+    def concurrent_change(self, body, cas=None, params=None):
+        # somebody else adds a source to the entry between the listing and the first write
+        if not consul.state.get("changed_concurrently"):
+            consul.state["changed_concurrently"] = True
+            consul.add_intention("other", "web", "allow")
+        return apply_config_entry(self, body, cas=cas, params=params)
+
+    monkeypatch.setattr(ConsulAPI, "apply_config_entry", concurrent_change)
+    intentions = [dict(source="service-0000", destination="web", action="deny")]
+    consul.reset_stats()
+    result = call_module("consul_intentions", dict(consul_args, intentions=intentions))
+    assert result["destinations"][0]["conflicts"] == 1
+    assert web_sources(consul)["other"] == "allow"
+    assert web_sources(consul)["service-0000"] == "deny"
+    # the listing, the rejected write, a read of the entry and the write
+    assert [method for method, _ in consul.requests] == ["GET", "PUT", "GET", "PUT"]
+
+
+def test_consul_intentions_cas_write_is_not_retried(consul, consul_args):
+    consul.fail_next(1, code=503, method="PUT", path="/v1/config")
+    intentions = [dict(source="service-0000", destination="web", action="deny")]
+    consul.reset_stats()
+    result = call_module("consul_intentions", dict(consul_args, intentions=intentions, retry_backoff=0))
+    # the write may have been applied, sent again it would fail its cas
+    assert result["failed"] is True
+    assert "status=503" in result["msg"]
+    assert [method for method, _ in consul.requests] == ["GET", "PUT"]
+
+
+def test_consul_intentions_check_mode(consul, consul_args):
+    intentions = [
+        dict(source="service-0000", destination="web", action="deny"),
+        dict(source="service-0001", destination="web", state="absent"),
+        dict(source="web", destination="db", action="allow"),
+    ]
+    consul.reset_stats()
+    result = call_module("consul_intentions", dict(consul_args, intentions=intentions, _ansible_check_mode=True))
+    assert result["changed"] is True
+    assert result["diff"]["before"]["web.Sources[Name=service-0000]"]["Action"] == "allow"
+    assert result["diff"]["after"]["web.Sources[Name=service-0000]"]["Action"] == "deny"
+    assert "web.Sources[Name=service-0001]" in result["diff"]["before"]
+    assert result["diff"]["after"]["db.Sources[Name=web]"] == dict(Name="web", Action="allow")
+    assert [method for method, _ in consul.requests] == ["GET"]
+    assert web_sources(consul)["service-0000"] == "allow"
+
+
+def test_consul_intentions_invalid(consul, consul_args):
+    intentions = [dict(source="api", destination="web", action="allow")] * 2
+    result = call_module("consul_intentions", dict(consul_args, intentions=intentions))
+    assert result["msg"] == "duplicate consul intention: api -> web"
+
+    result = call_module("consul_intentions", dict(consul_args, intentions=[dict(source="api", destination="web")]))
+    assert result["msg"] == "consul intention api -> web needs an action or permissions"
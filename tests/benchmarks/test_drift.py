@@ -0,0 +1,218 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from conftest import call_module
+from fake_server import CONSUL_TOKEN, NOMAD_TOKEN, fake_id
+
+
+@pytest.fixture
+def drift_args(nomad, consul):
+    """declares what the fake servers were seeded with"""
+    size = nomad.payload_size
+    desired = dict(
+        nomad=dict(
+            namespaces=[dict(name="namespace-%04d" % i, description="namespace %d" % i) for i in range(size)],
+            acl_policies=[
+                dict(name="policy-%04d" % i, rules='namespace "default" { policy = "read" }') for i in range(size)
+            ],
+            acl_tokens=[dict(name="token-%04d" % i, type="client", policies=["policy-%04d" % i]) for i in range(size)],
+            scheduler=dict(scheduler_algorithm="binpack", preemption_config=dict(system_scheduler_enabled=True)),
+        ),
+        consul=dict(
+            acl_policies=[
+                dict(name="policy-%04d" % i, rules='service_prefix "" { policy = "read" }') for i in range(size)
+            ],
+            acl_tokens=[
+                dict(description="token %04d" % i, policies=[dict(name="policy-%04d" % i)]) for i in range(size)
+            ],
+            intentions=[dict(source="service-%04d" % i, destination="web", action="allow") for i in range(size)],
+        ),
+    )
+    return dict(
+        nomad_url=nomad.url,
+        nomad_token=NOMAD_TOKEN,
+        consul_url=consul.url,
+        consul_token=CONSUL_TOKEN,
+        desired=desired,
+    )
+
+
+def by_status(result, status):
+    return sorted((o["service"], o["type"], o["key"]) for o in result["objects"] if o["status"] == status)
+
+
+def test_drift_in_sync(nomad, consul, drift_args, run_module):
+    declared = 3 * nomad.payload_size + 1 + 3 * consul.payload_size
+    consul.reset_stats()
+    measured = run_module("hashicorp_drift", drift_args, nomad)
+    assert measured.result["changed"] is False
+    assert measured.result["drift"] is False
+    assert measured.result["summary"] == dict(declared=declared, in_sync=declared, drifted=0, missing=0, unmanaged=0)
+    assert measured.result["objects"] == []
+    assert "diff" not in measured.result
+    # a listing per type, the policies are read one by one for their rules
+    assert measured.requests == 4 + nomad.payload_size
+
+
+def test_drift_requests(nomad, consul, drift_args):
+    nomad.reset_stats()
+    consul.reset_stats()
+    call_module("hashicorp_drift", drift_args)
+    assert sorted(set(path.split("?")[0] for _, path in nomad.requests if "/acl/policy/" not in path)) == [
+        "/v1/acl/policies",
+        "/v1/acl/tokens",
+        "/v1/namespaces",
+        "/v1/operator/scheduler/configuration",
+    ]
+    assert sorted(set(path for _, path in consul.requests if "/acl/policy/" not in path)) == [
+        "/v1/acl/policies",
+        "/v1/acl/tokens",
+        "/v1/connect/intentions",
+    ]
+    assert len(consul.requests) == 3 + consul.payload_size
+
+
+def test_drift_detected(nomad, consul, drift_args):
+    nomad.state["policies"]["policy-0001"]["Rules"] = 'namespace "default" { policy = "write" }'
+    nomad.state["namespaces"].pop("namespace-0002")
+    nomad.state["scheduler"]["SchedulerAlgorithm"] = "spread"
+    consul.state["intentions"][("service-0003", "web")]["Action"] = "deny"
+    drift_args["desired"]["consul"]["acl_tokens"][4]["policies"] = [dict(name="policy-0005")]
+
+    result = call_module("hashicorp_drift", drift_args)
+    assert result["changed"] is False
+    assert result["drift"] is True
+    assert result["summary"]["drifted"] == 4
+    assert result["summary"]["missing"] == 1
+    assert by_status(result, "missing") == [("nomad", "namespaces", "namespace-0002")]
+    assert by_status(result, "drifted") == [
+        ("consul", "acl_tokens", "token 0004"),
+        ("consul", "intentions", "service-0003 -> web"),
+        ("nomad", "acl_policies", "policy-0001"),
+        ("nomad", "scheduler", "scheduler"),
+    ]
+    assert result["diff"]["before"] == {
+        "nomad.namespaces[namespace-0002]": None,
+        "nomad.acl_policies[policy-0001].Rules": 'namespace "default" { policy = "write" }',
+        "nomad.scheduler[scheduler].SchedulerAlgorithm": "spread",
+        "consul.acl_tokens[token 0004].Policies[Name=policy-0005]": None,
+        "consul.intentions[service-0003 -> web].Action": "deny",
+    }
+    assert result["diff"]["after"]["nomad.scheduler[scheduler].SchedulerAlgorithm"] == "binpack"
+
+    drift_args["fail_on_drift"] = True
+    result = call_module("hashicorp_drift", drift_args)
+    assert result["failed"]
+    assert result["msg"] == "drift detected: 4 drifted and 1 missing of %d declared objects" % (
+        result["summary"]["declared"]
+    )
+
+
+def test_drift_unmanaged(nomad, consul):
+    args = dict(
+        nomad_url=nomad.url,
+        nomad_token=NOMAD_TOKEN,
+        desired=dict(
+            nomad=dict(namespaces=[dict(name="default")] + [dict(name="namespace-%04d" % i) for i in range(3)])
+        ),
+        report_unmanaged=True,
+    )
+    consul.reset_stats()
+    result = call_module("hashicorp_drift", args)
+    assert result["drift"] is False
+    assert result["summary"]["unmanaged"] == nomad.payload_size - 3
+    assert by_status(result, "unmanaged")[0] == ("nomad", "namespaces", "namespace-0003")
+    # consul has nothing declared, it is not asked
+    assert consul.requests == []
+
+
+def test_drift_consul_tokens_by_accessor_id(consul):
+    # a second token with the description of another one, and tokens without a description
+    token = consul.state["tokens"][fake_id("consul-token", "token 0004")]
+    other = dict(token, AccessorID=fake_id("other"), Policies=[dict(Name="policy-0005")])
+    consul.state["tokens"][other["AccessorID"]] = other
+    for i in range(2):
+        consul.add_token("token %d" % i)["Description"] = ""
+    args = dict(
+        consul_url=consul.url,
+        consul_token=CONSUL_TOKEN,
+        desired=dict(consul=dict(acl_tokens=[dict(description="token 0004", policies=[dict(name="policy-0004")])])),
+        report_unmanaged=True,
+    )
+    result = call_module("hashicorp_drift", args)
+    assert result["failed"]
+    assert result[
+        "msg"
+    ] == "consul acl_tokens token 0004 matches 2 objects, declare the ID of the one meant: %s" % ", ".join(
+        sorted([token["AccessorID"], other["AccessorID"]])
+    )
+
+    args["desired"]["consul"]["acl_tokens"] = [
+        dict(description="token 0004", accessor_id=token["AccessorID"], policies=[dict(name="policy-0004")]),
+        dict(description="token 0004", accessor_id=other["AccessorID"], policies=[dict(name="policy-0004")]),
+    ]
+    result = call_module("hashicorp_drift", args)
+    assert result["summary"]["in_sync"] == 1
+    assert by_status(result, "drifted") == [("consul", "acl_tokens", other["AccessorID"])]
+    # every token that is not declared, none of them collapsed into another
+    assert result["summary"]["unmanaged"] == len(consul.state["tokens"]) - 2
+    unmanaged = [o["id"] for o in result["objects"] if o["status"] == "unmanaged"]
+    assert len(set(unmanaged)) == len(unmanaged)
+
+
+def test_drift_nomad_tokens_by_accessor_id(nomad):
+    # nomad token names are not unique either
+    token = nomad.state["tokens"][fake_id("nomad-token", "token-0004")]
+    other = dict(token, AccessorID=fake_id("other"), Policies=["policy-0005"])
+    nomad.state["tokens"][other["AccessorID"]] = other
+    args = dict(
+        nomad_url=nomad.url,
+        nomad_token=NOMAD_TOKEN,
+        desired=dict(nomad=dict(acl_tokens=[dict(name="token-0004", type="client", policies=["policy-0004"])])),
+    )
+    result = call_module("hashicorp_drift", args)
+    assert result["failed"]
+    assert result[
+        "msg"
+    ] == "nomad acl_tokens token-0004 matches 2 objects, declare the ID of the one meant: %s" % ", ".join(
+        sorted([token["AccessorID"], other["AccessorID"]])
+    )
+
+    args["desired"]["nomad"]["acl_tokens"] = [
+        dict(name="token-0004", accessor_id=token["AccessorID"], type="client", policies=["policy-0004"]),
+        dict(name="token-0004", accessor_id=other["AccessorID"], type="client", policies=["policy-0004"]),
+    ]
+    result = call_module("hashicorp_drift", args)
+    assert result["summary"]["in_sync"] == 1
+    assert by_status(result, "drifted") == [("nomad", "acl_tokens", other["AccessorID"])]
+
+
+def test_drift_consul_intentions_in_namespaces(consul):
+    # the same source and destination names in another namespace, intentions have no ID to tell them apart
+    intention = consul.state["intentions"][("service-0001", "web")]
+    consul.state["intentions"][("service-0001", "web", "team")] = dict(intention, SourceNS="team", DestinationNS="team")
+    args = dict(
+        consul_url=consul.url,
+        consul_token=CONSUL_TOKEN,
+        desired=dict(consul=dict(intentions=[dict(source="service-0001", destination="web", action="allow")])),
+    )
+    result = call_module("hashicorp_drift", args)
+    assert result["failed"]
+    assert result["msg"] == "consul intentions service-0001 -> web matches 2 objects"
+
+
+def test_drift_needs_service_url(nomad, monkeypatch):
+    monkeypatch.delenv("CONSUL_HTTP_ADDR", raising=False)
+    args = dict(
+        nomad_url=nomad.url,
+        nomad_token=NOMAD_TOKEN,
+        consul_token=CONSUL_TOKEN,
+        desired=dict(consul=dict(intentions=[dict(source="api", destination="web")])),
+    )
+    result = call_module("hashicorp_drift", args)
+    assert result["failed"]
+    assert result["msg"] == "consul_url is required to compare the declared consul objects"
@@ -0,0 +1,143 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import time
+
+from ansible import constants as C
+from ansible.errors import AnsibleError
+from ansible.inventory.data import InventoryData
+from ansible.parsing.dataloader import DataLoader
+from ansible.plugins.loader import fragment_loader, inventory_loader
+from ansible.utils.plugin_docs import get_docstring
+from fake_server import CONSUL_TOKEN, NOMAD_TOKEN
+
+from plugins.inventory import hashicorp
+from plugins.module_utils import transport
+from plugins.module_utils.consul import ConsulAPI
+from plugins.module_utils.nomad import DEFAULT_PER_PAGE
+
+
+def load_plugin():
+    """sets up the plugin and its options the way the inventory plugin loader would"""
+    doc = get_docstring(hashicorp.__file__, fragment_loader)[0]
+    C.config.initialize_plugin_configuration_definitions("inventory", "hashicorp", doc["options"])
+    plugin = hashicorp.InventoryModule()
+    plugin._load_name = plugin.ansible_name = "hashicorp"
+    plugin._redirected_names = plugin.ansible_aliases = ["hashicorp"]
+    return plugin
+
+
+@pytest.fixture
+def inventory_config(tmp_path, nomad, consul):
+    def write(**options):
+        path = tmp_path / "hashicorp.yml"
+        config = dict(
+            plugin="hashicorp",
+            nomad_url=nomad.url,
+            nomad_token=NOMAD_TOKEN,
+            consul_url=consul.url,
+            consul_token=CONSUL_TOKEN,
+            cache=True,
+            cache_plugin="jsonfile",
+            cache_connection=str(tmp_path / "cache"),
+            cache_timeout=300,
+        )
+        config.update(options)
+        path.write_text("\n".join("%s: %r" % item for item in config.items()))
+        return str(path)
+
+    return write
+
+
+def load_inventory(path, cache=True):
+    transport.get_pool().close()
+    plugin = load_plugin()
+    inventory = InventoryData()
+    plugin.parse(inventory, DataLoader(), path, cache=cache)
+    try:
+        plugin.update_cache_if_changed()
+    except AttributeError:
+        # caching is disabled
+        pass
+    return inventory
+
+
+def test_inventory_groups(nomad, consul, inventory_config):
+    inventory = load_inventory(inventory_config(), cache=False)
+    size = nomad.payload_size
+    assert len(inventory.groups["nomad_clients"].hosts) == size
+    assert len(inventory.groups["nomad_pool_gpu"].hosts) == size // 5
+    assert len(inventory.groups["nomad_class_gpu"].hosts) == size // 5
+    assert len(inventory.groups["nomad_dc_dc2"].hosts) == size // 2
+    assert len(inventory.groups["consul_service_web"].hosts) == size
+    assert len(inventory.groups["consul_service_api"].hosts) == size // 5
+    assert [h.name for h in inventory.groups["consul_tag_primary"].hosts] == ["node-0000"]
+
+    # nomad and consul agree on the node names, the host vars are merged
+    host = inventory.get_host("node-0004")
+    assert host.vars["nomad_node_pool"] == "gpu"
+    assert host.vars["ansible_host"] == "10.0.0.5"
+    assert sorted(host.vars["consul_services"]) == ["api", "web"]
+
+
+def test_inventory_plugin_loader(nomad, consul, inventory_config, collection):
+    # ansible imports the plugin as part of the collection, along with the module_utils it shares with the modules
+    plugin = inventory_loader.get("%s.hashicorp" % collection)
+    path = inventory_config(plugin="%s.hashicorp" % collection)
+    assert plugin.verify_file(path)
+    inventory = InventoryData()
+    plugin.parse(inventory, DataLoader(), path, cache=False)
+    assert len(inventory.groups["nomad_clients"].hosts) == nomad.payload_size
+    assert len(inventory.groups["consul_service_web"].hosts) == consul.payload_size
+
+
+def test_inventory_filter_and_keyed_groups(nomad, consul, inventory_config):
+    path = inventory_config(
+        nomad_node_filter='NodePool == "gpu"',
+        consul_services=["api"],
+        keyed_groups=[dict(key="nomad_datacenter", prefix="datacenter")],
+    )
+    inventory = load_inventory(path, cache=False)
+    assert len(inventory.groups["nomad_clients"].hosts) == nomad.payload_size // 5
+    assert "consul_service_web" not in inventory.groups
+    assert "datacenter_dc1" in inventory.groups
+
+
+def test_inventory_services_fail(nomad, consul, inventory_config, monkeypatch):
+    get_service = ConsulAPI.get_service
+
+    def slow_get_service(api, name, **kwargs):
+        # the first service fails last
+        if name == "api":
+            time.sleep(0.1)
+        return get_service(api, name, **kwargs)
+
+    monkeypatch.setattr(ConsulAPI, "get_service", slow_get_service)
+    consul.fail_next(2, code=403, message="Permission denied", path="/v1/catalog/service/")
+    # the error of the service that failed first, the other one must not exit the process
+    with pytest.raises(AnsibleError, match="hashicorp_inventory: Not Authorized: .*/v1/catalog/service/web"):
+        load_inventory(inventory_config(consul_services=["api", "web"]), cache=False)
+
+
+def test_inventory(benchmark, nomad, consul, inventory_config):
+    path = inventory_config(cache=False)
+    load_inventory(path)
+    # every page of nomad nodes, then the consul nodes, the services and one request per service
+    assert len(nomad.requests) == -(-nomad.payload_size // DEFAULT_PER_PAGE)
+    assert len(consul.requests) == 4
+    benchmark.pedantic(load_inventory, args=(path,), rounds=5, iterations=1)
+
+
+def test_inventory_cached(benchmark, nomad, consul, inventory_config):
+    path = inventory_config()
+    # a refresh (cache=False) fetches everything and writes the cache
+    load_inventory(path, cache=False)
+    nomad.reset_stats()
+    consul.reset_stats()
+    inventory = benchmark.pedantic(load_inventory, args=(path,), rounds=10, iterations=1)
+    assert len(inventory.groups["nomad_clients"].hosts) == nomad.payload_size
+    assert nomad.requests == consul.requests == []
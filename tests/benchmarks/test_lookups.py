@@ -0,0 +1,202 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+import time
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from ansible import constants as C
+from ansible.errors import AnsibleError
+from ansible.plugins.loader import fragment_loader, lookup_loader
+from ansible.utils.plugin_docs import get_docstring
+from fake_server import CONSUL_TOKEN, NOMAD_TOKEN
+
+from plugins.lookup import consul_kv, nomad_var
+from plugins.module_utils import transport
+from plugins.module_utils.consul import ConsulAPI
+from plugins.module_utils.nomad import NomadAPI
+
+
+def load_lookup(module):
+    """sets up the lookup and its options the way the lookup plugin loader would"""
+    name = module.__name__.rsplit(".", 1)[-1]
+    doc = get_docstring(module.__file__, fragment_loader)[0]
+    C.config.initialize_plugin_configuration_definitions("lookup", name, doc["options"])
+    plugin = module.LookupModule()
+    plugin._load_name = plugin.ansible_name = name
+    plugin._redirected_names = plugin.ansible_aliases = [name]
+    return plugin
+
+
+@pytest.fixture(autouse=True)
+def _fresh_process():
+    """every test starts like a new worker process, without memoized values or pooled connections"""
+    consul_kv._memo.clear()
+    nomad_var._memo.clear()
+    transport.get_pool().close()
+
+
+@pytest.fixture
+def kv_lookup(consul):
+    def lookup(*terms, **kwargs):
+        kwargs.setdefault("url", consul.url)
+        kwargs.setdefault("token", CONSUL_TOKEN)
+        return load_lookup(consul_kv).run(list(terms), variables={}, **kwargs)
+
+    return lookup
+
+
+@pytest.fixture
+def var_lookup(nomad):
+    def lookup(*terms, **kwargs):
+        kwargs.setdefault("url", nomad.url)
+        kwargs.setdefault("token", NOMAD_TOKEN)
+        return load_lookup(nomad_var).run(list(terms), variables={}, **kwargs)
+
+    return lookup
+
+
+def test_consul_kv_batched(consul, kv_lookup):
+    keys = ["config/app/key-%04d" % i for i in range(10)]
+    consul.reset_stats()
+    assert kv_lookup(*keys + ["config/app/missing"]) == ["value-%04d" % i for i in range(10)] + [None]
+    # the keys share a folder, which is read at once
+    assert consul.requests == [("GET", "/v1/kv/config/app/?recurse=")]
+
+    consul.reset_stats()
+    assert kv_lookup("config/app/key-0003", "config/app/missing", default="n/a") == ["value-0003", "n/a"]
+    assert consul.requests == []
+
+
+def test_consul_kv_one_key_at_a_time(consul, kv_lookup):
+    consul.add_kv("other", "other")
+    consul.reset_stats()
+    values = [kv_lookup("config/app/key-%04d" % i)[0] for i in range(consul.payload_size)]
+    assert values == ["value-%04d" % i for i in range(consul.payload_size)]
+    # two keys are read on their own, the third lookup reads the folder
+    assert [path for _, path in consul.requests] == [
+        "/v1/kv/config/app/key-0000",
+        "/v1/kv/config/app/key-0001",
+        "/v1/kv/config/app/?recurse=",
+    ]
+
+    # folders at the top are never read at once
+    assert kv_lookup("other", "missing", "missing-too") == ["other", None, None]
+    assert len(consul.requests) == 6
+
+
+def test_consul_kv_prefix(consul, kv_lookup):
+    consul.add_kv("config/app/db/host", "db.service.consul")
+    consul.add_kv("config/app/db/flag", None)
+    consul.reset_stats()
+    values = kv_lookup("db/host", "db/flag", "db/port", "key-0001", prefix="config/app", default="5432")
+    assert values == ["db.service.consul", "", "5432", "value-0001"]
+    assert consul.requests == [("GET", "/v1/kv/config/app/?recurse=")]
+
+
+def test_consul_kv_stale(consul, kv_lookup):
+    consul.reset_stats()
+    assert kv_lookup("config/app/key-0000", consistency="stale", datacenter="dc1") == ["value-0000"]
+    assert consul.requests == [("GET", "/v1/kv/config/app/key-0000?dc=dc1&stale=")]
+
+
+def test_consul_kv_not_authorized(consul, kv_lookup):
+    with pytest.raises(AnsibleError, match="consul_kv: Not Authorized"):
+        kv_lookup("config/app/key-0000", token="not-a-token")
+
+
+def slow_first(monkeypatch, cls, name, first):
+    """makes the reads of first finish last"""
+    method = getattr(cls, name)
+
+    def slow(api, path, *args, **kwargs):
+        if path.startswith(first):
+            time.sleep(0.1)
+        return method(api, path, *args, **kwargs)
+
+    monkeypatch.setattr(cls, name, slow)
+
+
+def test_consul_kv_reads_fail(consul, kv_lookup, monkeypatch):
+    # folders are read in order, the key at the root comes first
+    slow_first(monkeypatch, ConsulAPI, "get_kv", "other")
+    consul.fail_next(2, code=403, message="Permission denied", path="/v1/kv/")
+    # the error of the read that failed first, the other one must not exit the process
+    with pytest.raises(AnsibleError, match="consul_kv: Not Authorized: .*/v1/kv/config/app/key-0000"):
+        kv_lookup("config/app/key-0000", "other")
+
+
+def test_consul_kv_template(benchmark, consul, kv_lookup):
+    """rendering a template with a lookup per key"""
+    keys = ["config/app/key-%04d" % i for i in range(consul.payload_size)]
+
+    def render():
+        consul_kv._memo.clear()
+        return [kv_lookup(key)[0] for key in keys]
+
+    consul.reset_stats()
+    render()
+    benchmark.extra_info.update(requests=len(consul.requests), payload_size=consul.payload_size)
+    assert len(consul.requests) == 3
+    benchmark.pedantic(render, rounds=10, iterations=1)
+
+
+def test_nomad_var(nomad, var_lookup):
+    nomad.reset_stats()
+    values = var_lookup("nomad/jobs/job-0000", "nomad/jobs/job-0001", "nomad/jobs/job-0000", "nomad/jobs/missing")
+    assert values == [
+        dict(password="secret-0000", user="user-0000"),
+        dict(password="secret-0001", user="user-0001"),
+        dict(password="secret-0000", user="user-0000"),
+        None,
+    ]
+    # one request per variable
+    assert sorted(path for _, path in nomad.requests) == [
+        "/v1/var/nomad/jobs/job-0000?namespace=default",
+        "/v1/var/nomad/jobs/job-0001?namespace=default",
+        "/v1/var/nomad/jobs/missing?namespace=default",
+    ]
+
+    nomad.reset_stats()
+    values = var_lookup("nomad/jobs/job-0001", "nomad/jobs/missing", item="password", default="")
+    assert values == ["secret-0001", ""]
+    assert nomad.requests == []
+
+
+def test_nomad_var_namespace(nomad, var_lookup):
+    nomad.add_variable("nomad/jobs/web", dict(password="web"), namespace="web")
+    assert var_lookup("nomad/jobs/web", item="password") == [None]
+    assert var_lookup("nomad/jobs/web", item="password", namespace="web") == ["web"]
+
+
+def test_lookup_plugin_loader(nomad, consul, collection):
+    # ansible imports the lookups as part of the collection, along with the module_utils they share with the modules
+    kv = lookup_loader.get("%s.consul_kv" % collection)
+    assert kv.run(["config/app/key-0001"], variables={}, url=consul.url, token=CONSUL_TOKEN) == ["value-0001"]
+    var = lookup_loader.get("%s.nomad_var" % collection)
+    values = var.run(["nomad/jobs/job-0001"], variables={}, url=nomad.url, token=NOMAD_TOKEN, item="user")
+    assert values == ["user-0001"]
+
+
+def test_nomad_var_reads_fail(nomad, var_lookup, monkeypatch):
+    slow_first(monkeypatch, NomadAPI, "get_variable", "nomad/jobs/job-0000")
+    nomad.fail_next(2, code=403, message="Permission denied", path="/v1/var/")
+    with pytest.raises(AnsibleError, match="nomad_var: Not Authorized: .*/v1/var/nomad/jobs/job-0001"):
+        var_lookup("nomad/jobs/job-0000", "nomad/jobs/job-0001")
+
+
+def test_nomad_var_template(benchmark, nomad, var_lookup):
+    """rendering a template with a lookup per item"""
+    paths = ["nomad/jobs/job-%04d" % i for i in range(nomad.payload_size)]
+
+    def render():
+        nomad_var._memo.clear()
+        return [var_lookup(path, item=item)[0] for path in paths for item in ("user", "password")]
+
+    nomad.reset_stats()
+    render()
+    benchmark.extra_info.update(requests=len(nomad.requests), payload_size=nomad.payload_size)
+    assert len(nomad.requests) == nomad.payload_size
+    benchmark.pedantic(render, rounds=10, iterations=1)
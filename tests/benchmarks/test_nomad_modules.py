@@ -0,0 +1,608 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from conftest import call_module
+from fake_server import NOMAD_TOKEN, fake_id
+
+from plugins.module_utils import instrumentation
+from plugins.module_utils.nomad import DEFAULT_PER_PAGE, NomadAPI
+from plugins.plugin_utils.api import ModuleShim, api_params
+
+JOB_HCL = """
+job "web" {
+  datacenters = ["dc1"]
+  group "web" {
+    task "nginx" {
+      driver = "docker"
+      config {
+        image = "nginx:1.25"
+      }
+    }
+  }
+}
+"""
+
+
+def pages(items, per_page=DEFAULT_PER_PAGE):
+    return max(1, -(-items // per_page))
+
+
+def test_nomad_acl_bootstrap(run_module, nomad, nomad_args):
+    run = run_module("nomad_acl_bootstrap", nomad_args, nomad)
+    assert run.result["changed"] is False
+    assert run.requests == 1
+    assert run.connections == 1
+
+
+def test_nomad_acl_bootstrap_initial(run_module, nomad, nomad_args):
+    def setup():
+        nomad.reset()
+        nomad.state["bootstrapped"] = False
+
+    run = run_module("nomad_acl_bootstrap", nomad_args, nomad, setup=setup)
+    assert run.result["changed"] is True
+    assert run.requests == 2
+    assert run.connections == 1
+
+
+def test_nomad_acl_policy_create(run_module, nomad, nomad_args):
+    args = dict(nomad_args, name="new-policy", rules='namespace "default" { policy = "write" }')
+    run = run_module("nomad_acl_policy", args, nomad, setup=nomad.reset)
+    assert run.result["changed"] is True
+    assert run.requests == 3
+    assert run.connections == 1
+
+
+def test_nomad_acl_token_unchanged(run_module, nomad, nomad_args):
+    args = dict(nomad_args, name="Bootstrap Token", type="management")
+    run = run_module("nomad_acl_token", args, nomad)
+    assert run.result["changed"] is False
+    # the listing is filtered by name on the server, then the full token is read
+    assert run.requests == 2
+    assert run.connections == 1
+
+
+def test_nomad_acl_token_create(run_module, nomad, nomad_args):
+    args = dict(nomad_args, name="new-token", type="management")
+    run = run_module("nomad_acl_token", args, nomad, setup=nomad.reset)
+    assert run.result["changed"] is True
+    assert run.requests == 2
+    assert run.connections == 1
+
+
+def test_nomad_acl_tokens(run_module, nomad, nomad_args):
+    size = nomad.payload_size
+    tokens = [dict(name="token-%04d" % i, policies=["policy-%04d" % i]) for i in range(size // 2)]
+    tokens += [dict(name="token-%04d" % i, state="absent") for i in range(size // 2, size // 2 + 5)]
+    tokens += [dict(name="new-token-%02d" % i, policies=["policy-0000"]) for i in range(10)]
+    args = dict(nomad_args, tokens=tokens, max_concurrency=4)
+
+    run = run_module("nomad_acl_tokens", args, nomad, setup=nomad.reset)
+    actions = [token["action"] for token in run.result["tokens"]]
+    assert actions.count("unchanged") == size // 2
+    assert actions.count("deleted") == min(5, size - size // 2)
+    assert actions.count("created") == 10
+    # a single (paginated) listing of every token, then one request per write
+    assert run.requests == pages(size + 1) + actions.count("deleted") + 10
+    assert run.connections <= 1 + 4
+
+
+def test_nomad_csi_volume_unchanged(run_module, nomad, nomad_args):
+    args = dict(
+        nomad_args,
+        id="volume-0000",
+        name="volume-0000",
+        plugin_id="hostpath",
+        capabilities=[dict(access_mode="single-node-writer", attachment_mode="file-system")],
+        capacity_gb=1,
+    )
+    run = run_module("nomad_csi_volume", args, nomad)
+    assert run.result["changed"] is False
+    assert run.result["mismatched"] is False
+    assert run.requests == 1
+
+
+def test_nomad_csi_volume_create(run_module, nomad, nomad_args):
+    args = dict(
+        nomad_args,
+        id="new-volume",
+        name="new-volume",
+        plugin_id="hostpath",
+        capabilities=[dict(access_mode="single-node-writer", attachment_mode="file-system")],
+        capacity_gb=1,
+    )
+    run = run_module("nomad_csi_volume", args, nomad, setup=nomad.reset)
+    assert run.result["changed"] is True
+    assert run.requests == 2
+    assert run.connections == 1
+
+
+def test_nomad_job_create(run_module, nomad, nomad_args):
+    args = dict(nomad_args, hcl_spec=JOB_HCL, wait_for_deployment=True, parse_cache=False)
+    run = run_module("nomad_job", args, nomad, setup=nomad.reset)
+    assert run.result["changed"] is True
+    assert run.result["deployment"]["status"] == "successful"
+    # parse, read, plan, submit, then follow the evaluation and the deployment
+    assert run.requests == 6
+    assert run.connections == 1
+
+
+def test_nomad_job_create_parse_cached(run_module, nomad, nomad_args):
+    args = dict(nomad_args, hcl_spec=JOB_HCL, wait_for_deployment=True)
+    assert call_module("nomad_job", args)["parse_cached"] is False
+    run = run_module("nomad_job", args, nomad, setup=nomad.reset)
+    assert run.result["changed"] is True
+    assert run.result["parse_cached"] is True
+    # the setup resets the server, so the job is new on every run
+    assert run.requests == 5
+
+
+def test_nomad_job_unchanged(run_module, nomad, nomad_args):
+    args = dict(nomad_args, hcl_spec=JOB_HCL)
+    assert call_module("nomad_job", args)["changed"] is True
+    run = run_module("nomad_job", args, nomad)
+    assert run.result["changed"] is False
+    assert run.result["plan_skipped"] is True
+    # the parse is cached, then the job and its submission are read without planning
+    assert run.requests == 2
+
+
+def test_nomad_job_unchanged_without_submission(run_module, nomad, nomad_args):
+    args = dict(nomad_args, hcl_spec=JOB_HCL)
+    call_module("nomad_job", args)
+    nomad.state["submissions"].clear()
+    run = run_module("nomad_job", args, nomad)
+    assert run.result["changed"] is False
+    assert "plan_skipped" not in run.result
+    assert run.requests == 3
+
+
+def test_nomad_job_parse(run_module, nomad, nomad_args):
+    run = run_module("nomad_job_parse", dict(nomad_args, hcl_spec=JOB_HCL, parse_cache=False), nomad)
+    assert run.result["parsed"]["ID"] == "web"
+    assert len(run.result["parsed"]["TaskGroups"]) == nomad.payload_size
+    assert run.requests == 1
+
+
+def test_nomad_job_parse_cached(run_module, nomad, nomad_args):
+    args = dict(nomad_args, hcl_spec=JOB_HCL)
+    # the first parse also looks up the server version
+    assert call_module("nomad_job_parse", args)["cached"] is False
+    assert [path.split("?")[0] for method, path in nomad.requests] == ["/v1/agent/self", "/v1/jobs/parse"]
+
+    run = run_module("nomad_job_parse", args, nomad)
+    assert run.result["cached"] is True
+    assert len(run.result["parsed"]["TaskGroups"]) == nomad.payload_size
+    assert run.requests == 0
+
+
+def test_nomad_job_parse_cache_unknown_version(nomad, nomad_args, tmp_path):
+    args = dict(nomad_args, hcl_spec=JOB_HCL, parse_cache_dir=str(tmp_path))
+    # without the server version a cached job could be from before an upgrade, so it is parsed every time
+    for _ in range(2):
+        nomad.reset_stats()
+        nomad.fail_next(1, code=403, message="Permission denied")
+        assert call_module("nomad_job_parse", args)["cached"] is False
+        assert [path.split("?")[0] for method, path in nomad.requests] == ["/v1/agent/self", "/v1/jobs/parse"]
+
+
+def test_nomad_namespace_unchanged(run_module, nomad, nomad_args):
+    args = dict(nomad_args, name="namespace-0000", description="namespace 0")
+    run = run_module("nomad_namespace", args, nomad)
+    assert run.result["changed"] is False
+    assert run.requests == 1
+
+
+def test_nomad_scheduler_unchanged(run_module, nomad, nomad_args):
+    run = run_module("nomad_scheduler", dict(nomad_args, preemption_config={}), nomad)
+    assert run.result["changed"] is False
+    assert run.requests == 1
+
+
+@pytest.mark.parametrize(
+    "name, args, before, after",
+    [
+        (
+            "nomad_namespace",
+            dict(name="new-namespace", description="new"),
+            {},
+            dict(Name="new-namespace", Description="new"),
+        ),
+        (
+            "nomad_namespace",
+            dict(name="namespace-0000", state="absent"),
+            dict(Name="namespace-0000", Description="namespace 0"),
+            {},
+        ),
+        (
+            "nomad_acl_policy",
+            dict(name="policy-0000", rules='namespace "default" { policy = "write" }'),
+            dict(Rules='namespace "default" { policy = "read" }'),
+            dict(Rules='namespace "default" { policy = "write" }'),
+        ),
+        (
+            "nomad_acl_token",
+            dict(name="token-0000", policies=["policy-0001"]),
+            {"Policies[0]": None},
+            {"Policies[0]": "policy-0001"},
+        ),
+        (
+            "nomad_scheduler",
+            dict(scheduler_algorithm="spread", preemption_config={}),
+            dict(SchedulerAlgorithm="binpack"),
+            dict(SchedulerAlgorithm="spread"),
+        ),
+        (
+            "nomad_csi_volume",
+            dict(
+                id="new-volume",
+                name="new-volume",
+                plugin_id="hostpath",
+                capabilities=[dict(access_mode="single-node-writer", attachment_mode="file-system")],
+                capacity_gb=1,
+            ),
+            {},
+            dict(ID="new-volume", PluginID="hostpath"),
+        ),
+    ],
+)
+def test_nomad_check_mode(nomad, nomad_args, name, args, before, after):
+    nomad.reset_stats()
+    result = call_module(name, dict(nomad_args, _ansible_check_mode=True, **args))
+    assert result["changed"] is True
+    for diff, expected in ((result["diff"]["before"], before), (result["diff"]["after"], after)):
+        assert dict((key, diff.get(key)) for key in expected) == expected
+    # a dry run only costs the reads
+    assert set(method for method, _ in nomad.requests) == {"GET"}
+
+    # the real run changes what the dry run reported
+    result = call_module(name, dict(nomad_args, **args))
+    assert result["changed"] is True
+    assert call_module(name, dict(nomad_args, _ansible_check_mode=True, **args))["changed"] is False
+
+
+def test_nomad_acl_tokens_check_mode(nomad, nomad_args):
+    tokens = [dict(name="token-0000", state="absent"), dict(name="new-token", policies=["policy-0000"])]
+    nomad.reset_stats()
+    result = call_module("nomad_acl_tokens", dict(nomad_args, tokens=tokens, _ansible_check_mode=True))
+    assert result["changed"] is True
+    assert [token["action"] for token in result["tokens"]] == ["deleted", "created"]
+    assert result["diff"]["before"]["token-0000.Name"] == "token-0000"
+    assert "token-0000.SecretID" not in result["diff"]["before"]
+    assert result["diff"]["after"]["new-token.Policies"] == ["policy-0000"]
+    assert set(method for method, _ in nomad.requests) == {"GET"}
+
+
+def test_nomad_wait(run_module, nomad, nomad_args):
+    args = dict(nomad_args, type="volume", id="volume-0000", conditions=dict(Schedulable=True))
+    run = run_module("nomad_wait", args, nomad)
+    assert run.result["object"]["ID"] == "volume-0000"
+    assert run.requests == 1
+
+
+def test_nomad_wait_absent(run_module, nomad, nomad_args):
+    args = dict(nomad_args, type="allocation", id=fake_id("missing"), state="absent")
+    run = run_module("nomad_wait", args, nomad)
+    assert run.result["object"] is None
+    assert run.requests == 1
+
+
+def test_nomad_wait_until_without_index(nomad, monkeypatch):
+    api = NomadAPI(ModuleShim("test", api_params(nomad.url, NOMAD_TOKEN), None))
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    # the index header of every read, a proxy strips some of them
+    headers = [None, None, 5, None, None]
+    reads = []
+
+    def read(index, wait, return_meta):
+        reads.append(index)
+        return len(reads), dict(index=headers[len(reads) - 1])
+
+    assert api.wait_until(read, lambda result: result == 5, timeout=60) == (5, None, True)
+    # without an index the reads do not block and back off, once there is one they keep blocking on it
+    assert reads == [0, 0, 0, 5, 5]
+    assert sleeps == [1, 2]
+
+
+def test_nomad_namespace_retries(run_module, nomad, nomad_args):
+    def setup():
+        nomad.reset()
+        nomad.fail_next(2)
+
+    args = dict(nomad_args, name="namespace-0000", description="namespace 0", retry_backoff=0)
+    run = run_module("nomad_namespace", args, nomad, setup=setup)
+    assert run.result["changed"] is False
+    assert run.requests == 3
+    assert run.connections == 1
+
+
+def test_nomad_acl_token_create_is_not_retried(nomad, nomad_args):
+    nomad.fail_next(1, method="POST")
+    result = call_module("nomad_acl_token", dict(nomad_args, name="new-token", type="management", retry_backoff=0))
+    assert result["failed"] is True
+    assert "status=500" in result["msg"]
+    assert len(nomad.requests) == 2
+
+
+def test_nomad_failover(run_module, nomad, nomad_args):
+    # nothing listens on port 1, the request fails over to the next server
+    args = dict(nomad_args, url="http://127.0.0.1:1", failover_urls=[nomad.url], retry_backoff=0)
+    run = run_module("nomad_namespace", dict(args, name="namespace-0000", description="namespace 0"), nomad)
+    assert run.result["changed"] is False
+    assert run.requests == 1
+
+
+def test_nomad_job_create_metrics(run_module, nomad, nomad_args, monkeypatch, tmp_path):
+    metrics_file = tmp_path / "metrics.jsonl"
+    monkeypatch.setattr(instrumentation, "SUMMARY_ENABLED", True)
+    monkeypatch.setattr(instrumentation, "METRICS_FILE", str(metrics_file))
+
+    args = dict(nomad_args, hcl_spec=JOB_HCL, wait_for_deployment=True, parse_cache=False)
+    run = run_module("nomad_job", args, nomad, setup=nomad.reset, rounds=1)
+    metrics = run.result["metrics"]
+    assert metrics["requests"] == run.requests == 6
+    assert metrics["connections"] == 1
+    assert set(e["endpoint"] for e in metrics["endpoints"]) == {
+        "/v1/jobs/parse",
+        "/v1/job/{id}",
+        "/v1/job/{id}/plan",
+        "/v1/evaluation/{id}",
+        "/v1/deployment/{id}",
+    }
+    # the traced run and the benchmarked run both append their requests
+    lines = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    assert len(lines) == 12
+    assert lines[0]["reused"] is False and lines[0]["connect"] is not None
+    assert all(line["reused"] for line in lines[1:6])
+
+
+def stack(count):
+    """a stack of jobs, every fifth job depends on the one before it"""
+    jobs = []
+    for i in range(count):
+        depends_on = ["app-%02d" % (i - 1)] if i % 5 == 4 else []
+        jobs.append(dict(hcl_spec=JOB_HCL.replace('"web"', '"app-%02d"' % i, 1), depends_on=depends_on))
+    return jobs
+
+
+@pytest.mark.parametrize("submit_order", ["sequential", "parallel"])
+def test_nomad_jobs_create(run_module, nomad, nomad_args, submit_order):
+    args = dict(nomad_args, jobs=stack(20), submit_order=submit_order, max_concurrency=4, parse_cache=False)
+    run = run_module("nomad_jobs", args, nomad, setup=nomad.reset)
+    assert run.result["changed"] is True
+    assert [job["id"] for job in run.result["jobs"]] == ["app-%02d" % i for i in range(20)]
+    assert all(job["changed"] for job in run.result["jobs"])
+    # parse, read and plan every job, then submit it
+    assert run.requests == 20 * 4
+    assert run.connections <= 1 + 4
+
+
+def test_nomad_jobs_unchanged(run_module, nomad, nomad_args):
+    args = dict(nomad_args, jobs=stack(20), max_concurrency=4)
+    assert call_module("nomad_jobs", args)["changed"] is True
+    run = run_module("nomad_jobs", args, nomad)
+    assert run.result["changed"] is False
+    assert all(job["plan_skipped"] and job["parse_cached"] for job in run.result["jobs"])
+    # every job and its submission are read, nothing is parsed or planned
+    assert run.requests == 20 * 2
+
+
+def test_nomad_jobs_dependency_order(nomad, nomad_args):
+    jobs = stack(3)
+    jobs[0]["depends_on"] = ["app-02"]
+    result = call_module("nomad_jobs", dict(nomad_args, jobs=jobs, wait_for_deployment=True))
+    assert result["changed"] is True
+    assert all(job["deployment"]["status"] == "successful" for job in result["jobs"])
+    submits = [path.split("?")[0] for method, path in nomad.requests if method == "POST" and "/v1/job/" in path]
+    submits = [path for path in submits if not path.endswith("/plan")]
+    assert submits == ["/v1/job/app-01", "/v1/job/app-02", "/v1/job/app-00"]
+
+
+def test_nomad_jobs_namespaces(nomad, nomad_args):
+    # the same job in two namespaces, depends_on names the job of its own namespace
+    jobs = stack(2) + [dict(job, namespace="namespace-0000") for job in stack(2)]
+    jobs[0]["depends_on"] = ["app-01"]
+    result = call_module("nomad_jobs", dict(nomad_args, jobs=jobs))
+    assert result["changed"] is True
+    assert [(job["namespace"], job["id"]) for job in result["jobs"]] == [
+        ("default", "app-00"),
+        ("default", "app-01"),
+        ("namespace-0000", "app-00"),
+        ("namespace-0000", "app-01"),
+    ]
+    submits = [
+        (path.split("?")[0], path.split("namespace=")[-1].split("&")[0])
+        for method, path in nomad.requests
+        if method == "POST" and path.startswith("/v1/job/app") and "/plan" not in path
+    ]
+    assert submits.index(("/v1/job/app-01", "default")) < submits.index(("/v1/job/app-00", "default"))
+
+
+def test_nomad_jobs_duplicate(nomad, nomad_args):
+    jobs = stack(1) + [dict(stack(1)[0], namespace="default")]
+    result = call_module("nomad_jobs", dict(nomad_args, jobs=jobs))
+    assert result["failed"] is True
+    assert result["msg"] == "duplicate nomad job in jobs: app-00 in namespace default"
+
+
+def test_nomad_jobs_dependency_cycle(nomad, nomad_args):
+    jobs = stack(2)
+    jobs[0]["depends_on"] = ["app-01"]
+    jobs[1]["depends_on"] = ["app-00"]
+    result = call_module("nomad_jobs", dict(nomad_args, jobs=jobs))
+    assert result["failed"] is True
+    assert "cycle" in result["msg"]
+    # the jobs were planned, but none of them was submitted
+    assert not [
+        path
+        for method, path in nomad.requests
+        if method == "POST" and path.startswith("/v1/job/app") and "/plan" not in path
+    ]
+
+
+def read_snapshot(path):
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+def replay_snapshot(path):
+    """the objects of a snapshot, later records win and deleted ones are dropped"""
+    objects = {}
+    for record in read_snapshot(path):
+        if record.get("deleted"):
+            objects.pop(record["key"], None)
+        else:
+            objects[record["key"]] = record["object"]
+    return objects
+
+
+@pytest.fixture
+def snapshot_args(nomad, nomad_args, tmp_path):
+    for i in range(20):
+        nomad.add_job("job-%04d" % i, namespace="namespace-%04d" % (i % 4))
+    return dict(nomad_args, dest=str(tmp_path / "nomad.jsonl.gz"))
+
+
+def snapshot_sizes(nomad):
+    state = nomad.state
+    return dict(
+        namespaces=len(state["namespaces"]),
+        acl_policies=len(state["policies"]),
+        acl_tokens=len(state["tokens"]),
+        jobs=len(state["jobs"]),
+        csi_volumes=len(state["volumes"]),
+    )
+
+
+def test_nomad_snapshot_export(run_module, nomad, snapshot_args):
+    run = run_module("nomad_snapshot_export", snapshot_args, nomad)
+    sizes = snapshot_sizes(nomad)
+    assert dict((name, counts["exported"]) for name, counts in run.result["objects"].items()) == sizes
+    # every listing, then the policies, jobs and volumes one by one
+    listings = sum(pages(size) for size in sizes.values())
+    assert run.requests == listings + sizes["acl_policies"] + sizes["jobs"] + sizes["csi_volumes"]
+    assert run.connections <= 8
+
+    objects = replay_snapshot(snapshot_args["dest"])
+    assert len(objects) == sum(sizes.values())
+    assert objects["jobs/namespace-0001/job-0005"]["TaskGroups"]
+    assert objects["acl_policies/policy-0001"]["Rules"]
+    assert not any("SecretID" in obj for key, obj in objects.items() if key.startswith("acl_tokens/"))
+
+    # exporting the same objects again writes the same snapshot
+    assert call_module("nomad_snapshot_export", snapshot_args)["changed"] is False
+
+
+def test_nomad_snapshot_export_incremental(nomad, snapshot_args):
+    args = dict(snapshot_args, mode="incremental")
+    assert call_module("nomad_snapshot_export", args)["changed"] is True
+    full = replay_snapshot(args["dest"])
+
+    policy = nomad.state["policies"]["policy-0001"]
+    policy.update(Rules='namespace "default" { policy = "write" }', ModifyIndex=nomad.bump())
+    del nomad.state["volumes"][("default", "volume-0002")]
+    nomad.add_namespace("new")
+    nomad.reset_stats()
+    result = call_module("nomad_snapshot_export", args)
+    assert result["changed"] is True
+    assert result["objects"]["acl_policies"] == dict(listed=50, exported=1, unchanged=49, deleted=0)
+    assert result["objects"]["csi_volumes"]["deleted"] == 1
+    # only the changed policy is fetched
+    assert len(nomad.requests) == len(snapshot_sizes(nomad)) + 1
+
+    # the changes are appended to the snapshot
+    records = read_snapshot(args["dest"])
+    assert [record["key"] for record in records[-3:]] == [
+        "namespaces/new",
+        "acl_policies/policy-0001",
+        "csi_volumes/default/volume-0002",
+    ]
+    objects = replay_snapshot(args["dest"])
+    assert len(objects) == len(full)
+    assert "write" in objects["acl_policies/policy-0001"]["Rules"]
+
+    nomad.reset_stats()
+    result = call_module("nomad_snapshot_export", args)
+    assert result["changed"] is False
+    assert len(nomad.requests) == len(snapshot_sizes(nomad))
+
+
+def test_nomad_snapshot_export_resume(nomad, snapshot_args, monkeypatch):
+    args = dict(snapshot_args, batch_size=10, max_concurrency=1, retries=0)
+    get_csi_volume = NomadAPI.get_csi_volume
+    calls = []
+
+    def flaky_get_csi_volume(self, id, **kwargs):
+        calls.append(id)
+        if len(calls) == 31:
+            self.module.fail_json(msg="connection reset by peer")
+        return get_csi_volume(self, id, **kwargs)
+
+    monkeypatch.setattr(NomadAPI, "get_csi_volume", flaky_get_csi_volume)
+    result = call_module("nomad_snapshot_export", args)
+    assert result["failed"] is True
+    # a batch that was cut short leaves a partial gzip member behind, the snapshot is untouched
+    assert not os.path.exists(args["dest"])
+    with open(args["dest"] + ".partial", "ab") as f:
+        f.write(b"\x1f\x8b\x08\x00partial")
+
+    monkeypatch.setattr(NomadAPI, "get_csi_volume", get_csi_volume)
+    nomad.reset_stats()
+    result = call_module("nomad_snapshot_export", args)
+    assert result["resumed"] is True
+    assert result["objects"]["csi_volumes"]["exported"] == 50
+    # the types that were done are not listed again, 30 volumes were exported before
+    assert len(nomad.requests) == 1 + 20
+
+    keys = [record["key"] for record in read_snapshot(args["dest"])]
+    assert len(keys) == len(set(keys)) == sum(snapshot_sizes(nomad).values())
+
+
+def test_nomad_snapshot_export_interrupted_full(nomad, snapshot_args, monkeypatch):
+    assert call_module("nomad_snapshot_export", dict(snapshot_args, mode="incremental", types=["namespaces"]))[
+        "changed"
+    ]
+    with open(snapshot_args["dest"], "rb") as f:
+        snapshot = f.read()
+
+    # a full export writes the new snapshot next to the old one, and is interrupted
+    get_csi_volume = NomadAPI.get_csi_volume
+
+    def failing_get_csi_volume(self, id, **kwargs):
+        self.module.fail_json(msg="connection reset by peer")
+
+    monkeypatch.setattr(NomadAPI, "get_csi_volume", failing_get_csi_volume)
+    assert call_module("nomad_snapshot_export", dict(snapshot_args, batch_size=10, retries=0))["failed"] is True
+    with open(snapshot_args["dest"], "rb") as f:
+        assert f.read() == snapshot
+
+    # an incremental export appends to the old snapshot, and drops what the full export left behind
+    monkeypatch.setattr(NomadAPI, "get_csi_volume", get_csi_volume)
+    result = call_module("nomad_snapshot_export", dict(snapshot_args, mode="incremental"))
+    assert result["resumed"] is False
+    assert result["objects"]["namespaces"]["exported"] == 0
+    assert not os.path.exists(snapshot_args["dest"] + ".partial")
+    with open(snapshot_args["dest"], "rb") as f:
+        assert f.read().startswith(snapshot)
+    keys = [record["key"] for record in read_snapshot(snapshot_args["dest"])]
+    assert len(keys) == len(set(keys)) == sum(snapshot_sizes(nomad).values())
+
+
+def test_nomad_snapshot_export_full_not_moved(nomad, snapshot_args):
+    assert call_module("nomad_snapshot_export", snapshot_args)["changed"] is True
+    # the run ended after the state was saved, before the snapshot was moved onto dest
+    os.replace(snapshot_args["dest"], snapshot_args["dest"] + ".partial")
+    result = call_module("nomad_snapshot_export", dict(snapshot_args, mode="incremental"))
+    assert result["changed"] is False
+    assert not os.path.exists(snapshot_args["dest"] + ".partial")
+    assert len(replay_snapshot(snapshot_args["dest"])) == sum(snapshot_sizes(nomad).values())
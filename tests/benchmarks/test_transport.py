@@ -0,0 +1,67 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+import threading
+from http import server
+
+import pytest
+
+from plugins.module_utils import transport
+
+
+class DroppingHandler(server.BaseHTTPRequestHandler):
+    """answers the first request of a connection, and drops the connection after reading any later one"""
+
+    protocol_version = "HTTP/1.1"
+
+    def handle_request(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.received.append((self.command, body))
+        self.requests = getattr(self, "requests", 0) + 1
+        if self.requests > 1:
+            self.close_connection = True
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_GET = do_POST = do_PUT = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def dropping_server():
+    httpd = server.ThreadingHTTPServer(("127.0.0.1", 0), DroppingHandler)
+    httpd.received = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_resend_on_dropped_connection(dropping_server):
+    pool = transport.ConnectionPool()
+    url = "http://127.0.0.1:%d/v1/agent/self" % dropping_server.server_port
+    assert pool.request(url).read() == b"{}"
+    # the server read the request before dropping the connection, a GET is safely sent again
+    timings = {}
+    assert pool.request(url, timings=timings).read() == b"{}"
+    assert timings["reused"] is False
+    assert [method for method, _ in dropping_server.received] == ["GET", "GET", "GET"]
+    pool.close()
+
+
+@pytest.mark.parametrize("method", ["POST", "PUT"])
+def test_no_resend_on_dropped_connection(dropping_server, method):
+    pool = transport.ConnectionPool()
+    url = "http://127.0.0.1:%d/v1/acl/token" % dropping_server.server_port
+    assert pool.request(url, method=method, data="{}").read() == b"{}"
+    # the server may have processed it, whether to send it again is up to the RetryPolicy
+    with pytest.raises(transport.STALE_CONNECTION_ERRORS):
+        pool.request(url, method=method, data='{"Description": "once"}')
+    assert dropping_server.received == [(method, b"{}"), (method, b'{"Description": "once"}')]
+    pool.close()
@@ -0,0 +1,152 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+#
+# Benchmarks of the diff engine against the nested all(any(...)) comparison it
+# replaced, on documents shaped like the ones the modules compare.
+#
+
+import copy
+import random
+import time
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from ansible.errors import AnsibleError
+from fake_server import FakeNomad, fake_id
+
+from plugins.module_utils.utils import del_none, diff, fail_json_once, is_subset, json_body, run_concurrently
+from plugins.plugin_utils.api import ModuleShim
+
+
+def is_subset_nested(subset, superset):
+    """the previous is_subset, which compares every list item with every other"""
+    if isinstance(subset, dict):
+        return all(key in superset and is_subset_nested(val, superset[key]) for key, val in subset.items())
+    elif isinstance(subset, list):
+        return all(any(is_subset_nested(subitem, superitem) for superitem in superset) for subitem in subset)
+    else:
+        return subset == superset
+
+
+IMPLEMENTATIONS = dict(nested=is_subset_nested, keyed=is_subset)
+
+
+@pytest.fixture(scope="module")
+def job(request):
+    """a job with one task group per payload item, as nomad returns it"""
+    size = request.config.getoption("--fake-payload-size") * 4
+    fake = FakeNomad(payload_size=size)
+    return fake.job_from_hcl('job "web" {}', "default")
+
+
+@pytest.fixture(scope="module")
+def tokens(request):
+    """a token listing, every token with a few policies"""
+    size = request.config.getoption("--fake-payload-size") * 20
+    return [
+        dict(
+            AccessorID=fake_id("token", i),
+            Name="token-%04d" % i,
+            Type="client",
+            Policies=["policy-%04d" % p for p in range(i % 7, i % 7 + 5)],
+            Global=False,
+            ModifyIndex=i,
+        )
+        for i in range(size)
+    ]
+
+
+def shuffled(items):
+    items = list(items)
+    random.Random(0).shuffle(items)
+    return items
+
+
+@pytest.mark.parametrize("implementation", sorted(IMPLEMENTATIONS))
+def test_is_subset_job(benchmark, job, implementation):
+    # the desired job lists its task groups in another order, without the server side fields
+    desired = copy.deepcopy(job)
+    desired["TaskGroups"] = shuffled(dict(g, Tasks=[dict(t) for t in g["Tasks"]]) for g in desired["TaskGroups"])
+    del desired["Meta"]
+    assert benchmark(IMPLEMENTATIONS[implementation], desired, job) is True
+
+
+@pytest.mark.parametrize("implementation", sorted(IMPLEMENTATIONS))
+def test_is_subset_job_changed(benchmark, job, implementation):
+    # a change in the last task group, the comparison stops there
+    desired = copy.deepcopy(job)
+    desired["TaskGroups"][-1]["Tasks"][0]["Config"]["image"] = "nginx:1.26"
+    assert benchmark(IMPLEMENTATIONS[implementation], desired, job) is False
+
+
+@pytest.mark.parametrize("implementation", sorted(IMPLEMENTATIONS))
+def test_is_subset_tokens(benchmark, tokens, implementation):
+    desired = [dict(Name=t["Name"], Type=t["Type"], Policies=shuffled(t["Policies"])) for t in shuffled(tokens)]
+    assert benchmark(IMPLEMENTATIONS[implementation], desired, tokens) is True
+
+
+def test_diff_job(benchmark, job):
+    desired = copy.deepcopy(job)
+    desired["TaskGroups"][-1]["Count"] = 3
+    desired["TaskGroups"][0]["Tasks"][0]["Env"]["ENV_00"] = "changed"
+    desired["Datacenters"] = ["dc1", "dc2"]
+    differences = benchmark(diff, desired, job)
+    assert [d["path"] for d in differences] == [
+        "Datacenters[1]",
+        "TaskGroups[Name=group-0000].Tasks[Name=task].Env.ENV_00",
+        "TaskGroups[Name=%s].Count" % job["TaskGroups"][-1]["Name"],
+    ]
+    assert differences[0] == dict(path="Datacenters[1]", desired="dc2", existing=None)
+
+
+@pytest.mark.parametrize(
+    "subset, superset",
+    [
+        (dict(a=1), dict(a=1, b=2)),
+        (dict(a=[1, 2]), dict(a=[3, 2, 1])),
+        (dict(a=[1, 4]), dict(a=[3, 2, 1])),
+        ([dict(Name="x", v=1)], [dict(Name="x", v=2), dict(Name="x", v=1)]),
+        ([dict(ID="1")], [dict(Name="1")]),
+        ([dict(v=1)], [dict(v=2), dict(v=1, w=0)]),
+        ([[1, 2]], [[2, 1, 0]]),
+        ([], []),
+        (dict(), dict(a=1)),
+        (dict(a=dict(b=[dict(Name="n", c=[True])])), dict(a=dict(b=[dict(Name="n", c=[1])]))),
+    ],
+)
+def test_is_subset_matches_nested(subset, superset):
+    assert is_subset(subset, superset) is is_subset_nested(subset, superset)
+    assert (diff(subset, superset) == []) is is_subset_nested(subset, superset)
+
+
+def test_del_none():
+    body = dict(a=None, b=dict(c=None, d=1), e=[dict(f=None, g=2), None, 3])
+    assert del_none(body) == dict(b=dict(d=1), e=[dict(g=2), None, 3])
+    # the input is left untouched
+    assert body == dict(a=None, b=dict(c=None, d=1), e=[dict(f=None, g=2), None, 3])
+
+
+def test_json_body():
+    assert json_body(dict(b=[dict(d=None, c=1)], a=None), prune=True) == b'{"b":[{"c":1}]}'
+    assert json_body(dict(b=1, a=None)) == b'{"a":null,"b":1}'
+
+
+def test_json_body_job(benchmark, job):
+    body = dict(Job=job, Submission=dict(Format="hcl2", Source='job "web" {}', Variables=None))
+    assert benchmark(json_body, body, prune=True).startswith(b'{"Job":')
+
+
+def test_run_concurrently_fail_json_once():
+    # outside of a module fail_json raises, a worker that lost the race to fail must not exit the process
+    shim = ModuleShim("test", {}, None)
+
+    def fail(item):
+        if item == 0:
+            time.sleep(0.1)
+        fail_json_once(shim, msg="item %d failed" % item)
+
+    with pytest.raises(AnsibleError, match="test: item 1 failed"):
+        run_concurrently(fail, [0, 1], max_workers=2)